@@ -1,14 +1,11 @@
 #!/bin/sh
 python ./manage.py migrate
 
-if [ -f "./data/polls-v4.json" ]; then
-  python ./manage.py loaddata ./data/polls-v4.json
-fi
-if [ -f "./data/users.json" ]; then
-  python ./manage.py loaddata ./data/users.json
-fi
-if [ -f "./data/votes-v4.json" ]; then
-  python ./manage.py loaddata ./data/votes-v4.json
-fi
+# Hashed and pre-compressed static files
+python ./manage.py collectstatic --noinput
 
-python ./manage.py runserver 0.0.0.0:8000
\ No newline at end of file
+# Bulk loads the fixtures, skipping any that are unchanged since the last boot
+python ./manage.py load_polls_data ./data/polls-v4.json ./data/users.json ./data/votes-v4.json
+
+# Served over ASGI, so live results streams do not hold a worker thread each
+uvicorn mysite.asgi:application --host 0.0.0.0 --port 8000
\ No newline at end of file
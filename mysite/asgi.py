@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
 application = get_asgi_application()
+
+# Start the vote buffer, when enabled, so votes left in journals are written at startup.
+from polls.buffer import get_vote_buffer  # noqa: E402
+
+get_vote_buffer()
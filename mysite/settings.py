@@ -53,6 +53,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'polls.middleware.RequestTimingMiddleware',  # First, so its total covers the other middleware
+    'polls.middleware.ReadYourWritesMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -95,6 +97,66 @@ DATABASES = {
         "PORT": config("DATABASE_PORT", default="5432")
     }
 }
+# A DATABASE_URL, e.g. sqlite:///primary.sqlite3, replaces the settings above
+if config("DATABASE_URL", default=""):
+    DATABASES["default"] = db_url(config("DATABASE_URL"))
+
+# Read replicas: comma-separated database URLs. Reads of poll data are routed to them,
+# except for POLLS_READ_YOUR_WRITES_SECONDS after a client writes. Tests use the primary.
+for number, replica_url in enumerate(config("DATABASE_REPLICA_URLS", default="", cast=Csv()), start=1):
+    DATABASES[f"replica{number}"] = {**db_url(replica_url), "TEST": {"MIRROR": "default"}}
+POLLS_DATABASE_REPLICAS = [alias for alias in DATABASES if alias != "default"]
+POLLS_READ_YOUR_WRITES_SECONDS = config("POLLS_READ_YOUR_WRITES_SECONDS", default=5, cast=int)
+
+DATABASE_ROUTERS = ["polls.routers.ReplicaRouter"]
+
+# Caches
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Computed poll results; use FileBasedCache with a directory LOCATION to share between processes.
+    "polls": {
+        "BACKEND": config("POLLS_CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": config("POLLS_CACHE_LOCATION", default="polls-results"),
+        "TIMEOUT": config("POLLS_CACHE_TIMEOUT", default=300, cast=int),
+        "OPTIONS": {
+            "MAX_ENTRIES": config("POLLS_CACHE_MAX_ENTRIES", default=1000, cast=int),
+        },
+    },
+    # Sessions when SESSION_ENGINE is the cache backend; it must be shared by every process
+    "sessions": {
+        "BACKEND": config("SESSION_CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": config("SESSION_CACHE_LOCATION", default="polls-sessions"),
+        "TIMEOUT": None,  # Sessions expire by SESSION_COOKIE_AGE
+    },
+    # Rate limit buckets; like sessions, it must be shared by every process for the limits to hold
+    "ratelimit": {
+        "BACKEND": config("POLLS_RATELIMIT_CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": config("POLLS_RATELIMIT_CACHE_LOCATION", default="polls-ratelimit"),
+        "OPTIONS": {
+            "MAX_ENTRIES": config("POLLS_RATELIMIT_CACHE_MAX_ENTRIES", default=100000, cast=int),
+        },
+    },
+    # Ballot responses kept for Idempotency-Key retries. Results and page traffic cannot evict
+    # them here; it must be shared by every process, such as Redis, for retries to find them
+    "idempotency": {
+        "BACKEND": config("POLLS_IDEMPOTENCY_CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": config("POLLS_IDEMPOTENCY_CACHE_LOCATION", default="polls-idempotency"),
+        "OPTIONS": {
+            "MAX_ENTRIES": config("POLLS_IDEMPOTENCY_CACHE_MAX_ENTRIES", default=100000, cast=int),
+        },
+    },
+}
+
+# Sessions
+# https://docs.djangoproject.com/en/5.1/topics/http/sessions/
+
+# django.contrib.sessions.backends.cache or .signed_cookies keep session reads off the database
+SESSION_ENGINE = config("SESSION_ENGINE", default="django.contrib.sessions.backends.db")
+SESSION_CACHE_ALIAS = "sessions"
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -115,8 +177,68 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 AUTHENTICATION_BACKENDS = [
+    'polls.auth.CachedModelBackend',
+    # Still listed so sessions logged in before the cached backend are not logged out
     'django.contrib.auth.backends.ModelBackend',
 ]
+# Keep logged-in users in process memory for this many seconds (0 loads them on every request)
+POLLS_USER_CACHE_SECONDS = config("POLLS_USER_CACHE_SECONDS", default=0, cast=int)
+POLLS_USER_CACHE_SIZE = config("POLLS_USER_CACHE_SIZE", default=10000, cast=int)
+
+# Token-bucket rate limits as requests per s, m, h or d (empty turns a limit off):
+# votes count per logged-in user, signups per client IP
+POLLS_RATE_LIMITS = {
+    "vote": config("POLLS_VOTE_RATE_LIMIT", default="30/m"),
+    "signup": config("POLLS_SIGNUP_RATE_LIMIT", default="10/m"),
+}
+# Number of proxies in front of the app whose X-Forwarded-For entries are trusted for client IPs
+POLLS_PROXY_COUNT = config("POLLS_PROXY_COUNT", default=0, cast=int)
+
+# Number of questions shown on each page of the poll index
+POLLS_INDEX_PAGE_SIZE = config("POLLS_INDEX_PAGE_SIZE", default=20, cast=int)
+# Open questions ending within this many hours are listed under "Closing soon"
+POLLS_CLOSING_SOON_HOURS = config("POLLS_CLOSING_SOON_HOURS", default=24, cast=int)
+
+# Cache the index and results pages of anonymous visitors for up to this many seconds (0 turns it off)
+POLLS_PAGE_CACHE_TIMEOUT = config("POLLS_PAGE_CACHE_TIMEOUT", default=60, cast=int)
+
+# Write-behind vote buffer: votes are queued in process and written in batches.
+# Off by default; every vote is then written in its own transaction.
+POLLS_VOTE_BUFFER_ENABLED = config("POLLS_VOTE_BUFFER_ENABLED", default=False, cast=bool)
+POLLS_VOTE_BUFFER_SIZE = config("POLLS_VOTE_BUFFER_SIZE", default=10000, cast=int)
+POLLS_VOTE_BUFFER_BATCH_SIZE = config("POLLS_VOTE_BUFFER_BATCH_SIZE", default=500, cast=int)
+POLLS_VOTE_BUFFER_INTERVAL = config("POLLS_VOTE_BUFFER_INTERVAL", default=1.0, cast=float)
+# Append-only journal of queued votes, replayed on startup so acknowledged votes survive a crash;
+# each process writes its own file, this path with the process id appended
+POLLS_VOTE_JOURNAL = config("POLLS_VOTE_JOURNAL", default="")
+POLLS_VOTE_JOURNAL_FSYNC = config("POLLS_VOTE_JOURNAL_FSYNC", default=True, cast=bool)
+
+# Ballots: questions one ballot may answer, and how long its response is kept for
+# retries sent with the same Idempotency-Key
+POLLS_BALLOT_MAX_QUESTIONS = config("POLLS_BALLOT_MAX_QUESTIONS", default=50, cast=int)
+POLLS_BALLOT_IDEMPOTENCY_SECONDS = config("POLLS_BALLOT_IDEMPOTENCY_SECONDS", default=86400, cast=int)
+
+# Turnout rollups: rollup_votes counts votes once they are this many seconds old,
+# leaving time for the transactions that wrote them to commit
+POLLS_ROLLUP_SETTLE_SECONDS = config("POLLS_ROLLUP_SETTLE_SECONDS", default=60, cast=int)
+
+# Serve the poll pages with the async views (for ASGI deployments)
+POLLS_ASYNC_VIEWS = config("POLLS_ASYNC_VIEWS", default=False, cast=bool)
+
+# Live results over Server-Sent Events. Each stream holds its connection open, so
+# only turn this on when the site is served by the ASGI application (see entrypoint.sh);
+# requests that come over WSGI are never streamed to.
+POLLS_LIVE_RESULTS = config("POLLS_LIVE_RESULTS", default=False, cast=bool)
+POLLS_SSE_MAX_CONNECTIONS = config("POLLS_SSE_MAX_CONNECTIONS", default=1000, cast=int)
+POLLS_SSE_KEEPALIVE = config("POLLS_SSE_KEEPALIVE", default=15, cast=int)
+
+# Request timing: send a Server-Timing header with DB, render and total time, and
+# log requests slower than this many milliseconds to the polls.requests logger (0 turns it off)
+POLLS_SERVER_TIMING = config("POLLS_SERVER_TIMING", default=True, cast=bool)
+POLLS_SLOW_REQUEST_MS = config("POLLS_SLOW_REQUEST_MS", default=500, cast=int)
+
+# Client IPs allowed to scrape /metrics; everyone else gets a 404
+POLLS_METRICS_ALLOWED_IPS = config("POLLS_METRICS_ALLOWED_IPS", default="127.0.0.1,::1", cast=Csv())
 
 LOGIN_REDIRECT_URL = 'polls:index'  # After login, show list of polls
 LOGOUT_REDIRECT_URL = 'login'       # After logout, return to login page
@@ -139,11 +261,24 @@ STATIC_URL = 'static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# collectstatic writes content-hashed names plus gzip and brotli copies; serve_static
+# sends hashed names with a year-long immutable Cache-Control
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "polls.assets.CompressedManifestStaticFilesStorage",
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Log records are written by a background thread (polls.log.QueueHandler), as one JSON
+# object per line by default; set POLLS_LOG_FORMAT to simple or details for plain text
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -156,20 +291,39 @@ LOGGING = {
             'format': '{levelname} {message}',
             'style': '{',
         },
+        'json': {
+            '()': 'polls.log.JsonFormatter',
+        },
+    },
+    'filters': {
+        # Share of vote events logged below WARNING, e.g. 0.01 for one in a hundred
+        'vote_sample': {
+            '()': 'polls.log.SampleFilter',
+            'rate': config("POLLS_VOTE_LOG_SAMPLE_RATE", default=1.0, cast=float),
+        },
     },
     'handlers': {
         'console': {
             'level': 'DEBUG',
-            'class': 'logging.StreamHandler',
-            'formatter': 'simple',
+            '()': 'polls.log.QueueHandler',
+            'maxsize': config("POLLS_LOG_QUEUE_SIZE", default=10000, cast=int),
+            'formatter': config("POLLS_LOG_FORMAT", default="json"),
         },
     },
     'loggers': {
         'polls': {
             'handlers': ['console'],
-            'level': 'DEBUG',
+            'level': config("POLLS_LOG_LEVEL", default="DEBUG"),
             'propagate': False,  # Set to False to avoid duplicate logs
         },
+        # One record per vote; goes through the polls handlers
+        'polls.votes': {
+            'filters': ['vote_sample'],
+        },
+        # Slow request warnings; goes through the polls handlers
+        'polls.requests': {
+            'level': config("POLLS_REQUEST_LOG_LEVEL", default="WARNING"),
+        },
         'django': {
             'handlers': ['console'],
             'level': 'INFO',
@@ -14,13 +14,20 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import include, path
 from django.views.generic.base import RedirectView
 
+from polls.assets import serve_static
+from polls.metrics import metrics
+
 urlpatterns = [
     path("", RedirectView.as_view(url="/polls/"), name="redirect_to_polls"),
     path("polls/", include("polls.urls")),
     path("admin/", admin.site.urls),
     path('accounts/', include('django.contrib.auth.urls')),
+    path("metrics", metrics, name="metrics"),
+    # runserver serves the uncollected files itself while DEBUG is on
+    path(f"{settings.STATIC_URL.strip('/')}/<path:path>", serve_static, name="static"),
 ]
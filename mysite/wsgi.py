@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
 application = get_wsgi_application()
+
+# Start the vote buffer, when enabled, so votes left in journals are written at startup.
+from polls.buffer import get_vote_buffer  # noqa: E402
+
+get_vote_buffer()
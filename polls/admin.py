@@ -1,10 +1,63 @@
+from django import forms
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.utils.functional import cached_property
+
+from .export import export_votes
 from .models import Choice, Question, Vote
 
+# Below this many rows an exact COUNT(*) is cheap, so the estimate is not used.
+EXACT_COUNT_LIMIT = 100000
+
+
+def estimated_count(model):
+    """Return the planner's estimate of a model's row count on PostgreSQL, or None elsewhere."""
+    if connection.vendor != "postgresql":
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [model._meta.db_table])
+        row = cursor.fetchone()
+    # reltuples is -1 until the table is first analyzed.
+    return row[0] if row and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that counts an unfiltered changelist of a big table from the table statistics."""
+
+    @cached_property
+    def count(self):
+        """Return the number of objects, estimated when counting them exactly would scan a big table."""
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model)
+            if estimate is not None and estimate > EXACT_COUNT_LIMIT:
+                return estimate
+        return super().count
+
+
+class StatusListFilter(admin.SimpleListFilter):
+    """Filters questions by whether voting is open, closing soon or closed, in the database."""
+
+    title = "status"
+    parameter_name = "status"
+
+    def lookups(self, request, model_admin):
+        """Return the statuses to filter by."""
+        return [("upcoming", "Upcoming"), ("open", "Open"), ("closing_soon", "Closing soon"), ("closed", "Closed")]
+
+    def queryset(self, request, queryset):
+        """Return the questions of the chosen status."""
+        if self.value() in ("upcoming", "open", "closing_soon", "closed"):
+            return getattr(queryset, self.value())()
+        return queryset
+
 
 class ChoiceInline(admin.TabularInline):
     model = Choice
     extra = 3
+    readonly_fields = ["vote_count"]
 
 
 class QuestionAdmin(admin.ModelAdmin):
@@ -13,15 +66,89 @@ class QuestionAdmin(admin.ModelAdmin):
         ("Date information", {"fields": ["pub_date", "end_date"], "classes": ["collapse"]}),
     ]
     inlines = [ChoiceInline]
-    list_display = ["question_text", "pub_date", "end_date", "was_published_recently"]
-    list_filter = ["pub_date"]
+    list_display = ["question_text", "pub_date", "end_date", "status", "vote_count", "was_published_recently"]
+    list_filter = [StatusListFilter, "pub_date"]
     search_fields = ["question_text"]
+    actions = ["export_votes_csv"]
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
 
+    def get_queryset(self, request):
+        """Annotate each question's status, computed by the database."""
+        return super().get_queryset(request).with_status()
 
-admin.site.register(Question, QuestionAdmin)
+    @admin.display(ordering="status")
+    def status(self, question):
+        """Return whether voting on the question is upcoming, open or closed."""
+        return question.status
+
+    @admin.action(description="Export votes of selected questions as CSV")
+    def export_votes_csv(self, request, queryset):
+        """Stream the votes on the selected questions as a CSV download."""
+        response = StreamingHttpResponse(
+            export_votes(Vote.objects.filter(question__in=queryset)),
+            content_type="text/csv",
+        )
+        response["Content-Disposition"] = 'attachment; filename="votes.csv"'
+        return response
+
+
+class ChoiceAdmin(admin.ModelAdmin):
+    list_display = ["choice_text", "question", "vote_count"]
+    list_select_related = ["question"]
+    autocomplete_fields = ["question"]
+    readonly_fields = ["vote_count"]
+    search_fields = ["choice_text", "question__question_text"]
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+
+
+class VoteAdminForm(forms.ModelForm):
+    """Vote form that keeps a changed vote on its question."""
 
+    def clean_choice(self):
+        """Reject moving an existing vote to a choice of another question."""
+        choice = self.cleaned_data["choice"]
+        if self.instance.pk is not None and choice.question_id != self.instance.question_id:
+            raise forms.ValidationError("A vote can only be changed to another choice of its question.")
+        return choice
 
-admin.site.register(Choice)
 
+class VoteAdmin(admin.ModelAdmin):
+    """
+    Admin of the votes, the biggest table.
 
-admin.site.register(Vote)  # Register the Vote model
+    Users are picked with an autocomplete and choices by id, so forms never
+    list every row. Votes are saved with Vote.cast, which keeps the stored
+    tallies right; a saved vote's user cannot be changed, only its choice.
+    """
+
+    form = VoteAdminForm
+    list_display = ["id", "user", "question", "choice", "cast_at", "changed_at"]
+    list_select_related = ["user", "question", "choice"]
+    autocomplete_fields = ["user"]
+    raw_id_fields = ["choice"]
+    fields = ["user", "choice", "cast_at", "changed_at"]
+    readonly_fields = ["cast_at", "changed_at"]
+    search_fields = ["user__username"]
+    ordering = ["-pk"]
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+
+    def get_readonly_fields(self, request, obj=None):
+        """Make the user read-only once the vote exists."""
+        if obj is not None:
+            return [*self.readonly_fields, "user"]
+        return self.readonly_fields
+
+    def save_model(self, request, obj, form, change):
+        """Cast the vote, or change it to the new choice, updating the tallies."""
+        obj.question_id = obj.choice.question_id
+        Vote.cast(obj.user, obj.choice)
+        if obj.pk is None:
+            obj.pk = Vote.objects.get(user=obj.user, question_id=obj.question_id).pk
+
+
+admin.site.register(Question, QuestionAdmin)
+admin.site.register(Choice, ChoiceAdmin)
+admin.site.register(Vote, VoteAdmin)
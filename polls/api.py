@@ -0,0 +1,262 @@
+import hashlib
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import condition, require_GET, require_POST
+
+from .cache import get_results, questions_version, results_version
+from .models import Choice, Question, Vote, VoteRollup
+from .rollups import processed_until, turnout
+from .views import decode_cursor, encode_cursor
+
+# Largest page a client may ask for; use ?all=1 to stream every question.
+MAX_PAGE_SIZE = 1000
+# Open/closed status depends on the clock, so listing ETags also change once a minute.
+LISTING_ETAG_SECONDS = 60
+# Cache of the responses kept for Idempotency-Key retries, apart from the results cache.
+IDEMPOTENCY_CACHE_ALIAS = "idempotency"
+
+vote_logger = logging.getLogger("polls.votes")
+
+
+def question_data(question, now):
+    """Return the JSON-ready fields of a question."""
+    return {
+        "id": question.pk,
+        "question_text": question.question_text,
+        "pub_date": question.pub_date,
+        "end_date": question.end_date,
+        "can_vote": question.pub_date <= now and (question.end_date is None or now <= question.end_date),
+        "vote_count": question.vote_count,
+    }
+
+
+def questions_etag(request, *args, **kwargs):
+    """Return the ETag of the question listing without touching the database."""
+    return f'"q{questions_version()}-{int(time.time()) // LISTING_ETAG_SECONDS}"'
+
+
+def results_etag(request, pk):
+    """Return the ETag of a question's results, touching the database only when its version is not cached."""
+    version = results_version(pk, exists=Question.objects.filter(pk=pk).exists)
+    return None if version is None else f'"r{pk}-{version}"'
+
+
+def stream_questions(questions, now, next_cursor=None):
+    """Yield the JSON document of a question listing piece by piece."""
+    encoder = DjangoJSONEncoder()
+    yield '{"questions": ['
+    for n, question in enumerate(questions):
+        yield ("," if n else "") + encoder.encode(question_data(question, now))
+    yield '], "next": ' + json.dumps(next_cursor) + "}"
+
+
+@require_GET
+@condition(etag_func=questions_etag)
+def question_list(request):
+    """
+    Return published questions, newest first, as streamed JSON.
+
+    Pages are keyset paginated like the index: pass the ``next`` value of one
+    page as ``after`` to get the following one, and ``limit`` to choose the
+    page size. ``all=1`` streams every published question for exports.
+    """
+    now = timezone.now()
+    questions = Question.objects.filter(pub_date__lte=now).order_by("-pub_date", "-pk")
+
+    if request.GET.get("all"):
+        return StreamingHttpResponse(
+            stream_questions(questions.iterator(chunk_size=MAX_PAGE_SIZE), now),
+            content_type="application/json",
+        )
+
+    try:
+        limit = min(int(request.GET.get("limit", settings.POLLS_INDEX_PAGE_SIZE)), MAX_PAGE_SIZE)
+    except ValueError:
+        limit = settings.POLLS_INDEX_PAGE_SIZE
+    limit = max(limit, 1)
+    after = decode_cursor(request.GET.get("after"))
+    if after:
+        pub_date, pk = after
+        questions = questions.filter(Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, pk__lt=pk))
+    page = list(questions[:limit + 1])
+    next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+    return StreamingHttpResponse(
+        stream_questions(page[:limit], now, next_cursor),
+        content_type="application/json",
+    )
+
+
+@require_GET
+@condition(etag_func=results_etag)
+def question_results(request, pk):
+    """Return the results of a published question as JSON."""
+    try:
+        question = Question.objects.get(pk=pk, pub_date__lte=timezone.now())
+    except Question.DoesNotExist:
+        raise Http404("No such question.")
+    results = get_results(question)
+    return JsonResponse({"id": question.pk, "question_text": question.question_text, **results})
+
+
+def parse_time(value):
+    """Parse an ISO date-time query parameter, returning None if it is missing and raising ValueError if invalid."""
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(value)
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+@require_GET
+def question_turnout(request, pk):
+    """
+    Return the votes cast on a published question per minute, hour or day as JSON.
+
+    The counts come from the rollups kept by the rollup_votes command, never
+    from the votes themselves; ``processed_until`` says how recent they are.
+    Choose the bucket size with ``granularity`` and the span with ISO
+    date-times in ``since`` and ``until``.
+    """
+    granularity = request.GET.get("granularity", VoteRollup.HOUR)
+    if granularity not in VoteRollup.GRANULARITIES:
+        return HttpResponseBadRequest(f"granularity must be one of {', '.join(VoteRollup.GRANULARITIES)}.")
+    try:
+        since = parse_time(request.GET.get("since"))
+        until = parse_time(request.GET.get("until"))
+    except ValueError as error:
+        return HttpResponseBadRequest(f"Invalid date-time: {error}")
+    try:
+        question = Question.objects.get(pk=pk, pub_date__lte=timezone.now())
+    except Question.DoesNotExist:
+        raise Http404("No such question.")
+    return JsonResponse({
+        "id": question.pk,
+        "granularity": granularity,
+        "processed_until": processed_until(),
+        "buckets": turnout(question, granularity, since, until),
+    })
+
+
+def parse_ballot(body):
+    """
+    Return the {question_id: choice_id} of a ballot's JSON body.
+
+    Raises:
+        ValueError: If the body is not a ballot, or answers too many questions.
+    """
+    data = json.loads(body)
+    votes = data.get("votes") if isinstance(data, dict) else None
+    if not isinstance(votes, list):
+        raise ValueError('A ballot is a JSON object with a "votes" list.')
+    if len(votes) > settings.POLLS_BALLOT_MAX_QUESTIONS:
+        raise ValueError(f"A ballot can answer at most {settings.POLLS_BALLOT_MAX_QUESTIONS} questions.")
+    ballot = {}
+    for vote in votes:
+        try:
+            question_id, choice_id = vote["question"], vote["choice"]
+        except (KeyError, TypeError):
+            raise ValueError('Each vote is an object with a "question" and a "choice".') from None
+        if type(question_id) is not int or type(choice_id) is not int:
+            raise ValueError("Question and choice ids are integers.")
+        ballot[question_id] = choice_id
+    return ballot
+
+
+def check_ballot(user, ballot):
+    """
+    Check every choice of a ballot in one query.
+
+    Returns:
+        tuple: The results of the votes that cannot be cast, by question id,
+               the (user_id, question_id, choice_id) votes to cast, and the
+               fields of each chosen choice, by choice id.
+    """
+    now = timezone.now()
+    choices = {
+        choice["pk"]: choice
+        for choice in Choice.objects.filter(pk__in=ballot.values(), question_id__in=ballot).values(
+            "pk", "question_id", "choice_text", "question__question_text", "question__pub_date", "question__end_date"
+        )
+    }
+    results = {}
+    votes = []
+    for question_id, choice_id in ballot.items():
+        choice = choices.get(choice_id)
+        result = {"question": question_id, "choice": choice_id}
+        # Unpublished questions are reported as invalid, so a ballot cannot reveal them.
+        if choice is None or choice["question_id"] != question_id or choice["question__pub_date"] > now:
+            results[question_id] = {**result, "status": "invalid"}
+        elif choice["question__end_date"] is not None and choice["question__end_date"] < now:
+            results[question_id] = {**result, "status": "closed"}
+        else:
+            votes.append((user.pk, question_id, choice_id))
+    return results, votes, choices
+
+
+def ballot_key(user, key):
+    """Return the cache key of the response to a user's ballot sent with an Idempotency-Key."""
+    return f"ballot:{user.pk}:{hashlib.sha256(key.encode()).hexdigest()}"
+
+
+@require_POST
+def cast_ballot(request):
+    """
+    Vote on many questions at once and return the result of each vote as JSON.
+
+    The body is ``{"votes": [{"question": 1, "choice": 3}, ...]}``. Every
+    choice is checked in one query, and the votes on open questions are
+    written in one transaction by Vote.cast_many; the others are reported as
+    ``closed`` or ``invalid`` without stopping the rest. A client that sends
+    an ``Idempotency-Key`` header gets the stored response when it retries
+    the same ballot with the same key, without it being cast again. Should
+    the stored response have expired or been evicted from the idempotency
+    cache, the retry is cast again, which leaves the same votes. Like the vote form, a ballot needs a CSRF token.
+    """
+    user = request.user
+    if not user.is_authenticated:
+        return JsonResponse({"error": "Log in to vote."}, status=401)
+
+    key = request.headers.get("Idempotency-Key")
+    digest = hashlib.sha256(request.body).hexdigest()
+    if key:
+        cache = caches[IDEMPOTENCY_CACHE_ALIAS]
+        stored = cache.get(ballot_key(user, key))
+        if stored is not None:
+            if stored["digest"] != digest:
+                return JsonResponse({"error": "This Idempotency-Key was used for another ballot."}, status=422)
+            return JsonResponse(stored["response"], headers={"Idempotent-Replayed": "true"})
+
+    try:
+        ballot = parse_ballot(request.body)
+    except ValueError as error:
+        return JsonResponse({"error": str(error)}, status=400)
+
+    results, votes, choices = check_ballot(user, ballot)
+    previous = Vote.cast_many(votes)
+    for _, question_id, choice_id in votes:
+        before = previous[(user.pk, question_id)]
+        status = "recorded" if before is None else "unchanged" if before == choice_id else "changed"
+        results[question_id] = {"question": question_id, "choice": choice_id, "status": status, "previous": before}
+        if status != "unchanged":
+            choice = choices[choice_id]
+            vote_logger.info('User %s voted for "%s" for question "%s" (ballot).',
+                             user.username, choice["choice_text"], choice["question__question_text"], extra={
+                                 "event": "vote" if before is None else "vote_changed", "user_id": user.pk,
+                                 "question_id": question_id, "choice_id": choice_id, "buffered": False,
+                             })
+
+    response = {"results": [results[question_id] for question_id in ballot]}
+    if key:
+        cache.set(ballot_key(user, key), {"digest": digest, "response": response},
+                  settings.POLLS_BALLOT_IDEMPOTENCY_SECONDS)
+    return JsonResponse(response)
@@ -0,0 +1,98 @@
+"""
+Hashed, pre-compressed static files and a view that serves them.
+
+collectstatic stores every file under a content-hashed name as well as its
+own, and writes gzip and (when the brotli package is installed) brotli
+copies of text files beside them. The view serves the smallest copy the
+client accepts and marks hashed names immutable, so browsers keep them until
+the content, and therefore the name, changes.
+"""
+import gzip
+import os
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.http import Http404
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import require_safe
+from django.views.static import serve
+
+try:
+    import brotli
+except ImportError:  # Only gzip copies are written without it.
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".json", ".map", ".svg", ".txt", ".xml", ".html", ".ico"}
+# Preferred first; each is served only if the client accepts it and the copy exists.
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+# The twelve hex digits ManifestStaticFilesStorage puts before the extension.
+HASHED_NAME = re.compile(r"\.[0-9a-f]{12}\.[^/.]+$")
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+MUTABLE_MAX_AGE = 60
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Manifest storage that also writes compressed copies of text files."""
+
+    def post_process(self, paths, dry_run=False, **options):
+        """Hash the collected files, then compress the originals and their hashed copies."""
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        for name in sorted({*paths, *self.hashed_files.values()}):
+            if os.path.splitext(name)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+                self.compress(name)
+
+    def compress(self, name):
+        """Write the compressed copies of a file that are worth having."""
+        path = self.path(name)
+        with open(path, "rb") as source:
+            data = source.read()
+        copies = [(".gz", gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            copies.append((".br", brotli.compress(data)))
+        for suffix, compressed in copies:
+            # Barely smaller files are not worth decompressing.
+            if len(compressed) < len(data) * 0.95:
+                with open(path + suffix, "wb") as target:
+                    target.write(compressed)
+
+    def stored_name(self, name):
+        """Return the hashed name of a file, or the name itself until collectstatic has been run."""
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+
+def accepted_encodings(request):
+    """Return the content codings named in the request's Accept-Encoding header."""
+    return {
+        part.split(";")[0].strip().lower()
+        for part in request.headers.get("Accept-Encoding", "").split(",")
+    }
+
+
+@require_safe
+def serve_static(request, path):
+    """Serve a collected static file, compressed when possible, caching hashed names for a year."""
+    accepted = accepted_encodings(request)
+    response = None
+    for encoding, suffix in ENCODINGS:
+        if encoding in accepted:
+            try:
+                # The content type and Content-Encoding follow from the copy's name, e.g. style.css.br.
+                response = serve(request, path + suffix, settings.STATIC_ROOT)
+                break
+            except Http404:
+                continue
+    if response is None:
+        response = serve(request, path, settings.STATIC_ROOT)
+
+    patch_vary_headers(response, ["Accept-Encoding"])
+    if HASHED_NAME.search(path):
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=MUTABLE_MAX_AGE)
+    return response
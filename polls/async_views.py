@@ -0,0 +1,109 @@
+"""
+Async versions of the poll views for running under ASGI.
+
+They behave exactly like the views in ``polls.views`` but wait on the
+database with Django's async ORM instead of holding a thread-pool slot.
+Writes that need a transaction still run in one sync thread. Select them
+with ``POLLS_ASYNC_VIEWS``.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import alogin
+from django.contrib.auth.decorators import login_required
+from django.contrib.auth.forms import UserCreationForm
+from django.http import Http404, HttpResponseRedirect
+from django.template.response import TemplateResponse
+from django.urls import reverse
+
+from . import views
+from .buffer import get_vote_buffer
+from .cache import get_results
+from .models import Choice, Question, Vote
+
+
+class IndexView(views.IndexView):
+    """Async view for displaying a page of the most recent questions."""
+
+    async def get(self, request, *args, **kwargs):
+        """Render one page of published questions."""
+        request.user = await request.auser()
+        self.object_list = self.finish_page([question async for question in self.get_page_queryset()])
+        return self.render_to_response(self.get_context_data())
+
+
+class DetailView(views.DetailView):
+    """Async view for displaying a specific question's details."""
+
+    async def get(self, request, *args, **kwargs):
+        """Redirect to the index page if the question is from the future, closed or does not exist."""
+        request.user = await request.auser()
+        try:
+            self.object = await self.get_queryset().aget(pk=kwargs["pk"])
+        except Question.DoesNotExist:
+            return HttpResponseRedirect(reverse('polls:index'))
+        if self.object.status != Question.OPEN:
+            return HttpResponseRedirect(reverse('polls:index'))
+        return self.render_to_response(self.get_context_data(object=self.object))
+
+
+class ResultsView(views.ResultsView):
+    """Async view for displaying the results of a specific question."""
+
+    async def get(self, request, *args, **kwargs):
+        """Render the question's results."""
+        request.user = await request.auser()
+        try:
+            self.object = await Question.objects.aget(pk=kwargs["pk"])
+        except Question.DoesNotExist:
+            raise Http404("No such question.")
+        context = {"object": self.object, "question": self.object, "view": self}
+        context["results"] = await sync_to_async(get_results)(self.object)
+        context["live_results"] = views.live_results(request)
+        return self.render_to_response(context)
+
+
+async def signup(request):
+    """Handle user signups and log the user in upon successful registration."""
+    if request.method == 'POST':
+        form = UserCreationForm(request.POST)
+        # Validation checks the username against the database and saving hashes the password.
+        if await sync_to_async(form.is_valid)():
+            user = await sync_to_async(form.save)()
+            await alogin(request, user, backend=settings.AUTHENTICATION_BACKENDS[0])
+            return HttpResponseRedirect(reverse('polls:index'))
+    else:
+        form = UserCreationForm()
+    return TemplateResponse(request, 'registration/signup.html', {'form': form})
+
+
+@login_required
+async def vote(request, question_id):
+    """Handle voting for a choice on a question."""
+    user = request.user = await request.auser()
+    try:
+        selected_choice = await Choice.objects.select_related("question").aget(
+            pk=request.POST["choice"], question_id=question_id
+        )
+    except (KeyError, ValueError, Choice.DoesNotExist):
+        try:
+            question = await Question.objects.aget(pk=question_id)
+        except Question.DoesNotExist:
+            raise Http404("No such question.")
+        if not question.can_vote():
+            return HttpResponseRedirect(reverse("polls:index"))
+        return views.no_choice_response(request, question)
+
+    question = selected_choice.question
+    if not question.can_vote():
+        return HttpResponseRedirect(reverse("polls:index"))
+
+    # Starting the buffer on first use reads old journals, which blocks.
+    buffer = await sync_to_async(get_vote_buffer)()
+    if buffer and await sync_to_async(buffer.submit)(user.id, question.id, selected_choice.id):
+        views.announce_vote(request, user, selected_choice, buffered=True)
+    else:
+        # Vote.cast() runs a transaction, which has to stay in one thread.
+        previous = await sync_to_async(Vote.cast)(user, selected_choice)
+        views.announce_vote(request, user, selected_choice, previous)
+
+    return HttpResponseRedirect(reverse("polls:results", args=(question.id,)))
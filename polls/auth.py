@@ -0,0 +1,58 @@
+"""
+Authentication backend that keeps recently seen users in process memory.
+
+AuthenticationMiddleware loads request.user from the database on every
+request. With POLLS_USER_CACHE_SECONDS set, the user record is kept for that
+long in a small per-process cache, so together with cache or signed-cookie
+sessions a page view reaches the poll queries without touching the
+auth tables. Entries are dropped when the user logs out or is saved or
+deleted in this process; other processes see the change once their entry
+expires, so keep the lifetime short.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+
+_lock = threading.Lock()
+_users = OrderedDict()
+
+
+def clear_user_cache(user_id=None):
+    """Forget the cached record of one user, or of every user."""
+    with _lock:
+        if user_id is None:
+            _users.clear()
+        else:
+            _users.pop(user_id, None)
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend whose get_user serves recently loaded users from memory."""
+
+    def get_user(self, user_id):
+        """Return the user with this id, from the process cache while its entry is fresh."""
+        lifetime = settings.POLLS_USER_CACHE_SECONDS
+        if lifetime <= 0:
+            return super().get_user(user_id)
+
+        now = time.monotonic()
+        with _lock:
+            entry = _users.get(user_id)
+            if entry is not None and entry[0] > now:
+                _users.move_to_end(user_id)
+                # Each request gets its own copy, so changes made while handling it stay there.
+                return copy.copy(entry[1])
+
+        user = super().get_user(user_id)
+        if user is not None:
+            with _lock:
+                _users[user_id] = (now + lifetime, user)
+                _users.move_to_end(user_id)
+                while len(_users) > settings.POLLS_USER_CACHE_SIZE:
+                    _users.popitem(last=False)
+            user = copy.copy(user)
+        return user
@@ -0,0 +1,232 @@
+"""
+Replay a weighted mix of poll requests and measure them.
+
+Requests go through Django's test client, or its async client to exercise
+the ASGI request path, against the database in the settings. Votes are really
+cast, so run it on a seeded benchmark database, not on production data.
+"""
+import math
+import random
+import time
+
+import django
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Q
+from django.test import AsyncClient, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from polls.auth import clear_user_cache
+from polls.models import Choice, Question, Vote
+
+DEFAULT_MIX = {"index": 40, "detail": 25, "results": 25, "vote": 10}
+SESSION_ENGINES = {
+    "db": "django.contrib.sessions.backends.db",
+    "cache": "django.contrib.sessions.backends.cache",
+    "signed_cookies": "django.contrib.sessions.backends.signed_cookies",
+}
+
+
+def parse_mix(value):
+    """Parse a request mix such as ``index=40,vote=10`` into a dict of weights."""
+    mix = {}
+    for part in value.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in DEFAULT_MIX:
+            raise ValueError(f"Unknown request kind {kind!r}; choose from {', '.join(DEFAULT_MIX)}.")
+        mix[kind] = float(weight)
+    if not any(weight > 0 for weight in mix.values()):
+        raise ValueError("The request mix needs at least one positive weight.")
+    return mix
+
+
+def percentile(sorted_values, percent):
+    """Return the nearest-rank percentile of already sorted values."""
+    rank = max(math.ceil(percent / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(samples):
+    """Return latency and query statistics of (seconds, queries, status) samples."""
+    if not samples:
+        return {"requests": 0}
+    latencies = sorted(seconds * 1000 for seconds, _, _ in samples)
+    queries = [count for _, count, _ in samples]
+    return {
+        "requests": len(samples),
+        "errors": sum(status >= 400 for _, _, status in samples),
+        "mean_ms": round(sum(latencies) / len(latencies), 3),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(latencies[-1], 3),
+        "queries_mean": round(sum(queries) / len(queries), 2),
+        "queries_max": max(queries),
+    }
+
+
+class BenchmarkRunner:
+    """Sends a reproducible sequence of requests from a pool of logged-in benchmark users."""
+
+    def __init__(self, mix=None, clients=20, sample=1000, prefix="bench", use_async=False, random_seed=0,
+                 session_engine=None, user_cache_seconds=None):
+        """
+        Prepare a run drawing request kinds from mix and questions from the newest sample open ones.
+
+        session_engine (a SESSION_ENGINES key) and user_cache_seconds override
+        the settings for the run, to compare the queries each request makes.
+        """
+        self.mix = mix or DEFAULT_MIX
+        self.session_engine = session_engine
+        self.user_cache_seconds = user_cache_seconds
+        self.clients = clients
+        self.sample = sample
+        self.prefix = prefix
+        self.use_async = use_async
+        self.rng = random.Random(random_seed)
+
+    def load_targets(self):
+        """Fetch the open questions to request and their choice ids."""
+        now = timezone.now()
+        question_ids = list(
+            Question.objects.filter(pub_date__lte=now)
+            .filter(Q(end_date__isnull=True) | Q(end_date__gte=now))
+            .order_by("-pub_date", "-pk")
+            .values_list("pk", flat=True)[:self.sample]
+        )
+        choices = {}
+        for question_id, choice_id in Choice.objects.filter(question_id__in=question_ids).values_list(
+            "question_id", "pk"
+        ):
+            choices.setdefault(question_id, []).append(choice_id)
+        self.targets = [(question_id, choices[question_id]) for question_id in question_ids if question_id in choices]
+        if not self.targets:
+            raise ValueError("There are no open questions with choices to request.")
+
+    def load_users(self):
+        """Fetch the benchmark users the clients log in as."""
+        self.users = list(User.objects.filter(username__startswith=f"{self.prefix}-").order_by("pk")[:self.clients])
+        if not self.users:
+            raise ValueError(f"There are no {self.prefix}-* users; seed the benchmark data first.")
+
+    def next_request(self):
+        """Return the kind, method, path and data of a random request from the mix."""
+        kind = self.rng.choices(list(self.mix), list(self.mix.values()))[0]
+        question_id, choice_ids = self.rng.choice(self.targets)
+        if kind == "index":
+            return kind, "get", reverse("polls:index"), None
+        if kind == "vote":
+            return kind, "post", reverse("polls:vote", args=(question_id,)), {"choice": self.rng.choice(choice_ids)}
+        return kind, "get", reverse(f"polls:{kind}", args=(question_id,)), None
+
+    def run(self, requests, warmup=0, label=""):
+        """Send warmup unmeasured requests, then measure requests more, and return the report as a dict."""
+        self.load_users()
+        self.load_targets()
+        # The few benchmark users vote far faster than the rate limits allow.
+        overrides = {"ALLOWED_HOSTS": [*settings.ALLOWED_HOSTS, "testserver"], "POLLS_RATE_LIMITS": {}}
+        if self.session_engine:
+            overrides["SESSION_ENGINE"] = SESSION_ENGINES[self.session_engine]
+        if self.user_cache_seconds is not None:
+            overrides["POLLS_USER_CACHE_SECONDS"] = self.user_cache_seconds
+        clear_user_cache()
+        with override_settings(**overrides):
+            session_engine = settings.SESSION_ENGINE
+            user_cache_seconds = settings.POLLS_USER_CACHE_SECONDS
+            if self.use_async:
+                samples, duration = async_to_sync(self.send_async)(requests, warmup)
+            else:
+                samples, duration = self.send_sync(requests, warmup)
+
+        by_kind = {}
+        for kind, sample in samples:
+            by_kind.setdefault(kind, []).append(sample)
+        return {
+            "label": label,
+            "started_at": timezone.now().isoformat(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "client": "async" if self.use_async else "sync",
+            "session_engine": session_engine,
+            "user_cache_seconds": user_cache_seconds,
+            "mix": self.mix,
+            "data": {
+                "users": User.objects.count(),
+                "questions": Question.objects.count(),
+                "choices": Choice.objects.count(),
+                "votes": Vote.objects.count(),
+            },
+            "duration_s": round(duration, 3),
+            "throughput_rps": round(len(samples) / duration, 2) if duration else None,
+            "overall": summarize([sample for _, sample in samples]),
+            "endpoints": {kind: summarize(by_kind.get(kind, [])) for kind in self.mix},
+        }
+
+    def send_sync(self, requests, warmup):
+        """Send the requests with the test client and return the samples and the measured duration."""
+        clients = []
+        for user in self.users:
+            client = Client()
+            client.force_login(user)
+            clients.append(client)
+
+        samples = []
+        started = None
+        for n in range(warmup + requests):
+            if n == warmup:
+                started = time.perf_counter()
+            kind, method, path, data = self.next_request()
+            client = clients[n % len(clients)]
+            with CaptureQueriesContext(connection) as queries:
+                began = time.perf_counter()
+                response = getattr(client, method)(path, data)
+                elapsed = time.perf_counter() - began
+            if n >= warmup:
+                samples.append((kind, (elapsed, len(queries), response.status_code)))
+        return samples, time.perf_counter() - started if started else 0
+
+    async def send_async(self, requests, warmup):
+        """Send the requests with the async test client and return the samples and the measured duration."""
+        clients = []
+        for user in self.users:
+            client = AsyncClient()
+            await client.aforce_login(user)
+            clients.append(client)
+
+        samples = []
+        started = None
+        for n in range(warmup + requests):
+            if n == warmup:
+                started = time.perf_counter()
+            kind, method, path, data = self.next_request()
+            client = clients[n % len(clients)]
+            queries = await start_capture()
+            began = time.perf_counter()
+            response = await getattr(client, method)(path, data)
+            elapsed = time.perf_counter() - began
+            query_count = await stop_capture(queries)
+            if n >= warmup:
+                samples.append((kind, (elapsed, query_count, response.status_code)))
+        return samples, time.perf_counter() - started if started else 0
+
+
+# The async ORM and sync views run on the thread that started the event loop,
+# so query capture is switched on and read there.
+@sync_to_async
+def start_capture():
+    """Start recording the queries of the default connection."""
+    queries = CaptureQueriesContext(connection)
+    queries.__enter__()
+    return queries
+
+
+@sync_to_async
+def stop_capture(queries):
+    """Stop recording queries and return how many ran."""
+    queries.__exit__(None, None, None)
+    return len(queries)
@@ -0,0 +1,127 @@
+"""
+Synthetic poll data at benchmark scale.
+
+Rows come from a seeded random generator and are written with bulk_create
+in batches, skipping model signals, so millions of votes load quickly. Vote
+tallies are decided before the rows are written and stored with them, so the
+data needs no reconcile pass afterwards.
+"""
+import random
+from collections import Counter
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from polls.cache import bump_questions_version
+from polls.models import Choice, Question, Vote
+
+BENCHMARK_PASSWORD = "benchmark"
+
+
+def seed(users, questions, choices, votes, prefix="bench", days=365, batch_size=5000, random_seed=0, log=None):
+    """
+    Create synthetic users, questions, choices and votes and return the number of each written.
+
+    Users are named ``<prefix>-<n>`` and share the password ``benchmark``.
+    Votes are spread evenly over the questions and unevenly over each
+    question's choices; no user votes twice on a question, so votes may not
+    exceed users x questions. About a fifth of the questions are closed.
+    """
+    if votes > users * questions:
+        raise ValueError("votes cannot exceed users x questions, since each user votes once per question.")
+    if votes and not choices:
+        raise ValueError("votes need at least one choice per question.")
+    rng = random.Random(random_seed)
+    now = timezone.now()
+    written = Counter()
+
+    with transaction.atomic():
+        user_ids = create_users(users, prefix, batch_size)
+    written["users"] = len(user_ids)
+    if log:
+        log(f"{len(user_ids)} users")
+
+    per_question, extra = divmod(votes, questions) if questions else (0, 0)
+    for start in range(0, questions, batch_size):
+        numbers = range(start, min(start + batch_size, questions))
+        with transaction.atomic():
+            counts = create_questions(
+                rng, now, days, prefix, choices, user_ids, batch_size,
+                [per_question + (n < extra) for n in numbers], numbers,
+            )
+        written.update(counts)
+        if log:
+            log(f"{numbers.stop} of {questions} questions, {written['votes']} votes")
+
+    bump_questions_version()
+    return dict(written)
+
+
+def create_users(count, prefix, batch_size):
+    """Bulk create count users and return their ids."""
+    password = make_password(BENCHMARK_PASSWORD)
+    user_ids = []
+    for start in range(0, count, batch_size):
+        batch = [
+            User(username=f"{prefix}-{n}", password=password)
+            for n in range(start, min(start + batch_size, count))
+        ]
+        user_ids.extend(user.pk for user in User.objects.bulk_create(batch))
+    return user_ids
+
+
+def create_questions(rng, now, days, prefix, choices, user_ids, batch_size, vote_counts, numbers):
+    """Bulk create one batch of questions with their choices and votes and return the number of each."""
+    questions = []
+    tallies = []
+    for n, vote_count in zip(numbers, vote_counts):
+        pub_date = now - timedelta(seconds=rng.uniform(60, days * 86400))
+        closed = rng.random() < 0.2
+        end_date = pub_date + (now - pub_date) * rng.random() if closed else None
+        questions.append(Question(
+            question_text=f"{prefix} question {n}?", pub_date=pub_date, end_date=end_date, vote_count=vote_count,
+        ))
+        tallies.append(split_votes(rng, vote_count, choices))
+    Question.objects.bulk_create(questions, batch_size=batch_size)
+
+    question_choices = [
+        [Choice(question=question, choice_text=f"Choice {n + 1}", vote_count=votes) for n, votes in enumerate(tally)]
+        for question, tally in zip(questions, tallies)
+    ]
+    Choice.objects.bulk_create([choice for row in question_choices for choice in row], batch_size=batch_size)
+
+    pending = []
+    vote_total = 0
+    for question, row in zip(questions, question_choices):
+        # Each question's voters are a run of consecutive users from a random start, so none repeats.
+        offset = rng.randrange(len(user_ids)) if user_ids else 0
+        voter = 0
+        # Votes are cast while the question is open, so turnout rollups have a history to chart.
+        voting_time = (question.end_date or now) - question.pub_date
+        for choice in row:
+            for _ in range(choice.vote_count):
+                cast_at = question.pub_date + voting_time * rng.random()
+                pending.append(Vote(
+                    user_id=user_ids[(offset + voter) % len(user_ids)], question_id=question.pk, choice_id=choice.pk,
+                    cast_at=cast_at, changed_at=cast_at,
+                ))
+                voter += 1
+                if len(pending) >= batch_size:
+                    Vote.objects.bulk_create(pending)
+                    vote_total += len(pending)
+                    pending = []
+    Vote.objects.bulk_create(pending)
+    vote_total += len(pending)
+    return {"questions": len(questions), "choices": sum(map(len, question_choices)), "votes": vote_total}
+
+
+def split_votes(rng, votes, choices):
+    """Return how many of votes each of choices gets, with some choices more popular than others."""
+    weights = [rng.random() + 0.1 for _ in range(choices)]
+    if not votes:
+        return [0] * choices
+    picks = Counter(rng.choices(range(choices), weights, k=votes))
+    return [picks[n] for n in range(choices)]
@@ -0,0 +1,141 @@
+"""
+In-process fan-out of live results to Server-Sent Events subscribers.
+
+A single broadcaster per process loads a question's results once per change
+and hands them to every subscriber of that question. Each subscriber keeps
+only the newest results, so a slow client skips intermediate updates instead
+of queueing them. Votes written by other processes are not seen.
+"""
+import asyncio
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+
+class TooManySubscribers(Exception):
+    """Raised when the connection cap is reached."""
+
+
+class Subscription:
+    """One client's view of a question's results, coalesced to the newest state."""
+
+    def __init__(self, broadcaster, question_id):
+        """Register with broadcaster for updates to question_id."""
+        self.broadcaster = broadcaster
+        self.question_id = question_id
+        self.latest = None
+        self.sent = None
+        self.changed = asyncio.Event()
+
+    def offer(self, results):
+        """Replace any results not yet sent with newer ones."""
+        self.latest = results
+        self.changed.set()
+
+    async def next_event(self, timeout=None):
+        """
+        Wait for the next change and return it as an SSE (event, data) pair.
+
+        The first event is a full ``snapshot``; later ``delta`` events hold the
+        total and only the choices whose counts changed since the last event.
+        Returns None if nothing changed within timeout seconds.
+        """
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self.changed.clear()
+        results, previous = self.latest, self.sent
+        self.sent = results
+        if previous is None:
+            return "snapshot", results
+        before = {choice["id"]: choice for choice in previous["choices"]}
+        changed = [choice for choice in results["choices"] if before.get(choice["id"]) != choice]
+        return "delta", {"total": results["total"], "choices": changed}
+
+    def close(self):
+        """Stop receiving updates."""
+        self.broadcaster.unsubscribe(self)
+
+
+class Broadcaster:
+    """Fans results changes out to the subscribers of each question."""
+
+    def __init__(self, max_connections=None):
+        """Create a broadcaster allowing at most max_connections subscribers."""
+        self.max_connections = max_connections
+        self.subscribers = {}
+        self.count = 0
+        self.loop = None
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    async def subscribe(self, question_id):
+        """Return a subscription primed with the question's current results."""
+        limit = self.max_connections or settings.POLLS_SSE_MAX_CONNECTIONS
+        with self.lock:
+            if self.count >= limit:
+                raise TooManySubscribers()
+            self.loop = asyncio.get_running_loop()
+            subscription = Subscription(self, question_id)
+            self.subscribers.setdefault(question_id, set()).add(subscription)
+            self.count += 1
+        try:
+            subscription.offer(await load_results(question_id))
+        except BaseException:
+            subscription.close()
+            raise
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Remove a subscription."""
+        with self.lock:
+            subscribers = self.subscribers.get(subscription.question_id, set())
+            if subscription in subscribers:
+                subscribers.discard(subscription)
+                self.count -= 1
+            if not subscribers:
+                self.subscribers.pop(subscription.question_id, None)
+
+    def notify(self, question_id):
+        """
+        Tell subscribers of a question that its results changed.
+
+        Safe to call from any thread. Does nothing when nobody is watching,
+        and bursts of changes to one question are loaded only once.
+        """
+        with self.lock:
+            if question_id not in self.subscribers or question_id in self.pending:
+                return
+            self.pending.add(question_id)
+            loop = self.loop
+        try:
+            loop.call_soon_threadsafe(lambda: loop.create_task(self.publish(question_id)))
+        except RuntimeError:
+            # The event loop has shut down; there is nobody left to tell.
+            with self.lock:
+                self.pending.discard(question_id)
+
+    async def publish(self, question_id):
+        """Load the question's results once and offer them to all its subscribers."""
+        with self.lock:
+            self.pending.discard(question_id)
+        results = await load_results(question_id)
+        with self.lock:
+            subscribers = list(self.subscribers.get(question_id, ()))
+        for subscription in subscribers:
+            subscription.offer(results)
+
+
+@sync_to_async
+def load_results(question_id):
+    """Return the current results payload of a question."""
+    # Imported here because the cache module notifies this one.
+    from .cache import get_results
+    from .models import Question
+
+    return get_results(Question(pk=question_id))
+
+
+broadcaster = Broadcaster()
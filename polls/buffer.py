@@ -0,0 +1,304 @@
+"""
+Optional write-behind buffer for votes.
+
+When ``POLLS_VOTE_BUFFER_ENABLED`` is set, validated votes are queued in
+process and a background thread writes them with ``Vote.cast_many`` in
+batches. Each vote is appended to a journal file with the time it was cast
+before it is acknowledged, so a crash does not lose votes the user was told
+were recorded, and votes written late still carry that time. Every
+process keeps its own journal, ``POLLS_VOTE_JOURNAL`` with the process id
+appended, and holds a lock on it while running. A starting buffer takes over
+the journals no running process holds and writes their votes first.
+
+While the database cannot be reached, a batch is kept and retried with a
+growing delay; only votes the database rejects, such as one for a deleted
+choice, are dropped. After each batch the journal records how many of its
+votes have been written, so a replay never writes them a second time, and it
+is emptied whenever all of them have been.
+"""
+import atexit
+import collections
+import glob
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, InterfaceError, OperationalError, connections
+from django.utils import timezone
+
+from .models import Vote
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger('polls')
+
+# Longest wait between retries while the database cannot be reached.
+MAX_RETRY_DELAY = 60.0
+
+
+def lock(file):
+    """Lock an open file for this process, returning False if another process holds it."""
+    try:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def read_entries(file):
+    """
+    Read the votes journaled in an open file, skipping lines a crash left half written.
+
+    Returns:
+        tuple: Every vote in the journal, and how many of them were written.
+    """
+    file.seek(0)
+    entries = []
+    written = 0
+    for line in file:
+        try:
+            value = json.loads(line)
+            if isinstance(value, dict):
+                written = value["written"]
+            else:
+                # Journals from earlier versions have no cast time.
+                user_id, question_id, choice_id, *cast_at = value
+                entries.append((user_id, question_id, choice_id, *map(datetime.fromisoformat, cast_at)))
+        except (KeyError, TypeError, ValueError):
+            if line.strip():
+                logger.error("Skipped a damaged line of vote journal %s: %r", file.name, line)
+    return entries, written
+
+
+class VoteBuffer:
+    """A bounded queue of votes flushed to the database in batches."""
+
+    def __init__(self, max_size=10000, batch_size=500, flush_interval=1.0, journal=None, fsync=True):
+        """Create an idle buffer; call start() to take over old journals and run the flusher."""
+        self.queue = queue.Queue(maxsize=max_size)
+        # Votes taken over from old journals or kept from a failed write, written before the queue.
+        self.pending = collections.deque()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.journal_path = journal
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.journal = None
+        # Votes in the journal, and how many of them, from the start, have been written.
+        self.journaled = 0
+        self.written = 0
+
+    def start(self, background=True):
+        """Open this process's journal, take over the votes of old ones and start the flusher thread."""
+        if self.journal_path:
+            if fcntl is None:
+                raise ImproperlyConfigured("POLLS_VOTE_JOURNAL needs file locks, which this system lacks.")
+            self.open_journal()
+            self.take_over_journals()
+        if background:
+            self.thread = threading.Thread(target=self.run, name="polls-vote-buffer", daemon=True)
+            self.thread.start()
+
+    def open_journal(self):
+        """Open and lock a journal of this process, keeping any votes a dead process left in it."""
+        for n in itertools.count():
+            path = f"{self.journal_path}.{os.getpid()}" + (f".{n}" if n else "")
+            journal = open(path, "a+", encoding="utf-8")
+            if lock(journal):
+                break
+            # Another host sharing the directory runs a process with the same id.
+            journal.close()
+        self.journal = journal
+        self.journal_file = path
+        entries, self.written = read_entries(journal)
+        self.journaled = len(entries)
+        self.pending.extend(entries[self.written:])
+        journal.seek(0, os.SEEK_END)
+
+    def take_over_journals(self):
+        """Move the votes of journals no running process holds into this process's journal."""
+        paths = glob.glob(glob.escape(self.journal_path) + ".*")
+        # The single journal shared by every process in earlier versions.
+        if os.path.exists(self.journal_path):
+            paths.append(self.journal_path)
+        for path in sorted(paths):
+            if path == self.journal_file:
+                continue
+            with open(path, "r+", encoding="utf-8") as journal:
+                if not lock(journal):
+                    continue
+                entries, written = read_entries(journal)
+                entries = entries[written:]
+                if entries:
+                    logger.info("Taking over %d journaled votes from %s.", len(entries), path)
+                    self.append(entries)
+                    self.pending.extend(entries)
+            os.remove(path)
+
+    def append(self, entries):
+        """Write votes to the journal and make sure they reach the disk."""
+        for user_id, question_id, choice_id, *cast_at in entries:
+            self.journal.write(json.dumps([user_id, question_id, choice_id, *(t.isoformat() for t in cast_at)]) + "\n")
+        self.journaled += len(entries)
+        self.sync()
+
+    def sync(self):
+        """Make sure what was written to the journal reaches the disk."""
+        self.journal.flush()
+        if self.fsync:
+            os.fsync(self.journal.fileno())
+
+    def submit(self, user_id, question_id, choice_id):
+        """
+        Queue a vote for writing.
+
+        Returns:
+            bool: True if the vote was journaled and queued, False if the buffer
+                  is full and the caller should write the vote itself.
+        """
+        entry = (user_id, question_id, choice_id, timezone.now())
+        with self.lock:
+            if self.queue.full():
+                return False
+            if self.journal:
+                self.append([entry])
+            self.queue.put_nowait(entry)
+        # While retrying a failed write, the flusher keeps to its delay.
+        if self.queue.qsize() >= self.batch_size and not self.pending:
+            self.wakeup.set()
+        return True
+
+    def run(self):
+        """Flush whenever a batch fills up or the flush interval passes, backing off while writes fail."""
+        delay = self.flush_interval
+        while not self.stopping.is_set():
+            self.wakeup.wait(delay)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            finally:
+                connections.close_all()
+            delay = min(delay * 2, MAX_RETRY_DELAY) if self.pending else self.flush_interval
+
+    def next_batch(self):
+        """Take up to batch_size votes, the pending ones first."""
+        batch = []
+        while self.pending and len(batch) < self.batch_size:
+            batch.append(self.pending.popleft())
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def flush(self):
+        """
+        Write the pending and queued votes to the database in batches.
+
+        Stops at the first batch that cannot be written, keeping it pending.
+
+        Returns:
+            int: The number of votes written or dropped.
+        """
+        taken = 0
+        while batch := self.next_batch():
+            kept = self.write(batch)
+            taken += len(batch) - len(kept)
+            self.checkpoint(len(batch) - len(kept))
+            if kept:
+                self.pending.extendleft(reversed(kept))
+                break
+        return taken
+
+    def write(self, batch):
+        """
+        Write one batch, falling back to one vote at a time if the batch is rejected.
+
+        Votes are written in journal order, so the ones written are always
+        the first of the batch.
+
+        Returns:
+            list: The rest of the batch, to retry because the database could not be reached.
+        """
+        try:
+            Vote.cast_many(batch)
+            return []
+        except (OperationalError, InterfaceError):
+            logger.warning("Could not write a batch of %d votes; will retry.", len(batch), exc_info=True)
+            return batch
+        except DatabaseError:
+            logger.warning("Vote batch of %d failed, writing votes one by one.", len(batch))
+        for n, entry in enumerate(batch):
+            try:
+                Vote.cast_many([entry])
+            except (OperationalError, InterfaceError):
+                return batch[n:]
+            except DatabaseError:
+                logger.exception("Dropped buffered vote %s.", entry)
+        return []
+
+    def checkpoint(self, count):
+        """Record that the next count journaled votes were written, emptying the journal once all of them are."""
+        if not self.journal or not count:
+            return
+        with self.lock:
+            self.written += count
+            if self.written == self.journaled:
+                self.journal.truncate(0)
+                self.journal.seek(0)
+                self.journaled = self.written = 0
+            else:
+                self.journal.write(json.dumps({"written": self.written}) + "\n")
+                self.sync()
+
+    def stop(self):
+        """Stop the flusher, write what it can and close the journal, which is removed if empty."""
+        self.stopping.set()
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join()
+        self.flush()
+        if self.journal:
+            empty = self.journal.tell() == 0
+            self.journal.close()
+            self.journal = None
+            if empty:
+                os.remove(self.journal_file)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_vote_buffer():
+    """Return the process-wide vote buffer, started on first use, or None when write-behind is disabled."""
+    global _buffer
+    if not settings.POLLS_VOTE_BUFFER_ENABLED:
+        return None
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                buffer = VoteBuffer(
+                    max_size=settings.POLLS_VOTE_BUFFER_SIZE,
+                    batch_size=settings.POLLS_VOTE_BUFFER_BATCH_SIZE,
+                    flush_interval=settings.POLLS_VOTE_BUFFER_INTERVAL,
+                    journal=settings.POLLS_VOTE_JOURNAL or None,
+                    fsync=settings.POLLS_VOTE_JOURNAL_FSYNC,
+                )
+                buffer.start()
+                atexit.register(buffer.stop)
+                _buffer = buffer
+    return _buffer
@@ -0,0 +1,121 @@
+"""
+Cache of computed poll results.
+
+Each question's tally payload is stored under a per-question version number.
+Any change to the question's votes or choices bumps the version once the
+change commits, so a cached payload is never served after a vote is counted.
+"""
+import threading
+import time
+
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .broadcast import broadcaster
+
+CACHE_ALIAS = "polls"
+QUESTIONS_VERSION_KEY = "questions-version"
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _version_key(question_id):
+    return f"results-version:{question_id}"
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _version(key, exists=None):
+    cache = _cache()
+    version = cache.get(key)
+    if version is None:
+        if exists is not None and not exists():
+            return None
+        # A version that was evicted must not restart at a number an old payload may still use.
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def results_version(question_id, exists=None):
+    """
+    Return the current results version of a question, creating one if it is missing.
+
+    For a question id that came from a request, pass exists, a callable that
+    checks the question is there. It is only called when the version is
+    missing, and no version is created, and None is returned, when it returns
+    False, so requests for made-up ids cannot fill the cache.
+    """
+    return _version(_version_key(question_id), exists)
+
+
+def questions_version():
+    """Return a version that changes whenever any question, choice or vote changes."""
+    return _version(QUESTIONS_VERSION_KEY)
+
+
+def get_results(question):
+    """Return the results payload of question, from the cache when possible."""
+    cache = _cache()
+    key = f"results:{question.pk}"
+    version = results_version(question.pk)
+    results = cache.get(key, version=version)
+    if results is None:
+        _count("misses")
+        # Read the primary: a lagging replica would be cached under the new version until the next vote.
+        results = question.get_results(using=DEFAULT_DB_ALIAS)
+        cache.set(key, results, version=version)
+    else:
+        _count("hits")
+    return results
+
+
+def _bump(key):
+    cache = _cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def bump_results_version(question_id):
+    """Make any cached results of a question stale right away."""
+    _bump(_version_key(question_id))
+    _bump(QUESTIONS_VERSION_KEY)
+
+
+def bump_questions_version():
+    """Make cached question listings stale, for bulk writes that bypass the model signals."""
+    _bump(QUESTIONS_VERSION_KEY)
+
+
+def results_changed(question_id):
+    """Expire the cached results of a question and push the new ones to live subscribers."""
+    bump_results_version(question_id)
+    broadcaster.notify(question_id)
+
+
+def invalidate_results(question_id):
+    """Make the cached results of a question stale once the current transaction commits."""
+    transaction.on_commit(lambda: results_changed(question_id))
+
+
+def cache_stats():
+    """Return a copy of the hit and miss counters."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_cache_stats():
+    """Set the hit and miss counters back to zero."""
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
@@ -0,0 +1,44 @@
+import csv
+import json
+from datetime import datetime
+
+from .models import Vote
+
+EXPORT_FIELDS = [
+    "vote_id", "user_id", "username", "question_id", "question_text", "choice_id", "choice_text", "cast_at", "changed_at",
+]
+
+
+class Echo:
+    """A file-like object that hands back what is written to it, for csv.writer."""
+
+    def write(self, value):
+        """Return value instead of storing it."""
+        return value
+
+
+def encode(row):
+    """Return a row with its times in ISO 8601; votes from before cast times were kept have none."""
+    return [value.isoformat() if isinstance(value, datetime) else value for value in row]
+
+
+def export_votes(votes=None, fmt="csv", chunk_size=2000):
+    """
+    Yield votes as lines of CSV or JSON Lines.
+
+    Rows are read with ``iterator(chunk_size=...)``, which uses a server-side
+    cursor on PostgreSQL, so memory use does not grow with the number of votes.
+    """
+    votes = Vote.objects.all() if votes is None else votes
+    rows = votes.order_by("pk").values_list(
+        "pk", "user_id", "user__username", "question_id", "question__question_text", "choice_id", "choice__choice_text",
+        "cast_at", "changed_at",
+    ).iterator(chunk_size=chunk_size)
+    if fmt == "jsonl":
+        for row in rows:
+            yield json.dumps(dict(zip(EXPORT_FIELDS, encode(row)))) + "\n"
+    else:
+        writer = csv.writer(Echo())
+        yield writer.writerow(EXPORT_FIELDS)
+        for row in rows:
+            yield writer.writerow(encode(row))
@@ -0,0 +1,119 @@
+"""
+Logging that never makes a request wait on the log output.
+
+QueueHandler puts records on an in-process queue, and a background thread
+formats them and writes them out, so a slow stdout or log collector delays
+only that thread. Messages keep their %-style arguments until then: a record
+dropped by level or sampling is never formatted, and one that is kept is
+formatted off the request thread. Pass plain values as arguments, not objects
+that may change before the record is written. JsonFormatter writes one JSON
+object per line, with any ``extra`` fields as keys of their own, and
+SampleFilter keeps only a share of a high-volume logger's records.
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+
+# Attributes every LogRecord has; anything else was passed in ``extra``.
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one line of JSON."""
+
+    def format(self, record):
+        """Return the JSON line of record."""
+        data = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in RECORD_ATTRIBUTES and not name.startswith("_"):
+                data[name] = value
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            data["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(data, default=str)
+
+
+class SampleFilter(logging.Filter):
+    """Lets through a random share of records below WARNING, and every record at WARNING or above."""
+
+    def __init__(self, rate=1.0, name=""):
+        """Keep about rate (0 to 1) of the records that are not warnings or errors."""
+        super().__init__(name)
+        self.rate = float(rate)
+
+    def filter(self, record):
+        """Return True if the record should be logged."""
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+
+class QueueListener(logging.handlers.QueueListener):
+    """QueueListener that, when stopped, waits for room in a full queue."""
+
+    def enqueue_sentinel(self):
+        """Queue the end marker after the records already waiting."""
+        self.queue.put(self._sentinel)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records for a background thread that writes them to a stream.
+
+    The formatter and level set on this handler are used for the output.
+    When the queue is full, records are dropped rather than making the caller
+    wait, and counted in ``dropped``. Closing the handler, which
+    ``logging.shutdown()`` does at exit, writes out every queued record first.
+    """
+
+    def __init__(self, stream=None, maxsize=10000):
+        """Start the thread writing to stream (default sys.stderr), queueing at most maxsize records."""
+        super().__init__(queue.Queue(maxsize))
+        self.target = logging.StreamHandler(stream if stream is not None else sys.stderr)
+        self.dropped = 0
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+        self.running = True
+
+    def setFormatter(self, fmt):
+        """Format the written records with fmt."""
+        super().setFormatter(fmt)
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        """Queue the record as it is; it is formatted by the writing thread."""
+        return record
+
+    def enqueue(self, record):
+        """Queue the record, or drop it if the queue is full."""
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """Wait until every queued record has been written."""
+        if self.running:
+            self.queue.join()
+        self.target.flush()
+
+    def close(self):
+        """Write out the queued records and stop the writing thread."""
+        if self.running:
+            self.running = False
+            self.listener.stop()
+            if self.dropped:
+                self.target.handle(logging.makeLogRecord({
+                    "name": __name__, "levelno": logging.WARNING, "levelname": "WARNING",
+                    "msg": "%d log records were dropped because the log queue was full.", "args": (self.dropped,),
+                }))
+        self.target.close()
+        super().close()
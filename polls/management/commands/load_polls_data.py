@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+from collections import defaultdict
+
+from django.contrib.auth.models import User
+from django.core import serializers
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from polls.cache import invalidate_results
+from polls.models import Choice, LoadedFixture, Question, Vote
+
+DEFAULT_FILES = ["data/polls-v4.json", "data/users.json", "data/votes-v4.json"]
+
+# Models these fixtures may create; anything else in older dumps (sessions,
+# permissions, admin log entries) belongs to other apps and is skipped.
+LOADABLE_MODELS = ["auth.user", "polls.question", "polls.choice", "polls.vote"]
+
+
+def iter_fixture(path, chunk_size=1 << 16):
+    """Yield the objects of a JSON fixture one at a time without reading the whole file."""
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8") as fixture:
+        buffer = fixture.read(chunk_size).lstrip()
+        if not buffer.startswith("["):
+            raise CommandError(f"{path} is not a JSON fixture list.")
+        pos = 1
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+            try:
+                obj, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                more = fixture.read(chunk_size)
+                if not more:
+                    raise CommandError(f"{path} ends in the middle of an object.")
+                buffer, pos = buffer[pos:] + more, 0
+                continue
+            yield obj
+            if pos >= chunk_size:
+                buffer, pos = buffer[pos:], 0
+
+
+def file_hash(path):
+    """Return the SHA-256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as data:
+        for chunk in iter(lambda: data.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Command(BaseCommand):
+    help = (
+        "Load poll fixtures (any data/polls-v*.json format, users and votes) with bulk upserts, "
+        "skipping files that have not changed since they were last loaded."
+    )
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument("files", nargs="*", default=DEFAULT_FILES, help="Fixture files to load, in order.")
+        parser.add_argument("--batch-size", type=int, default=2000, help="Rows per bulk insert (default 2000).")
+        parser.add_argument("--force", action="store_true", help="Load files even if they have not changed.")
+
+    def handle(self, *args, **options):
+        """Load each fixture file that changed, then bring the vote tallies up to date."""
+        self.batch_size = options["batch_size"]
+        loaded_polls = False
+        for path in options["files"]:
+            if not os.path.exists(path):
+                self.stdout.write(f"{path}: not found, skipped.")
+                continue
+            name = os.path.basename(path)
+            digest = file_hash(path)
+            if not options["force"] and LoadedFixture.objects.filter(name=name, sha256=digest).exists():
+                self.stdout.write(f"{path}: unchanged, skipped.")
+                continue
+            with transaction.atomic():
+                counts, skipped = self.load(path)
+                LoadedFixture.objects.update_or_create(name=name, defaults={"sha256": digest})
+            loaded_polls = loaded_polls or any(label.startswith("polls.") for label in counts)
+            summary = ", ".join(f"{n} {label}" for label, n in counts.items()) or "nothing"
+            self.stdout.write(self.style.SUCCESS(f"{path}: loaded {summary}."))
+            if skipped:
+                self.stdout.write(f"{path}: skipped {skipped} objects of other models.")
+        if loaded_polls:
+            call_command("reconcile_tallies", stdout=self.stdout)
+
+    def load(self, path):
+        """Upsert the objects of one fixture file and return the counts per model and the number skipped."""
+        self.pending = defaultdict(list)
+        self.choice_questions = {}
+        self.skipped = 0
+        counts = defaultdict(int)
+        objects = (obj for obj in iter_fixture(path) if self.wanted(obj))
+        for deserialized in serializers.deserialize("python", objects, ignorenonexistent=True):
+            obj = deserialized.object
+            label = obj._meta.label_lower
+            if isinstance(obj, Choice):
+                self.choice_questions[obj.pk] = obj.question_id
+            self.pending[obj.__class__].append(deserialized)
+            counts[label] += 1
+            if len(self.pending[obj.__class__]) >= self.batch_size:
+                self.flush(obj.__class__)
+        for model in list(self.pending):
+            self.flush(model)
+        written = [model for model in (User, Question, Choice, Vote) if counts.get(model._meta.label_lower)]
+        self.reset_sequences(written)
+        return dict(counts), self.skipped
+
+    def wanted(self, obj):
+        """Return True if obj belongs to a model this command loads, counting the ones it skips."""
+        if obj.get("model") in LOADABLE_MODELS:
+            return True
+        self.skipped += 1
+        return False
+
+    def flush(self, model):
+        """Bulk upsert the pending objects of model by primary key."""
+        batch = self.pending.pop(model, [])
+        if not batch:
+            return
+        objs = [deserialized.object for deserialized in batch]
+        if model is Vote:
+            self.fill_vote_questions(objs)
+        update_fields = [
+            field.name for field in model._meta.concrete_fields if field.editable and not field.primary_key
+        ]
+        model.objects.bulk_create(
+            objs,
+            batch_size=self.batch_size,
+            update_conflicts=True,
+            unique_fields=[model._meta.pk.name],
+            update_fields=update_fields,
+        )
+        for deserialized in batch:
+            for field_name, values in (deserialized.m2m_data or {}).items():
+                if values:
+                    getattr(deserialized.object, field_name).add(*values)
+        if model in (Question, Choice, Vote):
+            for question_id in {obj.question_id if model is not Question else obj.pk for obj in objs}:
+                invalidate_results(question_id)
+
+    def fill_vote_questions(self, votes):
+        """Set the question of votes from fixtures that predate Vote.question."""
+        missing = {vote.choice_id for vote in votes if vote.question_id is None} - set(self.choice_questions)
+        if missing:
+            self.choice_questions.update(
+                Choice.objects.filter(pk__in=missing).values_list("pk", "question_id")
+            )
+        for vote in votes:
+            if vote.question_id is None:
+                vote.question_id = self.choice_questions.get(vote.choice_id)
+
+    def reset_sequences(self, models):
+        """Move primary key sequences past the ids that were loaded, as loaddata does."""
+        statements = connection.ops.sequence_reset_sql(no_style(), models)
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
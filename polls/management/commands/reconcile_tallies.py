@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from polls.models import Choice, Question
+
+
+class Command(BaseCommand):
+    help = "Rebuild the stored vote tallies of choices and questions from the Vote table."
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report drift without writing the corrected tallies.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of rows written per bulk update (default 1000).",
+        )
+
+    def handle(self, *args, **options):
+        """Compare every stored tally with the real vote count and fix the ones that drifted."""
+        dry_run = options["dry_run"]
+        batch_size = options["batch_size"]
+
+        with transaction.atomic():
+            choices = self.reconcile(
+                Choice.objects.annotate(actual=Count("vote")), batch_size, dry_run
+            )
+            questions = self.reconcile(
+                Question.objects.annotate(actual=Count("choice__vote")), batch_size, dry_run
+            )
+
+        verb = "Found" if dry_run else "Fixed"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {choices} choice tallies and {questions} question tallies out of sync."
+        ))
+
+    def reconcile(self, queryset, batch_size, dry_run):
+        """Set vote_count to the annotated actual count for each drifted row and return how many drifted."""
+        drifted = []
+        total = 0
+        for obj in queryset.only("pk", "vote_count").order_by("pk").iterator(chunk_size=batch_size):
+            if obj.vote_count == obj.actual:
+                continue
+            self.stdout.write(
+                f"{obj._meta.model_name} {obj.pk}: stored {obj.vote_count}, actual {obj.actual}"
+            )
+            obj.vote_count = obj.actual
+            drifted.append(obj)
+            total += 1
+            if len(drifted) >= batch_size:
+                self.write(queryset.model, drifted, dry_run)
+                drifted = []
+        self.write(queryset.model, drifted, dry_run)
+        return total
+
+    def write(self, model, objs, dry_run):
+        """Bulk update the vote_count of objs unless this is a dry run."""
+        if objs and not dry_run:
+            model.objects.bulk_update(objs, ["vote_count"])
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from polls.rollups import rebuild_rollups, roll_up_votes
+
+
+class Command(BaseCommand):
+    help = (
+        "Add the votes cast or changed since the last run to the per-minute, per-hour and per-day "
+        "turnout rollups. Run it every minute, or keep it running with --every."
+    )
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument("--rebuild", action="store_true", help="Delete the rollups and count every vote again.")
+        parser.add_argument("--every", type=float, help="Keep running, rolling up new votes every this many seconds.")
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="Rollup rows written per bulk upsert (default 1000).")
+
+    def handle(self, *args, **options):
+        """Roll up the new votes once, or repeatedly with --every."""
+        if options["rebuild"]:
+            if options["every"]:
+                raise CommandError("--rebuild cannot be combined with --every.")
+            self.report(rebuild_rollups())
+            return
+        while True:
+            self.report(roll_up_votes(batch_size=options["batch_size"]))
+            if not options["every"]:
+                return
+            time.sleep(options["every"])
+
+    def report(self, result):
+        """Write what one run counted."""
+        if result["start"] == result["end"]:
+            self.stdout.write("No new votes to roll up.")
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Rolled up {result['votes']} votes and {result['changes']} changes "
+            f"up to {timezone.localtime(result['end']):%Y-%m-%d %H:%M:%S}."
+        ))
@@ -0,0 +1,55 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.benchmark.runner import DEFAULT_MIX, SESSION_ENGINES, BenchmarkRunner, parse_mix
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a weighted mix of index, detail, results and vote requests and report latency "
+        "percentiles, throughput and queries per request as JSON. Votes are really cast."
+    )
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        default_mix = ",".join(f"{kind}={weight}" for kind, weight in DEFAULT_MIX.items())
+        parser.add_argument("--requests", type=int, default=1000, help="Measured requests (default 1000).")
+        parser.add_argument("--warmup", type=int, default=100, help="Unmeasured requests sent first (default 100).")
+        parser.add_argument("--mix", default=default_mix, help=f"Request weights (default {default_mix}).")
+        parser.add_argument("--async", dest="use_async", action="store_true",
+                            help="Send requests through the async (ASGI) request path.")
+        parser.add_argument("--clients", type=int, default=20, help="Logged-in benchmark users to rotate (default 20).")
+        parser.add_argument("--sample", type=int, default=1000, help="Newest open questions to request (default 1000).")
+        parser.add_argument("--prefix", default="bench", help="Prefix of the seeded usernames (default bench).")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed of the request sequence (default 0).")
+        parser.add_argument("--session-engine", choices=SESSION_ENGINES,
+                            help="Session backend to use instead of SESSION_ENGINE.")
+        parser.add_argument("--user-cache-seconds", type=int,
+                            help="Use this instead of POLLS_USER_CACHE_SECONDS (0 loads the user on every request).")
+        parser.add_argument("--label", default="", help="Name of this run, such as a release, stored in the report.")
+        parser.add_argument("-o", "--output", help="File to write the JSON report to (default stdout).")
+
+    def handle(self, *args, **options):
+        """Run the benchmark and write its report."""
+        try:
+            runner = BenchmarkRunner(
+                mix=parse_mix(options["mix"]), clients=options["clients"], sample=options["sample"],
+                prefix=options["prefix"], use_async=options["use_async"], random_seed=options["seed"],
+                session_engine=options["session_engine"], user_cache_seconds=options["user_cache_seconds"],
+            )
+            report = runner.run(options["requests"], warmup=options["warmup"], label=options["label"])
+        except ValueError as error:
+            raise CommandError(error)
+
+        text = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                output.write(text + "\n")
+            overall = report["overall"]
+            self.stdout.write(self.style.SUCCESS(
+                f"{overall['requests']} requests, p50 {overall.get('p50_ms')} ms, p99 {overall.get('p99_ms')} ms, "
+                f"{report['throughput_rps']} req/s. Report written to {options['output']}."
+            ))
+        else:
+            self.stdout.write(text)
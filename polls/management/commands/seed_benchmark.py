@@ -0,0 +1,38 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.benchmark.seed import seed
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk generate synthetic users, questions, choices and votes for benchmarks. "
+        "Use an empty database; the rows are not meant to be mixed with real polls."
+    )
+
+    def add_arguments(self, parser):
+        """Add the command line options."""
+        parser.add_argument("--users", type=int, default=1000, help="Users to create (default 1000).")
+        parser.add_argument("--questions", type=int, default=1000, help="Questions to create (default 1000).")
+        parser.add_argument("--choices", type=int, default=4, help="Choices per question (default 4).")
+        parser.add_argument("--votes", type=int, default=100000, help="Votes to cast in total (default 100000).")
+        parser.add_argument("--days", type=int, default=365, help="Spread publication dates over this many days.")
+        parser.add_argument("--prefix", default="bench", help="Prefix of usernames and question texts (default bench).")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Rows per bulk insert (default 5000).")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed, for reproducible data (default 0).")
+
+    def handle(self, *args, **options):
+        """Generate the data and report how much was written."""
+        prefix = options["prefix"]
+        if User.objects.filter(username__startswith=f"{prefix}-").exists():
+            raise CommandError(f"Users named {prefix}-* already exist; choose another --prefix.")
+        try:
+            written = seed(
+                options["users"], options["questions"], options["choices"], options["votes"],
+                prefix=prefix, days=options["days"], batch_size=options["batch_size"],
+                random_seed=options["seed"], log=self.stdout.write,
+            )
+        except ValueError as error:
+            raise CommandError(error)
+        summary = ", ".join(f"{count} {name}" for name, count in written.items())
+        self.stdout.write(self.style.SUCCESS(f"Seeded {summary}."))
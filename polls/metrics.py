@@ -0,0 +1,154 @@
+"""
+In-process request metrics in the Prometheus text format.
+
+Each process keeps its own histograms, so a scraper sees the process that
+answered it; with several workers, scrape each one or sum them upstream.
+Only clients from POLLS_METRICS_ALLOWED_IPS may scrape.
+"""
+import threading
+from bisect import bisect_left
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_GET
+
+from .broadcast import broadcaster
+from .cache import cache_stats
+from .ratelimit import get_client_ip
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+# Clients choose the method, so any other is counted as "other" to keep the series bounded.
+METHODS = frozenset({"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"})
+
+
+def escape(value):
+    """Escape a label value for the text exposition format."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=""):
+    """Return a Prometheus label set such as ``{view="polls:index"}``."""
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """A monotonically increasing count per label set."""
+
+    def __init__(self, name, documentation, labels=()):
+        """Create a counter called name with the given label names."""
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        """Add amount to the count of label_values."""
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        """Return the counter in the text exposition format."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            values = sorted(self.values.items())
+        for label_values, value in values:
+            lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    """Observations counted into fixed buckets per label set."""
+
+    def __init__(self, name, documentation, buckets, labels=()):
+        """Create a histogram called name with the given upper bucket bounds and label names."""
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        """Count value for label_values."""
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(label_values)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), then the sum.
+                series = self.values[label_values] = [0] * (len(self.buckets) + 1) + [0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        """Return the histogram in the text exposition format, with cumulative buckets."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            values = sorted((label_values, list(series)) for label_values, series in self.values.items())
+        for label_values, series in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series):
+                cumulative += count
+                labels = format_labels(self.labels, label_values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labels, label_values)
+            lines.append(f"{self.name}_sum{labels} {round(series[-1], 6)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+responses = Counter("polls_responses_total", "Responses sent, by view and status code.", ("view", "method", "status"))
+request_seconds = Histogram(
+    "polls_request_duration_seconds", "Time spent handling a request.", SECONDS_BUCKETS, ("view",)
+)
+db_seconds = Histogram(
+    "polls_request_db_seconds", "Time a request spent waiting on database queries.", SECONDS_BUCKETS, ("view",)
+)
+render_seconds = Histogram(
+    "polls_request_render_seconds", "Time a request spent rendering its template.", SECONDS_BUCKETS, ("view",)
+)
+request_queries = Histogram(
+    "polls_request_queries", "Database queries run by a request.", QUERY_BUCKETS, ("view",)
+)
+REQUEST_METRICS = [responses, request_seconds, db_seconds, render_seconds, request_queries]
+
+
+def observe_request(view, method, status, total, timing):
+    """Record one finished request."""
+    responses.inc(view, method if method in METHODS else "other", status)
+    request_seconds.observe(total, view)
+    db_seconds.observe(timing.db, view)
+    render_seconds.observe(timing.render, view)
+    request_queries.observe(timing.queries, view)
+
+
+def render_metrics():
+    """Return all metrics of this process in the Prometheus text format."""
+    lines = []
+    for metric in REQUEST_METRICS:
+        lines.extend(metric.render())
+    stats = cache_stats()
+    lines += [
+        "# HELP polls_results_cache_requests_total Results cache lookups, by outcome.",
+        "# TYPE polls_results_cache_requests_total counter",
+        f'polls_results_cache_requests_total{{result="hit"}} {stats["hits"]}',
+        f'polls_results_cache_requests_total{{result="miss"}} {stats["misses"]}',
+        "# HELP polls_sse_subscribers Open live results streams.",
+        "# TYPE polls_sse_subscribers gauge",
+        f"polls_sse_subscribers {broadcaster.count}",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+@require_GET
+@never_cache
+def metrics(request):
+    """Return the metrics of this process for a Prometheus scraper on an allowed IP."""
+    if get_client_ip(request) not in settings.POLLS_METRICS_ALLOWED_IPS:
+        raise Http404
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,193 @@
+"""
+Middleware of the polls app.
+
+RequestTimingMiddleware times database queries, template rendering and the
+whole request. The numbers are sent back in a ``Server-Timing`` header,
+recorded in the histograms of ``polls.metrics`` and, past
+``POLLS_SLOW_REQUEST_MS``, logged as a warning on the ``polls.requests``
+logger. Queries are timed by an execute wrapper installed once on every
+database connection, which does no work outside a request.
+
+ReadYourWritesMiddleware gives ``polls.routers.ReplicaRouter`` the state of
+the current request.
+"""
+import logging
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .metrics import observe_request
+from .routers import PRIMARY_COOKIE, RoutingState, routing_state
+
+logger = logging.getLogger("polls.requests")
+
+_current = ContextVar("polls_request_timing", default=None)
+
+
+class RequestTiming:
+    """The database and rendering time of one request."""
+
+    __slots__ = ("queries", "db", "render", "render_started")
+
+    def __init__(self):
+        """Start with nothing recorded."""
+        self.queries = 0
+        self.db = 0.0
+        self.render = 0.0
+        self.render_started = None
+
+    def rendered(self, response):
+        """Note that the response finished rendering; a post-render callback."""
+        self.render = time.perf_counter() - self.render_started
+
+
+def time_query(execute, sql, params, many, context):
+    """Run a query, adding its duration to the timing of the current request."""
+    timing = _current.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timing.db += time.perf_counter() - started
+        timing.queries += 1
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """Time the queries of a newly opened database connection; a connection_created receiver."""
+    if time_query not in connection.execute_wrappers:
+        # Innermost, so execute_wrapper() blocks that pop their own wrapper are not disturbed.
+        connection.execute_wrappers.insert(0, time_query)
+
+
+def start_render(response):
+    """Time the rendering of a template response that is about to be rendered."""
+    timing = _current.get()
+    if timing is not None:
+        timing.render_started = time.perf_counter()
+        response.add_post_render_callback(timing.rendered)
+    return response
+
+
+class RequestTimingMiddleware:
+    """Measures each request; list it first in MIDDLEWARE so the total covers the other middleware."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        """Wrap get_response, matching its sync or async mode."""
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+            # The handler would run a sync hook through a thread in async mode, so offer an async one.
+            self.process_template_response = self.aprocess_template_response
+
+    def __call__(self, request):
+        """Time a request to a sync handler."""
+        if self.is_async:
+            return self.__acall__(request)
+        timing = RequestTiming()
+        token = _current.set(timing)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timing, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        """Time a request to an async handler."""
+        timing = RequestTiming()
+        token = _current.set(timing)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timing, time.perf_counter() - started)
+
+    def process_template_response(self, request, response):
+        """Start the render clock; the handler renders right after the last of these hooks, which is this one."""
+        return start_render(response)
+
+    async def aprocess_template_response(self, request, response):
+        """Start the render clock of a response rendered by an async handler."""
+        return start_render(response)
+
+    def finish(self, request, response, timing, total):
+        """Report the timing of a finished request."""
+        match = request.resolver_match
+        view = match.view_name if match else "<unmatched>"
+        observe_request(view, request.method, response.status_code, total, timing)
+        if settings.POLLS_SERVER_TIMING:
+            app = max(total - timing.db - timing.render, 0.0)
+            response["Server-Timing"] = (
+                f'db;dur={timing.db * 1000:.2f};desc="{timing.queries} queries", '
+                f"render;dur={timing.render * 1000:.2f}, app;dur={app * 1000:.2f}, total;dur={total * 1000:.2f}"
+            )
+        slow_ms = settings.POLLS_SLOW_REQUEST_MS
+        if slow_ms and total * 1000 >= slow_ms:
+            logger.warning(
+                "Slow request: %s %s took %.0f ms (%d queries, %.0f ms in the database, %.0f ms rendering)",
+                request.method, request.get_full_path(), total * 1000,
+                timing.queries, timing.db * 1000, timing.render * 1000,
+                extra={"event": "slow_request", "view": view, "status": response.status_code},
+            )
+        return response
+
+
+class ReadYourWritesMiddleware:
+    """Keeps a client on the primary for a short while after any request of theirs writes."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        """Wrap get_response, matching its sync or async mode."""
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        """Route the reads of a request to a sync handler."""
+        if self.is_async:
+            return self.__acall__(request)
+        if not settings.POLLS_DATABASE_REPLICAS:
+            return self.get_response(request)
+        state = RoutingState(pinned=self.needs_primary(request))
+        token = routing_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            routing_state.reset(token)
+        return self.finish(response, state)
+
+    async def __acall__(self, request):
+        """Route the reads of a request to an async handler."""
+        if not settings.POLLS_DATABASE_REPLICAS:
+            return await self.get_response(request)
+        state = RoutingState(pinned=self.needs_primary(request))
+        token = routing_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            routing_state.reset(token)
+        return self.finish(response, state)
+
+    def needs_primary(self, request):
+        """Return True if the request writes, or its client wrote recently, so it must read the primary."""
+        return request.method not in ("GET", "HEAD", "OPTIONS") or PRIMARY_COOKIE in request.COOKIES
+
+    def finish(self, response, state):
+        """Pin the client to the primary if the request wrote anything."""
+        if state.wrote:
+            response.set_cookie(
+                PRIMARY_COOKIE, "1", max_age=settings.POLLS_READ_YOUR_WRITES_SECONDS, httponly=True, samesite="Lax",
+            )
+        return response
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:16
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_vote_counts(apps, schema_editor):
+    """Set the stored vote counts of every choice and question from the existing votes."""
+    Choice = apps.get_model('polls', 'Choice')
+    Question = apps.get_model('polls', 'Question')
+    Vote = apps.get_model('polls', 'Vote')
+    per_choice = (Vote.objects.filter(choice=OuterRef('pk')).order_by()
+                  .values('choice').annotate(n=Count('pk')).values('n'))
+    Choice.objects.update(vote_count=Coalesce(Subquery(per_choice), 0))
+    per_question = (Vote.objects.filter(choice__question=OuterRef('pk')).order_by()
+                    .values('choice__question').annotate(n=Count('pk')).values('n'))
+    Question.objects.update(vote_count=Coalesce(Subquery(per_question), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0003_remove_choice_votes_vote'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='choice',
+            name='vote_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='vote_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_vote_counts, migrations.RunPython.noop),
+    ]
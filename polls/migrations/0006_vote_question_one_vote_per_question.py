@@ -0,0 +1,63 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_vote_questions(apps, schema_editor):
+    """Fill in the question of each vote, keep the latest vote of each user on each question and recount."""
+    Choice = apps.get_model('polls', 'Choice')
+    Question = apps.get_model('polls', 'Question')
+    Vote = apps.get_model('polls', 'Vote')
+    Vote.objects.update(
+        question_id=Subquery(Choice.objects.filter(pk=OuterRef('choice_id')).values('question_id'))
+    )
+    # Keep only the latest vote of each user on each question.
+    latest = (Vote.objects.values('user_id', 'question_id').order_by()
+              .annotate(keep=Max('pk'), n=Count('pk')).filter(n__gt=1))
+    removed = 0
+    for row in latest:
+        removed += Vote.objects.filter(
+            user_id=row['user_id'], question_id=row['question_id']
+        ).exclude(pk=row['keep']).delete()[0]
+    if removed:
+        per_choice = (Vote.objects.filter(choice=OuterRef('pk')).order_by()
+                      .values('choice').annotate(n=Count('pk')).values('n'))
+        Choice.objects.update(vote_count=Coalesce(Subquery(per_choice), 0))
+        per_question = (Vote.objects.filter(question=OuterRef('pk')).order_by()
+                        .values('question').annotate(n=Count('pk')).values('n'))
+        Question.objects.update(vote_count=Coalesce(Subquery(per_question), 0))
+    # Check the deferred foreign keys the updates queued now: PostgreSQL refuses to alter a
+    # table with pending trigger events, and the operations below alter polls_vote.
+    schema_editor.connection.check_constraints(table_names=['polls_vote'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0005_hot_path_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vote',
+            name='question',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='polls.question'),
+        ),
+        migrations.RunPython(fill_vote_questions, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='vote',
+            name='question',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.question'),
+        ),
+        migrations.RemoveIndex(
+            model_name='vote',
+            name='polls_vote_user_choice_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(fields=('user', 'question'), name='polls_vote_one_per_question'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:17
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0007_loadedfixture'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('processed_until', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VoteRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(
+                    choices=[('minute', 'minute'), ('hour', 'hour'), ('day', 'day')], max_length=6
+                )),
+                ('bucket', models.DateTimeField()),
+                ('cast_count', models.PositiveIntegerField(default=0)),
+                ('change_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        # cast_at is added without a default, so existing votes keep null times instead of the time of the migration.
+        migrations.AddField(
+            model_name='vote',
+            name='cast_at',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='time cast'),
+        ),
+        migrations.AddField(
+            model_name='vote',
+            name='changed_at',
+            field=models.DateTimeField(editable=False, null=True, verbose_name='time last changed'),
+        ),
+        migrations.AlterField(
+            model_name='vote',
+            name='cast_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, null=True, verbose_name='time cast'),
+        ),
+        migrations.AddIndex(
+            model_name='vote',
+            index=models.Index(fields=['changed_at'], name='polls_vote_changed_at_idx'),
+        ),
+        migrations.AddField(
+            model_name='voterollup',
+            name='choice',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.choice'),
+        ),
+        migrations.AddField(
+            model_name='voterollup',
+            name='question',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='polls.question'),
+        ),
+        migrations.AddConstraint(
+            model_name='voterollup',
+            constraint=models.UniqueConstraint(
+                fields=('question', 'granularity', 'bucket', 'choice'), name='polls_voterollup_bucket'
+            ),
+        ),
+    ]
@@ -1,9 +1,61 @@
+import functools
+import operator
+from collections import Counter
+from django.conf import settings
 from django.contrib import admin
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When, Window
+from django.db.models.functions import Coalesce, Greatest, NullIf, Round
 from django.utils import timezone
 from datetime import timedelta
 from django.contrib.auth.models import User
 
+from .cache import invalidate_results
+
+
+class QuestionQuerySet(models.QuerySet):
+    """
+    Questions selected or labelled by whether they are open at a given moment.
+
+    Every method takes the moment as ``now`` (default: the current time), so a
+    page can apply several of them against the same instant. The filters are
+    plain conditions on pub_date and end_date, served by their indexes.
+    """
+
+    def with_status(self, now=None):
+        """Annotate each question's ``status``: Question.UPCOMING, OPEN or CLOSED."""
+        now = now or timezone.now()
+        return self.annotate(status=Case(
+            When(pub_date__gt=now, then=Value(Question.UPCOMING)),
+            When(end_date__lt=now, then=Value(Question.CLOSED)),
+            default=Value(Question.OPEN),
+            output_field=models.CharField(),
+        ))
+
+    def upcoming(self, now=None):
+        """Return the questions that are not published yet."""
+        return self.filter(pub_date__gt=now or timezone.now())
+
+    def published(self, now=None):
+        """Return the questions published by now."""
+        return self.filter(pub_date__lte=now or timezone.now())
+
+    def open(self, now=None):
+        """Return the questions that can be voted on now."""
+        now = now or timezone.now()
+        return self.published(now).filter(Q(end_date__isnull=True) | Q(end_date__gte=now))
+
+    def closing_soon(self, now=None, within=None):
+        """Return the open questions whose voting ends within the given timedelta (default POLLS_CLOSING_SOON_HOURS)."""
+        now = now or timezone.now()
+        within = within if within is not None else timedelta(hours=settings.POLLS_CLOSING_SOON_HOURS)
+        return self.published(now).filter(end_date__gte=now, end_date__lte=now + within)
+
+    def closed(self, now=None):
+        """Return the published questions whose voting has ended."""
+        now = now or timezone.now()
+        return self.published(now).filter(end_date__lt=now)
+
 
 class Question(models.Model):
     """
@@ -13,11 +65,31 @@ class Question(models.Model):
         question_text (str): The text of the question.
         pub_date (datetime): The date and time the question was published.
         end_date (datetime, optional): The date and time when voting ends.
+        vote_count (int): The stored total of votes cast on this question.
     """
 
     question_text = models.CharField(max_length=200)
     pub_date = models.DateTimeField("date published", default=timezone.now)
     end_date = models.DateTimeField("date ending", null=True, blank=True)
+    vote_count = models.PositiveIntegerField(default=0, editable=False)
+
+    UPCOMING = "upcoming"
+    OPEN = "open"
+    CLOSED = "closed"
+
+    objects = QuestionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # The index lists published questions newest first, keyed on (pub_date, id).
+            models.Index(fields=["-pub_date", "-id"], name="polls_question_pub_date_idx"),
+            # Closing-date checks only ever look at questions that have an end_date.
+            models.Index(
+                fields=["end_date"],
+                name="polls_question_end_date_idx",
+                condition=Q(end_date__isnull=False),
+            ),
+        ]
 
     def __str__(self):
         return self.question_text
@@ -39,6 +111,37 @@ class Question(models.Model):
             return self.pub_date <= now <= self.end_date
         return now >= self.pub_date
 
+    def get_results(self, using=None):
+        """
+        Return the vote tally of this question as plain data.
+
+        Counts, percentages and the total are computed in a single query, so
+        rendering the result does no further database access.
+
+        Args:
+            using (str, optional): Database alias to read from instead of the routed one.
+
+        Returns:
+            dict: ``total`` votes and a list of ``choices``, each a dict with
+                  ``id``, ``choice_text``, ``votes`` and ``percent``.
+        """
+        total = Window(Sum("vote_count"))
+        choices = list(
+            self.choice_set.db_manager(using).order_by("pk").annotate(
+                votes=F("vote_count"),
+                total=total,
+                percent=Coalesce(
+                    Round(F("vote_count") * 100.0 / NullIf(total, 0), 1),
+                    0.0,
+                    output_field=models.FloatField(),
+                ),
+            ).values("id", "choice_text", "votes", "total", "percent")
+        )
+        total_votes = choices[0]["total"] if choices else 0
+        for choice in choices:
+            del choice["total"]
+        return {"total": total_votes, "choices": choices}
+
     @admin.display(
         boolean=True,
         ordering="pub_date",
@@ -63,29 +166,322 @@ class Choice(models.Model):
     Attributes:
         question (Question): The question this choice is related to.
         choice_text (str): The text of the choice.
-        votes (int): The number of votes this choice has received.
+        vote_count (int): The stored number of votes this choice has received.
     """
 
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
     choice_text = models.CharField(max_length=200)
+    vote_count = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # Results list the choices of one question in id order.
+            models.Index(fields=["question", "id"], name="polls_choice_question_id_idx"),
+        ]
 
     @property
     def votes(self):
         """Return the number of votes for this choice."""
-        return self.vote_set.count()
+        return self.vote_count
 
     def __str__(self):
         return self.choice_text
 
 
+class VoteQuerySet(models.QuerySet):
+    """Votes, deleted together with their share of the stored tallies."""
+
+    def delete(self):
+        """Delete the votes and take them off the stored tallies of their choices and questions."""
+        with transaction.atomic(using=self.db):
+            remove_from_tallies(self)
+            return super().delete()
+
+
 class Vote(models.Model):
     """
     Represent a vote by a user for a choice in a poll.
 
     Attributes:
         choice (Choice): The choice that was voted for.
+        question (Question): The question of the choice, stored so the database
+            can allow only one vote per user per question.
         user (User): The user who cast the vote.
+        cast_at (datetime): When the vote was first cast; null for votes that
+            predate the timestamps.
+        changed_at (datetime): When the vote was cast or last changed to
+            another choice; the rollups read new votes by this time. It is
+            exactly cast_at until the vote is changed, and null for votes that
+            predate the timestamps or were bulk created without it.
     """
 
     choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    cast_at = models.DateTimeField("time cast", default=timezone.now, null=True, editable=False)
+    changed_at = models.DateTimeField("time last changed", null=True, editable=False)
+
+    objects = VoteQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # Also serves as the index for looking up a user's vote on a question.
+            models.UniqueConstraint(fields=["user", "question"], name="polls_vote_one_per_question"),
+        ]
+        indexes = [
+            # The rollup command reads the votes changed since its watermark.
+            models.Index(fields=["changed_at"], name="polls_vote_changed_at_idx"),
+            models.Index(fields=["cast_at"], name="polls_vote_cast_at_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        """Fill in the question from the choice, and the changed time from the cast time, before saving."""
+        if self.question_id is None:
+            self.question_id = self.choice.question_id
+        if self.changed_at is None:
+            self.changed_at = self.cast_at
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        """Delete the vote and take it off the stored tallies of its choice and question."""
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            add_vote_counts(Choice, {self.choice_id: -1})
+            add_vote_counts(Question, {self.question_id: -1})
+            invalidate_results(self.question_id)
+        return result
+
+    @classmethod
+    def cast(cls, user, choice):
+        """
+        Record user's vote for choice and keep the stored tallies in step.
+
+        The vote row is locked while it is changed and the unique constraint
+        rejects a second insert, so concurrent submissions from the same user
+        leave exactly one vote and correct tallies.
+
+        Returns:
+            int or None: The id of the choice the user had voted for before,
+                         or None if this is their first vote on the question.
+        """
+        try:
+            return cls._cast(user, choice)
+        except IntegrityError:
+            # A concurrent request inserted this user's vote first and has
+            # committed by now, so cast again as a change of that vote.
+            return cls._cast(user, choice)
+
+    @classmethod
+    def _cast(cls, user, choice):
+        question_id = choice.question_id
+        with transaction.atomic():
+            previous = (
+                cls.objects.select_for_update()
+                .filter(user=user, question_id=question_id)
+                .values_list("choice_id", flat=True)
+                .first()
+            )
+            if previous is None:
+                cls.objects.create(user=user, question_id=question_id, choice=choice)
+                adjust_tally(choice.pk, 1, question_id=question_id)
+            elif previous != choice.pk:
+                cls.objects.filter(user=user, question_id=question_id).update(choice=choice, changed_at=timezone.now())
+                Choice.objects.filter(pk=previous).update(vote_count=F("vote_count") - 1)
+                Choice.objects.filter(pk=choice.pk).update(vote_count=F("vote_count") + 1)
+                # update() sends no signals, so expire the cached results here.
+                invalidate_results(question_id)
+        return previous
+
+    @classmethod
+    def cast_many(cls, votes):
+        """
+        Record many votes in one transaction with bulk writes.
+
+        Args:
+            votes: Iterable of (user_id, question_id, choice_id) tuples, or
+                (user_id, question_id, choice_id, cast_at) ones for votes cast
+                earlier, such as buffered ones. When a user votes on the same
+                question more than once, the last one wins, and a vote cast
+                before the stored one last changed is ignored.
+
+        Returns:
+            dict: Maps each (user_id, question_id) to the id of the choice the
+                  user had voted for before, or None for a first vote.
+        """
+        latest = {}
+        for user_id, question_id, choice_id, *cast_at in votes:
+            latest[(user_id, question_id)] = (choice_id, cast_at[0] if cast_at else None)
+        if not latest:
+            return {}
+        try:
+            return cls._cast_many(latest)
+        except IntegrityError:
+            # A concurrent request inserted one of these votes first, so
+            # cast again and treat it as a change of that vote.
+            return cls._cast_many(latest)
+
+    @classmethod
+    def _cast_many(cls, latest):
+        questions = {question_id for _, question_id in latest}
+        # Only the rows of these exact (user, question) pairs are locked, not every mix of them.
+        pairs = functools.reduce(operator.or_, (Q(user_id=user_id, question_id=question_id)
+                                                for user_id, question_id in latest))
+        choice_deltas = Counter()
+        question_deltas = Counter()
+        previous = {}
+        created = []
+        changed = []
+        now = timezone.now()
+        with transaction.atomic():
+            existing = {
+                (vote.user_id, vote.question_id): vote
+                for vote in cls.objects.select_for_update()
+                .filter(pairs)
+                .only("pk", "user_id", "question_id", "choice_id", "changed_at")
+            }
+            for key, (choice_id, cast_at) in latest.items():
+                cast_at = cast_at or now
+                vote = existing.get(key)
+                previous[key] = vote.choice_id if vote else None
+                if vote is None:
+                    created.append(cls(user_id=key[0], question_id=key[1], choice_id=choice_id,
+                                       cast_at=cast_at, changed_at=cast_at))
+                    choice_deltas[choice_id] += 1
+                    question_deltas[key[1]] += 1
+                elif vote.changed_at is not None and vote.changed_at > cast_at:
+                    # The user has voted again since, through another path or process.
+                    continue
+                elif vote.choice_id != choice_id:
+                    choice_deltas[vote.choice_id] -= 1
+                    choice_deltas[choice_id] += 1
+                    vote.choice_id = choice_id
+                    vote.changed_at = cast_at
+                    changed.append(vote)
+            cls.objects.bulk_create(created)
+            cls.objects.bulk_update(changed, ["choice", "changed_at"])
+            add_vote_counts(Choice, choice_deltas)
+            add_vote_counts(Question, question_deltas)
+            for question_id in questions:
+                invalidate_results(question_id)
+        return previous
+
+
+def adjust_tally(choice_id, delta, question_id=None):
+    """
+    Add delta to the stored vote counts of a choice and its question.
+
+    The update is done in the database with F() expressions so concurrent
+    votes never overwrite each other's counts. When question_id is not given
+    the question is found through the choice.
+    """
+    Choice.objects.filter(pk=choice_id).update(vote_count=F("vote_count") + delta)
+    if question_id is None:
+        questions = Question.objects.filter(choice__pk=choice_id)
+    else:
+        questions = Question.objects.filter(pk=question_id)
+    questions.update(vote_count=F("vote_count") + delta)
+
+
+def add_vote_counts(model, deltas):
+    """
+    Add {pk: delta} to the stored vote counts of many choices or questions in one UPDATE.
+
+    A count that has drifted below the votes taken off it stops at zero, so
+    it is left for reconcile_tallies instead of failing the write.
+    """
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if deltas:
+        model.objects.filter(pk__in=deltas).update(vote_count=Greatest(F("vote_count") + Case(
+            *[When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()],
+            default=Value(0),
+        ), Value(0)))
+
+
+def remove_from_tallies(votes):
+    """Take a queryset of votes about to be deleted off the stored tallies, in one UPDATE per table."""
+    choice_deltas = Counter()
+    question_deltas = Counter()
+    for choice_id, question_id, count in (
+        votes.order_by().values_list("choice_id", "question_id").annotate(count=Count("pk"))
+    ):
+        choice_deltas[choice_id] -= count
+        question_deltas[question_id] -= count
+    add_vote_counts(Choice, choice_deltas)
+    add_vote_counts(Question, question_deltas)
+    for question_id in question_deltas:
+        invalidate_results(question_id)
+
+
+class VoteRollup(models.Model):
+    """
+    Count of votes cast and changed on a choice within one time bucket.
+
+    Rows are added to by the rollup_votes command only, so turnout charts
+    read these instead of the votes themselves.
+
+    Attributes:
+        question (Question): The question voted on.
+        choice (Choice): The choice the votes were for.
+        granularity (str): Length of the bucket: minute, hour or day.
+        bucket (datetime): Start of the bucket, in the current time zone.
+        cast_count (int): Votes first cast within the bucket.
+        change_count (int): Votes changed to this choice within the bucket.
+    """
+
+    MINUTE = "minute"
+    HOUR = "hour"
+    DAY = "day"
+    GRANULARITIES = [MINUTE, HOUR, DAY]
+
+    # The unique constraint starts with the question, so it also serves as its index.
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, db_index=False)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    granularity = models.CharField(max_length=6, choices=[(name, name) for name in GRANULARITIES])
+    bucket = models.DateTimeField()
+    cast_count = models.PositiveIntegerField(default=0)
+    change_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # Charts read one question's buckets of one granularity in time order.
+            models.UniqueConstraint(
+                fields=["question", "granularity", "bucket", "choice"], name="polls_voterollup_bucket"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.choice} {self.granularity} {self.bucket:%Y-%m-%d %H:%M}"
+
+
+class RollupWatermark(models.Model):
+    """
+    How far the rollup_votes command has counted the votes.
+
+    Attributes:
+        name (str): The rollup the watermark belongs to.
+        processed_until (datetime): Votes changed at or before this time are counted.
+    """
+
+    name = models.CharField(max_length=50, unique=True)
+    processed_until = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return f"{self.name} until {self.processed_until}"
+
+
+class LoadedFixture(models.Model):
+    """
+    Record of a data file loaded by the load_polls_data command.
+
+    Attributes:
+        name (str): The file name of the fixture.
+        sha256 (str): Hash of the file contents when it was last loaded.
+        loaded_at (datetime): When the file was last loaded.
+    """
+
+    name = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64)
+    loaded_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,146 @@
+"""
+Whole-page cache of the index and results pages for anonymous visitors.
+
+Anonymous visitors all get the same HTML for a URL, so the rendered page is
+stored in the polls cache under the URL and a version: the questions version
+for the index and the question's results version for its results page, so a
+new, changed or closed question or a counted vote makes the old copy stale.
+Questions also open and close as time passes without any write, so an index
+copy is never kept past the next pub_date or end_date. Logged-in users always
+get a freshly rendered page.
+
+A cached page cannot carry a per-visitor CSRF token, so it is rendered with a
+placeholder that is replaced with the visitor's own token on every hit.
+"""
+import math
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.template.response import TemplateResponse
+from django.utils import timezone
+from django.utils.http import urlencode
+
+from .cache import CACHE_ALIAS, questions_version, results_version
+from .models import Question
+
+CSRF_PLACEHOLDER = "polls-page-cache-csrf-token"
+# The only query parameters the cached views read; any others do not change the page.
+PAGE_PARAMETERS = ("after", "before", "status")
+
+
+def page_timeout():
+    """Return how long pages are cached for, in seconds (0 turns the page cache off)."""
+    return settings.POLLS_PAGE_CACHE_TIMEOUT
+
+
+def seconds_until_next_change():
+    """Return the seconds until a question next opens or closes, capped at the page timeout."""
+    now = timezone.now()
+    # Two lookups that each read one entry of an index, instead of one aggregate over the whole table.
+    changes = [
+        Question.objects.filter(pub_date__gt=now).order_by("pub_date").values_list("pub_date", flat=True).first(),
+        Question.objects.filter(end_date__gte=now).order_by("end_date").values_list("end_date", flat=True).first(),
+    ]
+    timeout = page_timeout()
+    for moment in changes:
+        if moment is not None:
+            # Voting stays open through the end_date itself, so the page changes just after it.
+            timeout = min(timeout, math.floor((moment - now).total_seconds()) + 1)
+    return max(timeout, 1)
+
+
+def index_version(request, **kwargs):
+    """Return the version of the cached index pages."""
+    return f"q{questions_version()}"
+
+
+def results_page_version(request, pk, **kwargs):
+    """Return the version of a question's cached results page, or None if there is no such question."""
+    version = results_version(pk, exists=Question.objects.filter(pk=pk).exists)
+    return None if version is None else f"r{version}"
+
+
+def is_cacheable(request):
+    """Return True if the request may be answered from, or stored in, the page cache."""
+    # Pending messages are shown once, to this visitor only.
+    has_messages = CookieStorage.cookie_name in request.COOKIES
+    return page_timeout() > 0 and request.method in ("GET", "HEAD") and not has_messages
+
+
+def page_key(request):
+    """Return the cache key of the page at the request's path and page parameters."""
+    parameters = {name: request.GET[name] for name in PAGE_PARAMETERS if name in request.GET}
+    return f"page:{request.path}?{urlencode(parameters)}"
+
+
+def cached_page(request, version):
+    """Return the response for a cached copy of the page, or None."""
+    if version is None:
+        return None
+    page = caches[CACHE_ALIAS].get(page_key(request), version=version)
+    if page is None:
+        return None
+    content_type, content = page
+    if CSRF_PLACEHOLDER.encode() in content:
+        content = content.replace(CSRF_PLACEHOLDER.encode(), get_token(request).encode())
+    return HttpResponse(content, content_type=content_type)
+
+
+def store_page(request, version, response, expires):
+    """Cache a freshly rendered page and return the response sent to this visitor."""
+    if response.status_code != 200 or response.cookies:
+        return response
+    content = response.content
+    timeout = expires() if expires else page_timeout()
+    caches[CACHE_ALIAS].set(page_key(request), (response["Content-Type"], content), timeout, version=version)
+    if CSRF_PLACEHOLDER.encode() in content:
+        response.content = content.replace(CSRF_PLACEHOLDER.encode(), get_token(request).encode())
+    return response
+
+
+def prepare_page(request, version, response, expires):
+    """Have a TemplateResponse render with the CSRF placeholder and cache the page once it is rendered."""
+    if version is not None and isinstance(response, TemplateResponse):
+        response.context_data["csrf_token"] = CSRF_PLACEHOLDER
+        response.add_post_render_callback(lambda rendered: store_page(request, version, rendered, expires))
+    return response
+
+
+def cache_anonymous_page(version, expires=None):
+    """
+    Decorate a view to serve anonymous visitors from the page cache.
+
+    version(request, **kwargs) names the current copy of the page, or is None
+    to have the view answer without the cache, and expires(), if given,
+    returns how long a new copy may be kept instead of
+    POLLS_PAGE_CACHE_TIMEOUT. Sync and async views are both supported.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            async def wrapper(request, *args, **kwargs):
+                if not is_cacheable(request) or (await request.auser()).is_authenticated:
+                    return await view(request, *args, **kwargs)
+                # The cache backend may be a blocking one, such as the database cache.
+                key_version = await sync_to_async(version)(request, **kwargs)
+                response = await sync_to_async(cached_page)(request, key_version)
+                if response is None:
+                    response = prepare_page(request, key_version, await view(request, *args, **kwargs), expires)
+                return response
+        else:
+            def wrapper(request, *args, **kwargs):
+                if not is_cacheable(request) or request.user.is_authenticated:
+                    return view(request, *args, **kwargs)
+                key_version = version(request, **kwargs)
+                response = cached_page(request, key_version)
+                if response is None:
+                    response = prepare_page(request, key_version, view(request, *args, **kwargs), expires)
+                return response
+
+        return wraps(view)(wrapper)
+
+    return decorator
@@ -0,0 +1,122 @@
+"""
+Token-bucket rate limits for the views that are expensive to abuse.
+
+Each limited view has a rate in POLLS_RATE_LIMITS, such as ``30/m``: a bucket
+holds up to that many tokens, refills at that many per period, and every
+request takes one. A request finding the bucket empty is answered with 429
+and a Retry-After header before the view runs, so it never reaches the
+database or, for signup, the password hasher. Buckets are kept in the
+``ratelimit`` cache, which must be shared by every process for the limits to
+hold across them. A bucket is read and written without a lock, so requests
+racing on the same bucket may together take a little more than the rate.
+"""
+import math
+import time
+from functools import lru_cache, wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+CACHE_ALIAS = "ratelimit"
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+@lru_cache
+def parse_rate(rate):
+    """Return the (tokens, seconds) of a rate such as ``30/m``, or None if the rate is empty or zero."""
+    if not rate:
+        return None
+    count, _, period = rate.partition("/")
+    try:
+        tokens, seconds = int(count), PERIODS[period.strip() or "s"]
+    except (KeyError, ValueError):
+        raise ValueError(f"Invalid rate limit {rate!r}; use a count per s, m, h or d, such as 30/m.") from None
+    return (tokens, seconds) if tokens > 0 else None
+
+
+def get_client_ip(request):
+    """
+    Get the visitor's IP address.
+
+    X-Forwarded-For is only trusted as far as the POLLS_PROXY_COUNT proxies in
+    front of the app wrote it; anything a client puts before that is ignored.
+    """
+    proxies = settings.POLLS_PROXY_COUNT
+    if proxies:
+        forwarded = [ip.strip() for ip in request.META.get("HTTP_X_FORWARDED_FOR", "").split(",") if ip.strip()]
+        if forwarded:
+            return forwarded[-min(proxies, len(forwarded))]
+    return request.META.get("REMOTE_ADDR")
+
+
+def bucket_key(scope, request, user=None):
+    """Return the cache key of the bucket a request takes from: its user's, if given, or its IP's."""
+    if user is not None and user.is_authenticated:
+        return f"{scope}:user:{user.pk}"
+    return f"{scope}:ip:{get_client_ip(request)}"
+
+
+def take(bucket, rate, now):
+    """
+    Take a token from a bucket.
+
+    Returns:
+        tuple: The bucket to store, or None if it was empty, and the seconds
+               to wait before a token is available (0 when one was taken).
+    """
+    capacity, period = rate
+    if bucket is None:
+        tokens = capacity
+    else:
+        tokens, stamp = bucket
+        tokens = min(capacity, tokens + (now - stamp) * capacity / period)
+    if tokens < 1:
+        return None, math.ceil((1 - tokens) * period / capacity)
+    return (tokens - 1, now), 0
+
+
+def too_many_requests(wait):
+    """Return the 429 response telling the client to retry after wait seconds."""
+    return HttpResponse("Too many requests. Please try again later.", status=429,
+                        headers={"Retry-After": str(max(wait, 1))})
+
+
+def rate_limit(scope, per_user=False, methods=("POST",)):
+    """
+    Decorate a view to limit its requests to the POLLS_RATE_LIMITS rate of scope.
+
+    Requests are counted per client IP, or per logged-in user with per_user
+    (anonymous visitors then count per IP). Only requests with one of methods
+    are limited. Sync and async views are both supported.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            async def wrapper(request, *args, **kwargs):
+                rate = parse_rate(settings.POLLS_RATE_LIMITS.get(scope))
+                if rate is not None and request.method in methods:
+                    cache = caches[CACHE_ALIAS]
+                    key = bucket_key(scope, request, await request.auser() if per_user else None)
+                    bucket, wait = take(await cache.aget(key), rate, time.time())
+                    if bucket is None:
+                        return too_many_requests(wait)
+                    # A bucket left alone for a period is full again, the same as a missing one.
+                    await cache.aset(key, bucket, rate[1])
+                return await view(request, *args, **kwargs)
+        else:
+            def wrapper(request, *args, **kwargs):
+                rate = parse_rate(settings.POLLS_RATE_LIMITS.get(scope))
+                if rate is not None and request.method in methods:
+                    cache = caches[CACHE_ALIAS]
+                    key = bucket_key(scope, request, request.user if per_user else None)
+                    bucket, wait = take(cache.get(key), rate, time.time())
+                    if bucket is None:
+                        return too_many_requests(wait)
+                    # A bucket left alone for a period is full again, the same as a missing one.
+                    cache.set(key, bucket, rate[1])
+                return view(request, *args, **kwargs)
+
+        return wraps(view)(wrapper)
+
+    return decorator
@@ -0,0 +1,154 @@
+"""
+Turnout rollups: counts of votes per question, choice and time bucket.
+
+roll_up_votes() reads only the votes cast or changed since the watermark of
+its last run, groups them by minute, hour and day in the database and adds
+the counts to VoteRollup. A vote is counted as cast in the bucket of its
+cast_at, for the choice it has when it is counted, and as changed in the
+bucket of its changed_at when it was changed to another choice; a vote
+changed several times between two runs counts as one change. Votes from
+before cast_at was recorded count only their changes. Deleted votes are not
+taken off again. Votes are only counted once they are
+POLLS_ROLLUP_SETTLE_SECONDS old, so a transaction that commits a little after
+stamping its votes is not skipped by the watermark.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from .models import RollupWatermark, Vote, VoteRollup
+
+WATERMARK_NAME = "votes"
+# Span a turnout chart covers when no start is given.
+DEFAULT_SPANS = {
+    VoteRollup.MINUTE: datetime.timedelta(hours=6),
+    VoteRollup.HOUR: datetime.timedelta(days=7),
+    VoteRollup.DAY: datetime.timedelta(days=365),
+}
+
+
+def count_votes(votes, field, granularity):
+    """Return {(question_id, choice_id, bucket): count} of votes grouped by the bucket of a time field."""
+    rows = (
+        votes.annotate(bucket=Trunc(field, granularity))
+        .values_list("question_id", "choice_id", "bucket")
+        .annotate(count=Count("pk"))
+        .order_by()
+    )
+    return {(question_id, choice_id, bucket): count for question_id, choice_id, bucket, count in rows}
+
+
+def roll_up_votes(until=None, batch_size=1000):
+    """
+    Add the votes changed since the last run, up to until, to the rollups.
+
+    until defaults to POLLS_ROLLUP_SETTLE_SECONDS ago. Runs are serialized by
+    a lock on the watermark row and each one commits with its watermark, so a
+    run that fails leaves nothing half counted.
+
+    Returns:
+        dict: The ``start`` and ``end`` of the processed window and the number
+              of ``votes`` counted as cast and ``changes`` counted.
+    """
+    if until is None:
+        until = timezone.now() - datetime.timedelta(seconds=settings.POLLS_ROLLUP_SETTLE_SECONDS)
+    with transaction.atomic():
+        RollupWatermark.objects.get_or_create(name=WATERMARK_NAME)
+        watermark = RollupWatermark.objects.select_for_update().get(name=WATERMARK_NAME)
+        start = watermark.processed_until
+        if start is not None and start >= until:
+            return {"start": start, "end": start, "votes": 0, "changes": 0}
+
+        # Casts and changes are windowed on their own times: a vote cast in this window
+        # may have been changed since, and one changed now may have been cast long ago.
+        # Votes from before cast_at was recorded have no cast time to count them in.
+        casts = Vote.objects.filter(cast_at__isnull=False, cast_at__lte=until)
+        changes = Vote.objects.filter(changed_at__lte=until).exclude(changed_at=F("cast_at"))
+        if start is not None:
+            casts = casts.filter(cast_at__gt=start)
+            changes = changes.filter(changed_at__gt=start)
+
+        totals = {"votes": 0, "changes": 0}
+        for granularity in VoteRollup.GRANULARITIES:
+            counts = {}
+            for name, votes, field in (("votes", casts, "cast_at"), ("changes", changes, "changed_at")):
+                for key, count in count_votes(votes, field, granularity).items():
+                    counts.setdefault(key, {"votes": 0, "changes": 0})[name] += count
+                    if granularity == VoteRollup.MINUTE:
+                        totals[name] += count
+            add_counts(granularity, counts, batch_size)
+
+        watermark.processed_until = until
+        watermark.save(update_fields=["processed_until"])
+    return {"start": start, "end": until, **totals}
+
+
+def add_counts(granularity, counts, batch_size):
+    """Add {(question_id, choice_id, bucket): {"votes": n, "changes": m}} to the rollups of a granularity."""
+    if not counts:
+        return
+    existing = {
+        (row.question_id, row.choice_id, row.bucket): row
+        for row in VoteRollup.objects.filter(
+            granularity=granularity,
+            question_id__in={question_id for question_id, _, _ in counts},
+            bucket__gte=min(bucket for _, _, bucket in counts),
+        )
+    }
+    rows = []
+    for (question_id, choice_id, bucket), count in counts.items():
+        row = existing.get((question_id, choice_id, bucket)) or VoteRollup(
+            question_id=question_id, choice_id=choice_id, granularity=granularity, bucket=bucket,
+        )
+        row.cast_count += count["votes"]
+        row.change_count += count["changes"]
+        rows.append(row)
+    VoteRollup.objects.bulk_create(
+        rows,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=["question", "granularity", "bucket", "choice"],
+        update_fields=["cast_count", "change_count"],
+    )
+
+
+def rebuild_rollups(until=None):
+    """Delete the rollups and the watermark and count every vote again."""
+    with transaction.atomic():
+        VoteRollup.objects.all().delete()
+        RollupWatermark.objects.filter(name=WATERMARK_NAME).delete()
+        return roll_up_votes(until=until)
+
+
+def turnout(question, granularity=VoteRollup.HOUR, since=None, until=None):
+    """
+    Return the turnout of a question per bucket, read from the rollups only.
+
+    Returns:
+        list: A dict per bucket with data, oldest first: its ``start``, the
+              ``votes`` cast and ``changes`` made in it, and ``choices``
+              mapping each choice id to the votes cast for it.
+    """
+    if since is None:
+        since = (until or timezone.now()) - DEFAULT_SPANS[granularity]
+    rows = VoteRollup.objects.filter(question=question, granularity=granularity, bucket__gte=since)
+    if until is not None:
+        rows = rows.filter(bucket__lt=until)
+    buckets = {}
+    for bucket, choice_id, cast_count, change_count in rows.order_by("bucket", "choice_id").values_list(
+        "bucket", "choice_id", "cast_count", "change_count"
+    ):
+        entry = buckets.setdefault(bucket, {"start": bucket, "votes": 0, "changes": 0, "choices": {}})
+        entry["votes"] += cast_count
+        entry["changes"] += change_count
+        entry["choices"][choice_id] = cast_count
+    return list(buckets.values())
+
+
+def processed_until():
+    """Return the time up to which votes have been rolled up, or None before the first run."""
+    return RollupWatermark.objects.filter(name=WATERMARK_NAME).values_list("processed_until", flat=True).first()
@@ -0,0 +1,60 @@
+"""
+Read replica routing for poll data.
+
+Reads of the polls app's models go to one of ``POLLS_DATABASE_REPLICAS``;
+everything else, including sessions and users, stays on the primary. A
+client that has just written reads from the primary for
+``POLLS_READ_YOUR_WRITES_SECONDS`` afterwards, so it sees its own vote even
+while the replicas lag behind. Reads inside a transaction also use the
+primary, so they see that transaction's writes.
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PRIMARY_COOKIE = "polls_primary"
+
+routing_state = ContextVar("polls_routing_state", default=None)
+
+
+class RoutingState:
+    """Whether the current request has to read from the primary, and whether it wrote."""
+
+    __slots__ = ("pinned", "wrote")
+
+    def __init__(self, pinned=False):
+        """Start a request, pinned to the primary if it wrote recently."""
+        self.pinned = pinned
+        self.wrote = False
+
+
+class ReplicaRouter:
+    """Send reads of poll data to a read replica unless the primary is needed."""
+
+    def db_for_read(self, model, **hints):
+        """Return a replica for poll data, or None to use the primary."""
+        replicas = settings.POLLS_DATABASE_REPLICAS
+        if not replicas or model._meta.app_label != "polls":
+            return None
+        state = routing_state.get()
+        if state is not None and state.pinned:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        """Write to the primary and read from it for the rest of the request."""
+        state = routing_state.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Allow relations between objects read from the primary or any replica."""
+        databases = {DEFAULT_DB_ALIAS, *settings.POLLS_DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
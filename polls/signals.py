@@ -0,0 +1,68 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_out
+from django.db.backends.signals import connection_created
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .auth import clear_user_cache
+from .cache import invalidate_results
+from .middleware import install_query_timer
+from .models import Choice, Question, Vote, remove_from_tallies
+
+# Vote has no delete receivers, so Django deletes the votes of a deleted
+# question, choice or user with one DELETE instead of loading each of them.
+# Votes deleted on their own are taken off the tallies by Vote.delete() and
+# Vote.objects.delete(), and the receivers below handle the cascades.
+
+
+def deletes(origin, model):
+    """Return True if a delete started from origin removes rows of model itself."""
+    if isinstance(origin, QuerySet):
+        return origin.model is model
+    return isinstance(origin, model)
+
+
+@receiver(pre_delete, sender=Choice)
+def remove_choice_votes_from_tally(sender, instance, origin=None, **kwargs):
+    """Take the votes of a choice deleted on its own off its question's tally."""
+    if not deletes(origin, Question):
+        remove_from_tallies(Vote.objects.filter(choice=instance))
+
+
+@receiver(pre_delete, sender=get_user_model())
+def remove_user_votes_from_tally(sender, instance, **kwargs):
+    """Take the votes of a deleted user off the tallies."""
+    remove_from_tallies(Vote.objects.filter(user=instance))
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def expire_cached_question(sender, instance, **kwargs):
+    """Expire the cached results and listings of a changed question."""
+    invalidate_results(instance.pk)
+
+
+@receiver(post_save, sender=Vote)
+@receiver(post_save, sender=Choice)
+@receiver(post_delete, sender=Choice)
+def expire_cached_results(sender, instance, **kwargs):
+    """Expire the cached results of the question a vote or choice belongs to."""
+    invalidate_results(instance.question_id)
+
+
+@receiver(user_logged_out)
+def forget_logged_out_user(sender, request, user, **kwargs):
+    """Drop the cached record of a user who logged out."""
+    if user is not None:
+        clear_user_cache(user.pk)
+
+
+@receiver(post_save, sender=get_user_model())
+@receiver(post_delete, sender=get_user_model())
+def forget_changed_user(sender, instance, **kwargs):
+    """Drop the cached record of a user whose password, permissions or status may have changed."""
+    clear_user_cache(instance.pk)
+
+
+connection_created.connect(install_query_timer, dispatch_uid="polls_query_timer")
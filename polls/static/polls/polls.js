@@ -0,0 +1,36 @@
+// Shared scripts of the poll pages.
+
+// Log out in the background and refresh the page to reflect the logged-out state
+const logoutForm = document.getElementById('logout-form');
+if (logoutForm) {
+    logoutForm.addEventListener('submit', function(e) {
+        e.preventDefault(); // Prevent the default form submission
+        fetch(this.action, {
+            method: 'POST',
+            headers: {
+                'X-CSRFToken': this.querySelector('input[name="csrfmiddlewaretoken"]').value
+            }
+        }).then(() => {
+            window.location.reload();
+        });
+    });
+}
+
+// Update the results counts in place as votes arrive
+const resultsTable = document.querySelector('table[data-stream]');
+if (resultsTable && window.EventSource) {
+    const source = new EventSource(resultsTable.dataset.stream);
+    const update = function(e) {
+        const data = JSON.parse(e.data);
+        document.getElementById('total-votes').textContent = data.total;
+        data.choices.forEach(function(choice) {
+            const row = resultsTable.querySelector('tr[data-choice="' + choice.id + '"]');
+            if (row) {
+                row.querySelector('.votes').textContent = choice.votes;
+                row.querySelector('.percent').textContent = choice.percent + '%';
+            }
+        });
+    };
+    source.addEventListener('snapshot', update);
+    source.addEventListener('delta', update);
+}
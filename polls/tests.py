@@ -1,10 +1,42 @@
+import asyncio
+import csv
 import datetime
-from django.test import TestCase
+import gzip
+import importlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+from unittest import mock
+from io import StringIO
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
-from django.urls import reverse
+from django.urls import clear_url_caches, resolve, reverse
 from django.contrib.auth.models import User
-from .models import Question, Choice
+from . import auth
+from .admin import EXACT_COUNT_LIMIT
+from .assets import brotli
+from .auth import clear_user_cache
+from .broadcast import broadcaster
+from .buffer import VoteBuffer, get_vote_buffer
+from .log import JsonFormatter, QueueHandler, SampleFilter
+from .cache import cache_stats, get_results, reset_cache_stats
+from .models import Question, Choice, Vote, VoteRollup
+from .rollups import rebuild_rollups, roll_up_votes
+from .ratelimit import get_client_ip, parse_rate, take
+from .pagecache import CSRF_PLACEHOLDER, cached_page, page_key, seconds_until_next_change
+from .routers import PRIMARY_COOKIE, ReplicaRouter, RoutingState, routing_state
 from mysite import settings
+from mysite.asgi import application
 
 
 class QuestionModelTests(TestCase):
@@ -82,6 +114,10 @@ def create_question(question_text, days):
 class QuestionIndexViewTests(TestCase):
     """Test suite for the index view of the polls app."""
 
+    def setUp(self):
+        """Start from an empty page cache."""
+        caches["polls"].clear()
+
     def test_no_questions(self):
         """If no questions exist, an appropriate message is displayed."""
         response = self.client.get(reverse("polls:index"))
@@ -117,6 +153,106 @@ class QuestionIndexViewTests(TestCase):
         self.assertListEqual(list(response.context["latest_question_list"]), [question2, question1])
 
 
+@override_settings(POLLS_INDEX_PAGE_SIZE=2)
+class QuestionIndexPaginationTests(TestCase):
+    """Test suite for the keyset pagination of the index view."""
+
+    def setUp(self):
+        """Create five published questions, newest first in self.questions."""
+        caches["polls"].clear()
+        self.questions = [create_question(question_text=f"Question {n}.", days=-n) for n in range(1, 6)]
+
+    def get_page(self, **params):
+        """Return the index response for the given query parameters."""
+        return self.client.get(reverse("polls:index"), params)
+
+    def test_first_page(self):
+        """The first page holds the newest questions and only a next cursor."""
+        response = self.get_page()
+        self.assertListEqual(response.context["latest_question_list"], self.questions[:2])
+        self.assertIsNone(response.context["previous_cursor"])
+        self.assertIsNotNone(response.context["next_cursor"])
+
+    def test_walk_forward_and_back(self):
+        """Following next cursors visits every question once, and previous cursors walk back."""
+        seen = []
+        response = self.get_page()
+        seen += response.context["latest_question_list"]
+        while response.context["next_cursor"]:
+            response = self.get_page(after=response.context["next_cursor"])
+            seen += response.context["latest_question_list"]
+        self.assertListEqual(seen, self.questions)
+        response = self.get_page(before=response.context["previous_cursor"])
+        self.assertListEqual(response.context["latest_question_list"], self.questions[2:4])
+        response = self.get_page(before=response.context["previous_cursor"])
+        self.assertListEqual(response.context["latest_question_list"], self.questions[:2])
+        self.assertIsNone(response.context["previous_cursor"])
+
+    def test_invalid_cursor(self):
+        """An invalid cursor falls back to the first page."""
+        response = self.get_page(after="not-a-cursor")
+        self.assertListEqual(response.context["latest_question_list"], self.questions[:2])
+
+
+class QuestionStatusTests(TestCase):
+    """Test suite for the status of questions computed by the database."""
+
+    def setUp(self):
+        """Create an upcoming, an open, a closing and a closed question."""
+        caches["polls"].clear()
+        now = timezone.now()
+        self.upcoming = create_question(question_text="Upcoming question.", days=3)
+        self.open = create_question(question_text="Open question.", days=-3)
+        self.closing = Question.objects.create(question_text="Closing question.", pub_date=now - datetime.timedelta(days=2),
+                                               end_date=now + datetime.timedelta(hours=2))
+        self.closed = Question.objects.create(question_text="Closed question.", pub_date=now - datetime.timedelta(days=4),
+                                              end_date=now - datetime.timedelta(days=1))
+
+    def test_annotated_status(self):
+        """Each question is labelled upcoming, open or closed, agreeing with can_vote()."""
+        statuses = dict(Question.objects.with_status().values_list("question_text", "status"))
+        self.assertEqual(statuses, {
+            "Upcoming question.": Question.UPCOMING,
+            "Open question.": Question.OPEN,
+            "Closing question.": Question.OPEN,
+            "Closed question.": Question.CLOSED,
+        })
+        for question in Question.objects.with_status():
+            self.assertEqual(question.status == Question.OPEN, question.can_vote())
+
+    def test_filters(self):
+        """The queryset filters select the questions of each status."""
+        self.assertCountEqual(Question.objects.open(), [self.open, self.closing])
+        self.assertCountEqual(Question.objects.closing_soon(), [self.closing])
+        self.assertCountEqual(Question.objects.closed(), [self.closed])
+        self.assertCountEqual(Question.objects.published(), [self.open, self.closing, self.closed])
+
+    def test_index_status_filter(self):
+        """The index lists only the questions of the requested status."""
+        for status, expected in (("open", [self.closing, self.open]), ("closing", [self.closing]),
+                                 ("closed", [self.closed]), ("bogus", [self.closing, self.open, self.closed])):
+            with self.subTest(status=status):
+                response = self.client.get(reverse("polls:index"), {"status": status})
+                self.assertListEqual(response.context["latest_question_list"], expected)
+
+    @override_settings(POLLS_INDEX_PAGE_SIZE=1)
+    def test_pagination_keeps_status_filter(self):
+        """Page links of a filtered index keep the filter."""
+        response = self.client.get(reverse("polls:index"), {"status": "open"})
+        self.assertContains(response, f'?after={response.context["next_cursor"]}&amp;status=open')
+
+    def test_index_marks_closed_questions(self):
+        """Closed questions are shown as closed without a vote link."""
+        response = self.client.get(reverse("polls:index"))
+        self.assertContains(response, '<span class="status closed">Closed</span>', count=1, html=True)
+        self.assertNotContains(response, f'href="{reverse("polls:detail", args=(self.closed.id,))}"')
+
+    def test_closed_question_detail_redirects(self):
+        """The detail page of a closed question redirects to the index."""
+        response = self.client.get(reverse("polls:detail", args=(self.closed.id,)))
+        self.assertRedirects(response, reverse("polls:index"))
+
+
 class QuestionDetailViewTests(TestCase):
     """Test suite for the detail view of the polls app."""
 
@@ -135,12 +271,36 @@ class QuestionDetailViewTests(TestCase):
         response = self.client.get(url)
         self.assertContains(response, past_question.question_text)
 
+    def test_selected_choice(self):
+        """The choice the user voted for is marked as selected."""
+        question = create_question(question_text="Voted question.", days=-5)
+        choice = Choice.objects.create(question=question, choice_text="Mine")
+        user = User.objects.create_user(username="detail", password="FatChance!")
+        Vote.cast(user, choice)
+        self.client.force_login(user)
+        response = self.client.get(reverse("polls:detail", args=(question.id,)))
+        self.assertEqual(response.context["selected_choice"], choice.id)
+
+    def test_query_count(self):
+        """The detail page loads the question, its choices and the user's vote in a fixed number of queries."""
+        question = create_question(question_text="Busy question.", days=-5)
+        for n in range(10):
+            Choice.objects.create(question=question, choice_text=f"Choice {n}")
+        url = reverse("polls:detail", args=(question.id,))
+        with self.assertNumQueries(2):
+            self.client.get(url)
+        self.client.force_login(User.objects.create_user(username="counter", password="FatChance!"))
+        # session and user lookups, then the same two queries
+        with self.assertNumQueries(4):
+            self.client.get(url)
+
 
 class UserAuthTest(TestCase):
     """Test suite for user authentication in the polls app."""
 
     def setUp(self):
         """Set up test data for authentication tests."""
+        caches["ratelimit"].clear()
         # Create a test user
         self.username = "testuser"
         self.password = "FatChance!"
@@ -206,3 +366,1622 @@ class UserAuthTest(TestCase):
         response = self.client.get(vote_url)
         self.assertEqual(response.status_code, 302)
         self.assertRedirects(response, f"{reverse('login')}?next={vote_url}")
+
+
+class VoteTallyTests(TestCase):
+    """Test suite for the stored vote tallies on Choice and Question."""
+
+    def setUp(self):
+        """Create a user and a question with two choices."""
+        caches["ratelimit"].clear()
+        self.user = User.objects.create_user(username="voter", password="FatChance!")
+        self.question = create_question(question_text="Tally question.", days=-1)
+        self.choice1 = Choice.objects.create(question=self.question, choice_text="One")
+        self.choice2 = Choice.objects.create(question=self.question, choice_text="Two")
+        self.client.login(username="voter", password="FatChance!")
+
+    def vote_for(self, choice):
+        """Post a vote for choice as the logged in user."""
+        return self.client.post(reverse("polls:vote", args=(self.question.id,)), {"choice": choice.id})
+
+    def assertTallies(self, first, second):
+        """Assert the stored tallies of both choices and their question."""
+        for obj in (self.question, self.choice1, self.choice2):
+            obj.refresh_from_db()
+        self.assertEqual(self.choice1.votes, first)
+        self.assertEqual(self.choice2.votes, second)
+        self.assertEqual(self.question.vote_count, first + second)
+
+    def test_vote_increments_tally(self):
+        """A new vote adds one to its choice and question."""
+        self.vote_for(self.choice1)
+        self.assertTallies(1, 0)
+
+    def test_changed_vote_moves_tally(self):
+        """Changing a vote moves the count to the new choice without changing the question total."""
+        self.vote_for(self.choice1)
+        self.vote_for(self.choice2)
+        self.assertTallies(0, 1)
+
+    def test_deleted_vote_decrements_tally(self):
+        """Deleting a vote, directly or through its user, takes it off the tally."""
+        self.vote_for(self.choice1)
+        self.user.delete()
+        self.assertTallies(0, 0)
+
+    def test_deleted_votes_and_choice_decrement_tallies(self):
+        """Votes deleted one by one, in bulk or with their choice are taken off the tallies."""
+        voters = [User.objects.create_user(username=f"leaver{n}") for n in range(4)]
+        for voter, choice in zip(voters, (self.choice1, self.choice1, self.choice1, self.choice2)):
+            Vote.cast(voter, choice)
+        Vote.objects.get(user=voters[0]).delete()
+        self.assertTallies(2, 1)
+        Vote.objects.filter(user=voters[1]).delete()
+        self.assertTallies(1, 1)
+        self.choice2.delete()
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.vote_count, 1)
+
+    def test_deleting_question_does_not_load_votes(self):
+        """Deleting a question or choice deletes its votes in bulk, however many there are."""
+        queries = []
+        for count in (2, 20):
+            question = create_question(question_text=f"Doomed {count}.", days=-1)
+            choice = Choice.objects.create(question=question, choice_text="Doomed")
+            Vote.cast_many((User.objects.create_user(username=f"doomed{count}-{n}").pk, question.pk, choice.pk)
+                           for n in range(count))
+            with CaptureQueriesContext(connection) as captured:
+                question.delete()
+            queries.append(len(captured))
+        self.assertEqual(queries[0], queries[1])
+        self.assertFalse(Vote.objects.filter(question__question_text__startswith="Doomed").exists())
+
+    def test_delete_with_drifted_tally(self):
+        """Deleting votes never fails on a stored tally that is lower than the real count."""
+        self.vote_for(self.choice1)
+        Choice.objects.filter(pk=self.choice1.pk).update(vote_count=0)
+        Question.objects.filter(pk=self.question.pk).update(vote_count=0)
+        self.user.delete()
+        self.assertTallies(0, 0)
+
+    def test_reconcile_tallies_fixes_drift(self):
+        """reconcile_tallies rebuilds the stored tallies from the Vote table."""
+        Vote.objects.create(user=self.user, choice=self.choice2)
+        Choice.objects.filter(pk=self.choice1.pk).update(vote_count=5)
+        out = StringIO()
+        call_command("reconcile_tallies", stdout=out)
+        self.assertIn("Fixed 2 choice tallies and 1 question tallies", out.getvalue())
+        self.assertTallies(0, 1)
+
+
+class QuestionResultsViewTests(TestCase):
+    """Test suite for the results view of the polls app."""
+
+    def setUp(self):
+        """Create a question with three choices and some votes."""
+        caches["polls"].clear()
+        self.question = create_question(question_text="Results question.", days=-1)
+        self.choices = [
+            Choice.objects.create(question=self.question, choice_text=f"Choice {n}") for n in range(1, 4)
+        ]
+        for n in range(3):
+            user = User.objects.create_user(username=f"user{n}", password="FatChance!")
+            Vote.objects.create(user=user, choice=self.choices[0 if n < 2 else 1])
+        call_command("reconcile_tallies", stdout=StringIO())
+
+    def test_results_context(self):
+        """The results context holds counts, percentages and the total as plain data."""
+        response = self.client.get(reverse("polls:results", args=(self.question.id,)))
+        results = response.context["results"]
+        self.assertEqual(results["total"], 3)
+        self.assertEqual([c["votes"] for c in results["choices"]], [2, 1, 0])
+        self.assertEqual([c["percent"] for c in results["choices"]], [66.7, 33.3, 0.0])
+
+    def test_results_query_count(self):
+        """The results page runs the same number of queries however many choices there are."""
+        url = reverse("polls:results", args=(self.question.id,))
+        # The question is checked to exist before its results version is created.
+        with self.assertNumQueries(3):
+            self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            for n in range(10):
+                Choice.objects.create(question=self.question, choice_text=f"Extra {n}")
+        with self.assertNumQueries(2):
+            self.client.get(url)
+
+    def test_results_without_votes(self):
+        """A question without votes shows zero percent for every choice."""
+        question = create_question(question_text="Empty question.", days=-1)
+        Choice.objects.create(question=question, choice_text="Lonely")
+        response = self.client.get(reverse("polls:results", args=(question.id,)))
+        self.assertEqual(response.context["results"]["total"], 0)
+        self.assertEqual(response.context["results"]["choices"][0]["percent"], 0.0)
+
+
+class QueryPlanTests(TestCase):
+    """Test suite checking that the hot poll queries are served by indexes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Seed enough questions, choices and votes for the planner to prefer indexes."""
+        now = timezone.now()
+        users = User.objects.bulk_create([User(username=f"planner{n}") for n in range(50)])
+        questions = Question.objects.bulk_create([
+            Question(
+                question_text=f"Question {n}",
+                pub_date=now - datetime.timedelta(hours=n),
+                end_date=now + datetime.timedelta(hours=n - 100) if n % 2 else None,
+            )
+            for n in range(500)
+        ])
+        choices = Choice.objects.bulk_create([
+            Choice(question=question, choice_text=f"Choice {n}") for question in questions for n in range(3)
+        ])
+        Vote.objects.bulk_create([
+            Vote(user=user, question=questions[n], choice=choices[n * 3 + u % 3])
+            for u, user in enumerate(users) for n in range(u % 25, len(questions), 25)
+        ])
+        cls.user = users[0]
+        cls.question = questions[0]
+        cls.now = now
+
+    def assertUsesIndex(self, queryset):
+        """Fail if the query plan of queryset reads any table with a sequential scan."""
+        if connection.vendor == "postgresql":
+            with transaction.atomic(), connection.cursor() as cursor:
+                # Small test tables are cheaper to scan, so only fall back to one when no index fits.
+                cursor.execute("SET LOCAL enable_seqscan = off")
+                plan = queryset.explain()
+            self.assertNotIn("Seq Scan", plan)
+        else:
+            for line in queryset.explain().splitlines():
+                self.assertNotRegex(line, r"\bSCAN \w+$", msg=f"Sequential scan in plan:\n{line}")
+
+    def test_user_vote_lookup(self):
+        """Finding a user's vote on a question uses indexes."""
+        self.assertUsesIndex(Vote.objects.filter(user=self.user, question=self.question))
+
+    def test_published_questions_page(self):
+        """Listing a page of published questions uses the (pub_date, id) index."""
+        queryset = Question.objects.filter(pub_date__lte=self.now).order_by("-pub_date", "-pk")[:20]
+        self.assertUsesIndex(queryset)
+
+    def test_end_date_range(self):
+        """End date range checks use the partial end_date index."""
+        self.assertUsesIndex(Question.objects.filter(end_date__gte=self.now))
+        self.assertUsesIndex(Question.objects.filter(end_date__lt=self.now))
+
+    def test_question_choices(self):
+        """Listing the choices of a question uses an index."""
+        self.assertUsesIndex(self.question.choice_set.order_by("pk"))
+
+    def test_status_filtered_pages(self):
+        """Pages of open, closing soon and closed questions use indexes."""
+        for status in ("open", "closing_soon", "closed"):
+            with self.subTest(status=status):
+                queryset = getattr(Question.objects.with_status(self.now), status)(self.now)
+                self.assertUsesIndex(queryset.order_by("-pub_date", "-pk")[:20])
+
+    def test_next_change_lookups(self):
+        """Finding when the next question opens or closes, for the page cache, uses indexes."""
+        self.assertUsesIndex(Question.objects.filter(pub_date__gt=self.now).order_by("pub_date")[:1])
+        self.assertUsesIndex(Question.objects.filter(end_date__gte=self.now).order_by("end_date")[:1])
+
+
+class VoteCastTests(TestCase):
+    """Test suite for the one-vote-per-question write path."""
+
+    def setUp(self):
+        """Create a user and a question with two choices."""
+        caches["ratelimit"].clear()
+        self.user = User.objects.create_user(username="caster", password="FatChance!")
+        self.question = create_question(question_text="Cast question.", days=-1)
+        self.choice1 = Choice.objects.create(question=self.question, choice_text="One")
+        self.choice2 = Choice.objects.create(question=self.question, choice_text="Two")
+
+    def test_cast_returns_previous_choice(self):
+        """cast() reports the choice a vote replaced, or None for a first vote."""
+        self.assertIsNone(Vote.cast(self.user, self.choice1))
+        self.assertEqual(Vote.cast(self.user, self.choice2), self.choice1.id)
+        self.assertEqual(Vote.cast(self.user, self.choice2), self.choice2.id)
+        self.assertEqual(Vote.objects.get(user=self.user).choice, self.choice2)
+
+    def test_one_vote_per_question_constraint(self):
+        """The database rejects a second vote by the same user on the same question."""
+        Vote.objects.create(user=self.user, choice=self.choice1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Vote.objects.create(user=self.user, choice=self.choice2)
+
+    def test_vote_query_count(self):
+        """Casting a first vote or changing it costs a fixed, small number of queries."""
+        Vote.cast(self.user, self.choice1)
+        self.client.force_login(self.user)
+        url = reverse("polls:vote", args=(self.question.id,))
+        # session, user, choice with question, locked vote, vote update and two tallies,
+        # plus the savepoint pair from running inside the test case's transaction
+        with self.assertNumQueries(9):
+            self.client.post(url, {"choice": self.choice2.id})
+
+
+class VoteQuestionMigrationTests(TransactionTestCase):
+    """Test suite for the migration that keeps one vote per user per question."""
+
+    before = [("polls", "0005_hot_path_indexes")]
+    after = [("polls", "0006_vote_question_one_vote_per_question")]
+
+    def setUp(self):
+        """Migrate polls back to before votes had a question."""
+        self.addCleanup(call_command, "migrate", "polls", verbosity=0)
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        self.apps = executor.loader.project_state(self.before).apps
+
+    def test_duplicate_votes_removed_and_recounted(self):
+        """Only the latest vote of each user on a question is kept, and the tallies match the kept votes."""
+        Question = self.apps.get_model("polls", "Question")
+        Choice = self.apps.get_model("polls", "Choice")
+        Vote = self.apps.get_model("polls", "Vote")
+        user = User.objects.create_user(username="twice", password="FatChance!")
+        other = User.objects.create_user(username="once", password="FatChance!")
+        question = Question.objects.create(question_text="Old question.", pub_date=timezone.now(), vote_count=3)
+        one = Choice.objects.create(question=question, choice_text="One", vote_count=2)
+        two = Choice.objects.create(question=question, choice_text="Two", vote_count=1)
+        Vote.objects.create(user_id=user.id, choice=one)
+        latest = Vote.objects.create(user_id=user.id, choice=two)
+        Vote.objects.create(user_id=other.id, choice=one)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        apps = executor.loader.project_state(self.after).apps
+        Vote = apps.get_model("polls", "Vote")
+        self.assertEqual(
+            set(Vote.objects.values_list("user_id", "choice_id", "question_id")),
+            {(user.id, two.id, question.id), (other.id, one.id, question.id)},
+        )
+        self.assertTrue(Vote.objects.filter(pk=latest.pk).exists())
+        Choice = apps.get_model("polls", "Choice")
+        self.assertEqual(dict(Choice.objects.values_list("id", "vote_count")), {one.id: 1, two.id: 1})
+        self.assertEqual(apps.get_model("polls", "Question").objects.get().vote_count, 2)
+
+
+class ResultsCacheTests(TestCase):
+    """Test suite for the per-question results cache."""
+
+    def setUp(self):
+        """Start from an empty cache with zeroed counters and a question with one choice."""
+        caches["polls"].clear()
+        reset_cache_stats()
+        self.user = User.objects.create_user(username="cached", password="FatChance!")
+        self.question = create_question(question_text="Cached question.", days=-1)
+        self.choice = Choice.objects.create(question=self.question, choice_text="Only")
+
+    def test_second_read_is_a_hit(self):
+        """Reading the same results twice computes them once."""
+        get_results(self.question)
+        with self.assertNumQueries(0):
+            get_results(self.question)
+        self.assertEqual(cache_stats(), {"hits": 1, "misses": 1})
+
+    def test_vote_expires_results(self):
+        """Results read after a vote commits include that vote."""
+        self.assertEqual(get_results(self.question)["total"], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.cast(self.user, self.choice)
+        self.assertEqual(get_results(self.question)["total"], 1)
+
+    def test_deleted_vote_expires_results(self):
+        """Results read after a vote is deleted no longer count it."""
+        Vote.cast(self.user, self.choice)
+        self.assertEqual(get_results(self.question)["total"], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.all().delete()
+        self.assertEqual(get_results(self.question)["total"], 0)
+
+    def test_evicted_version_does_not_serve_old_payload(self):
+        """Losing the version key never brings back a payload cached under an older version."""
+        get_results(self.question)
+        caches["polls"].delete(f"results-version:{self.question.pk}")
+        Vote.cast(self.user, self.choice)
+        self.assertEqual(get_results(self.question)["total"], 1)
+
+
+class VoteBufferTests(TestCase):
+    """Test suite for the write-behind vote buffer."""
+
+    def setUp(self):
+        """Create two users and a question with two choices."""
+        caches["ratelimit"].clear()
+        self.users = [User.objects.create_user(username=f"buffered{n}", password="FatChance!") for n in range(2)]
+        self.question = create_question(question_text="Buffered question.", days=-1)
+        self.choice1 = Choice.objects.create(question=self.question, choice_text="One")
+        self.choice2 = Choice.objects.create(question=self.question, choice_text="Two")
+        journal_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(journal_dir.cleanup)
+        self.journal = os.path.join(journal_dir.name, "votes.journal")
+
+    def test_flush_writes_batches(self):
+        """Queued votes are written on flush, with a user's last vote winning."""
+        buffer = VoteBuffer(batch_size=2)
+        buffer.start(background=False)
+        buffer.submit(self.users[0].id, self.question.id, self.choice1.id)
+        buffer.submit(self.users[1].id, self.question.id, self.choice1.id)
+        buffer.submit(self.users[0].id, self.question.id, self.choice2.id)
+        self.assertEqual(Vote.objects.count(), 0)
+        self.assertEqual(buffer.flush(), 3)
+        self.choice1.refresh_from_db()
+        self.choice2.refresh_from_db()
+        self.assertEqual((self.choice1.votes, self.choice2.votes), (1, 1))
+
+    def test_full_buffer_refuses_votes(self):
+        """A full buffer refuses a vote so the caller can write it directly."""
+        buffer = VoteBuffer(max_size=1)
+        buffer.start(background=False)
+        self.assertTrue(buffer.submit(self.users[0].id, self.question.id, self.choice1.id))
+        self.assertFalse(buffer.submit(self.users[1].id, self.question.id, self.choice1.id))
+
+    def test_journal_is_replayed(self):
+        """Votes journaled but never flushed are written by the next buffer to start."""
+        crashed = VoteBuffer(journal=self.journal)
+        crashed.start(background=False)
+        crashed.submit(self.users[0].id, self.question.id, self.choice2.id)
+        # A crash releases the journal's lock without flushing it.
+        crashed.journal.close()
+
+        buffer = VoteBuffer(journal=self.journal)
+        buffer.start(background=False)
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(Vote.objects.get(user=self.users[0]).choice, self.choice2)
+        self.assertEqual(os.path.getsize(buffer.journal_file), 0)
+
+    def test_each_process_keeps_its_own_journal(self):
+        """A buffer neither shares nor takes over the journal of a running one, only of a stopped one."""
+        running = VoteBuffer(journal=self.journal)
+        running.start(background=False)
+        running.submit(self.users[0].id, self.question.id, self.choice1.id)
+        other = VoteBuffer(journal=self.journal)
+        other.start(background=False)
+        self.assertNotEqual(other.journal_file, running.journal_file)
+        self.assertEqual(other.flush(), 0)
+        other.stop()
+        self.assertFalse(os.path.exists(other.journal_file))
+
+        running.journal.close()
+        other = VoteBuffer(journal=self.journal)
+        other.start(background=False)
+        self.assertEqual(other.flush(), 1)
+        self.assertEqual(Vote.objects.get().choice, self.choice1)
+
+    def test_damaged_journal_line_is_skipped(self):
+        """A line a crash left half written is skipped, and the votes around it are replayed."""
+        with open(f"{self.journal}.1", "w") as journal:
+            journal.write(f"[{self.users[0].id}, {self.question.id}, {self.choice1.id}]\n[{self.users[1].id}, ")
+        buffer = VoteBuffer(journal=self.journal)
+        with self.assertLogs("polls", "ERROR"):
+            buffer.start(background=False)
+        self.assertEqual(buffer.flush(), 1)
+        self.assertFalse(os.path.exists(f"{self.journal}.1"))
+
+    def test_outage_keeps_votes(self):
+        """Votes that cannot be written while the database is unreachable are kept and retried."""
+        buffer = VoteBuffer(journal=self.journal)
+        buffer.start(background=False)
+        buffer.submit(self.users[0].id, self.question.id, self.choice1.id)
+        with mock.patch.object(Vote, "cast_many", side_effect=OperationalError("server closed the connection")):
+            with self.assertLogs("polls", "WARNING"):
+                self.assertEqual(buffer.flush(), 0)
+        self.assertEqual([entry[:3] for entry in buffer.pending], [(self.users[0].id, self.question.id, self.choice1.id)])
+        self.assertGreater(os.path.getsize(buffer.journal_file), 0)
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(Vote.objects.get().choice, self.choice1)
+        self.assertEqual(os.path.getsize(buffer.journal_file), 0)
+
+    def test_written_votes_are_not_replayed(self):
+        """Votes written before a crash are not written again, so they cannot undo later votes."""
+        crashed = VoteBuffer(batch_size=1, journal=self.journal)
+        crashed.start(background=False)
+        crashed.submit(self.users[0].id, self.question.id, self.choice1.id)
+        crashed.submit(self.users[1].id, self.question.id, self.choice1.id)
+        outcomes = [Vote.cast_many, mock.Mock(side_effect=OperationalError("server closed the connection"))]
+        with mock.patch.object(Vote, "cast_many", side_effect=lambda votes: outcomes.pop(0)(votes)):
+            with self.assertLogs("polls", "WARNING"):
+                self.assertEqual(crashed.flush(), 1)
+        Vote.cast(self.users[0], self.choice2)
+        crashed.journal.close()
+
+        buffer = VoteBuffer(journal=self.journal)
+        buffer.start(background=False)
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(Vote.objects.get(user=self.users[0]).choice, self.choice2)
+        self.assertEqual(Vote.objects.get(user=self.users[1]).choice, self.choice1)
+        self.assertEqual(os.path.getsize(buffer.journal_file), 0)
+
+    def test_replayed_votes_keep_their_cast_time(self):
+        """A vote replayed from the journal is recorded at the time it was cast, not when it was written."""
+        cast_at = timezone.now() - datetime.timedelta(hours=3)
+        crashed = VoteBuffer(journal=self.journal)
+        crashed.start(background=False)
+        with mock.patch("polls.buffer.timezone.now", return_value=cast_at):
+            crashed.submit(self.users[0].id, self.question.id, self.choice1.id)
+        crashed.journal.close()
+
+        buffer = VoteBuffer(journal=self.journal)
+        buffer.start(background=False)
+        buffer.flush()
+        vote = Vote.objects.get()
+        self.assertEqual((vote.cast_at, vote.changed_at), (cast_at, cast_at))
+
+    def test_buffered_vote_does_not_undo_a_later_vote(self):
+        """A buffered vote written after the user voted again directly leaves the later vote in place."""
+        buffer = VoteBuffer()
+        buffer.start(background=False)
+        buffer.submit(self.users[0].id, self.question.id, self.choice1.id)
+        Vote.cast(self.users[0], self.choice2)
+        buffer.flush()
+        self.assertEqual(Vote.objects.get().choice, self.choice2)
+        self.choice1.refresh_from_db()
+        self.choice2.refresh_from_db()
+        self.assertEqual((self.choice1.votes, self.choice2.votes), (0, 1))
+
+    def test_large_batch(self):
+        """A full batch of votes by many users on many questions is written in one go."""
+        questions = [create_question(question_text=f"Batch question {n}.", days=-1) for n in range(20)]
+        choices = [Choice.objects.create(question=question, choice_text="Batch") for question in questions]
+        users = User.objects.bulk_create([User(username=f"batch{n}") for n in range(25)])
+        buffer = VoteBuffer(batch_size=500)
+        buffer.start(background=False)
+        for user in users:
+            for question, choice in zip(questions, choices):
+                buffer.submit(user.id, question.id, choice.id)
+        self.assertEqual(buffer.flush(), 500)
+        self.assertEqual(Vote.objects.count(), 500)
+
+    def test_vote_view_uses_buffer(self):
+        """With write-behind enabled the vote view queues the vote instead of writing it."""
+        buffer = VoteBuffer()
+        buffer.start(background=False)
+        self.client.force_login(self.users[0])
+        with mock.patch("polls.views.get_vote_buffer", return_value=buffer):
+            response = self.client.post(reverse("polls:vote", args=(self.question.id,)), {"choice": self.choice1.id})
+        self.assertRedirects(response, reverse("polls:results", args=(self.question.id,)))
+        self.assertEqual(Vote.objects.count(), 0)
+        buffer.flush()
+        self.assertEqual(Vote.objects.get().choice, self.choice1)
+
+
+class ApiTests(TestCase):
+    """Test suite for the read-only JSON API."""
+
+    def setUp(self):
+        """Start from an empty cache and create three published questions."""
+        caches["polls"].clear()
+        self.questions = [create_question(question_text=f"Api question {n}.", days=-n) for n in range(1, 4)]
+        self.choice = Choice.objects.create(question=self.questions[0], choice_text="Yes")
+
+    def get_json(self, url, **params):
+        """Return the decoded JSON body of a GET request."""
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b"".join(response.streaming_content) if response.streaming else response.content)
+
+    def test_question_list_pages(self):
+        """The listing is keyset paginated with a next cursor."""
+        url = reverse("polls:api_questions")
+        page = self.get_json(url, limit=2)
+        self.assertEqual([q["id"] for q in page["questions"]], [q.id for q in self.questions[:2]])
+        page = self.get_json(url, limit=2, after=page["next"])
+        self.assertEqual([q["id"] for q in page["questions"]], [self.questions[2].id])
+        self.assertIsNone(page["next"])
+
+    def test_question_list_export(self):
+        """all=1 streams every published question."""
+        create_question(question_text="Future question.", days=5)
+        data = self.get_json(reverse("polls:api_questions"), all=1)
+        self.assertEqual(len(data["questions"]), 3)
+
+    def test_results(self):
+        """The results endpoint returns the question's tally."""
+        data = self.get_json(reverse("polls:api_results", args=(self.questions[0].id,)))
+        self.assertEqual(data["total"], 0)
+        self.assertEqual(data["choices"][0]["choice_text"], "Yes")
+
+    def test_results_not_modified(self):
+        """A matching If-None-Match gets a 304 without any database query, until a vote changes the results."""
+        url = reverse("polls:api_results", args=(self.questions[0].id,))
+        etag = self.client.get(url)["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        user = User.objects.create_user(username="api", password="FatChance!")
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.cast(user, self.choice)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["total"], 1)
+
+
+@override_settings(POLLS_LIVE_RESULTS=True)
+class ResultsStreamTests(TransactionTestCase):
+    """Test suite for live results over Server-Sent Events on the ASGI application."""
+
+    def setUp(self):
+        """Create a question with two choices and a voter."""
+        caches["polls"].clear()
+        self.addCleanup(broadcaster.__init__)
+        self.question = create_question(question_text="Live question.", days=-1)
+        self.choice1 = Choice.objects.create(question=self.question, choice_text="One")
+        self.choice2 = Choice.objects.create(question=self.question, choice_text="Two")
+        self.user = User.objects.create_user(username="live", password="FatChance!")
+
+    def connect(self, path):
+        """Start an ASGI GET request for path and return its communicator."""
+        communicator = ApplicationCommunicator(application, {
+            "type": "http", "http_version": "1.1", "method": "GET", "scheme": "http",
+            "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+            "headers": [(b"host", b"testserver")], "client": ("127.0.0.1", 1234), "server": ("testserver", 80),
+        })
+        return communicator
+
+    async def disconnect(self, communicator):
+        """Disconnect a client and wait until its subscription has been dropped."""
+        connected = broadcaster.count
+        await communicator.send_input({"type": "http.disconnect"})
+        await communicator.wait(timeout=5)
+        # The cancelled stream closes its subscription on a later turn of the event loop.
+        for _ in range(500):
+            if broadcaster.count < connected:
+                break
+            await asyncio.sleep(0.01)
+
+    async def read_event(self, communicator):
+        """Return the (event, data) pair of the next SSE message."""
+        message = await communicator.receive_output(timeout=5)
+        event, data = message["body"].decode().strip().split("\n")
+        return event.removeprefix("event: "), json.loads(data.removeprefix("data: "))
+
+    def test_one_vote_reaches_many_subscribers(self):
+        """A single vote is loaded once and pushed to every subscriber as a delta."""
+        path = reverse("polls:results_stream", args=(self.question.id,))
+
+        async def scenario():
+            watchers = [self.connect(path) for _ in range(5)]
+            for watcher in watchers:
+                await watcher.send_input({"type": "http.request", "body": b"", "more_body": False})
+                start = await watcher.receive_output(timeout=5)
+                self.assertEqual(start["status"], 200)
+                event, data = await self.read_event(watcher)
+                self.assertEqual((event, data["total"]), ("snapshot", 0))
+            await sync_to_async(Vote.cast)(self.user, self.choice2)
+            for watcher in watchers:
+                event, data = await self.read_event(watcher)
+                self.assertEqual(event, "delta")
+                self.assertEqual(data["total"], 1)
+                self.assertEqual([c["id"] for c in data["choices"]], [self.choice2.id])
+            for watcher in watchers:
+                await self.disconnect(watcher)
+            self.assertEqual(broadcaster.count, 0)
+
+        async_to_sync(scenario)()
+
+    def test_connection_cap(self):
+        """Subscribers beyond the connection cap are turned away with a 503."""
+        path = reverse("polls:results_stream", args=(self.question.id,))
+
+        async def scenario():
+            first, second = self.connect(path), self.connect(path)
+            await first.send_input({"type": "http.request", "body": b"", "more_body": False})
+            self.assertEqual((await first.receive_output(timeout=5))["status"], 200)
+            await second.send_input({"type": "http.request", "body": b"", "more_body": False})
+            self.assertEqual((await second.receive_output(timeout=5))["status"], 503)
+            await self.disconnect(first)
+
+        with override_settings(POLLS_SSE_MAX_CONNECTIONS=1):
+            async_to_sync(scenario)()
+
+    def test_results_page_streams_over_asgi(self):
+        """The results page served over ASGI points the browser at the stream."""
+        url = reverse("polls:results", args=(self.question.id,))
+        response = async_to_sync(self.async_client.get)(url)
+        self.assertContains(response, 'data-stream="%s"' % reverse("polls:results_stream", args=(self.question.id,)))
+
+    def test_not_streamed_over_wsgi(self):
+        """Over WSGI the results page has no stream and the stream answers 204, so clients stop."""
+        response = self.client.get(reverse("polls:results", args=(self.question.id,)))
+        self.assertNotContains(response, "data-stream")
+        response = self.client.get(reverse("polls:results_stream", args=(self.question.id,)))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(broadcaster.count, 0)
+
+    def test_live_results_off(self):
+        """With live results off, even an ASGI request gets a 204 and no subscription."""
+        path = reverse("polls:results_stream", args=(self.question.id,))
+
+        async def scenario():
+            communicator = self.connect(path)
+            await communicator.send_input({"type": "http.request", "body": b"", "more_body": False})
+            self.assertEqual((await communicator.receive_output(timeout=5))["status"], 204)
+            await communicator.wait(timeout=5)
+
+        with override_settings(POLLS_LIVE_RESULTS=False):
+            async_to_sync(scenario)()
+        self.assertEqual(broadcaster.count, 0)
+
+
+class SignupViewTests(TestCase):
+    """Test suite for the signup view."""
+
+    def setUp(self):
+        """Start with empty rate limit buckets."""
+        caches["ratelimit"].clear()
+
+    def test_signup_logs_in(self):
+        """A valid signup creates the user, logs them in and redirects to the index."""
+        form_data = {"username": "newcomer", "password1": "Tr1cky-Pass!", "password2": "Tr1cky-Pass!"}
+        response = self.client.post(reverse("polls:signup"), form_data)
+        self.assertRedirects(response, reverse("polls:index"))
+        self.assertEqual(int(self.client.session["_auth_user_id"]), User.objects.get(username="newcomer").id)
+
+    def test_invalid_signup(self):
+        """An invalid signup shows the form again."""
+        response = self.client.post(reverse("polls:signup"), {"username": "newcomer"})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(User.objects.filter(username="newcomer").exists())
+
+
+def reload_urlconf():
+    """Re-import the URLconfs so they pick up the current POLLS_ASYNC_VIEWS setting."""
+    importlib.reload(sys.modules["polls.urls"])
+    importlib.reload(sys.modules["mysite.urls"])
+    clear_url_caches()
+
+
+class PageCacheTests(TestCase):
+    """Test suite for the page cache of anonymous visitors."""
+
+    def setUp(self):
+        """Start from an empty page cache with a published question and a choice."""
+        caches["polls"].clear()
+        self.question = create_question(question_text="Shared question.", days=-1)
+        self.choice = Choice.objects.create(question=self.question, choice_text="Shared choice")
+        self.user = User.objects.create_user(username="member", password="FatChance!")
+
+    def test_anonymous_pages_served_from_cache(self):
+        """Repeated anonymous requests for the index and results are answered without queries."""
+        for url in (reverse("polls:index"), reverse("polls:results", args=(self.question.id,))):
+            first = self.client.get(url)
+            with self.assertNumQueries(0):
+                second = self.client.get(url)
+            self.assertEqual(second.content, first.content)
+
+    def test_missing_questions_leave_cache_alone(self):
+        """Results pages and API results of made-up question ids store no results version."""
+        for url in (reverse("polls:results", args=(9999,)), reverse("polls:api_results", args=(9999,))):
+            self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertIsNone(caches["polls"].get("results-version:9999"))
+
+    def test_vote_expires_results_page(self):
+        """A counted vote makes the cached results page stale."""
+        url = reverse("polls:results", args=(self.question.id,))
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.cast(self.user, self.choice)
+        response = self.client.get(url)
+        self.assertContains(response, '<th colspan="2" id="total-votes">1</th>', html=True)
+
+    def test_published_question_expires_index(self):
+        """A newly published question appears on the cached index."""
+        self.client.get(reverse("polls:index"))
+        with self.captureOnCommitCallbacks(execute=True):
+            create_question(question_text="Breaking question.", days=0)
+        self.assertContains(self.client.get(reverse("polls:index")), "Breaking question.")
+
+    def test_index_kept_until_next_question_opens(self):
+        """An index page is cached only until the next scheduled question opens."""
+        Question.objects.create(question_text="Soon.", pub_date=timezone.now() + datetime.timedelta(seconds=30))
+        self.assertLessEqual(seconds_until_next_change(), 31)
+
+    def test_index_kept_until_next_question_closes(self):
+        """An index page is cached only until the next open question closes."""
+        Question.objects.create(question_text="Closing.", pub_date=timezone.now() - datetime.timedelta(days=1),
+                                end_date=timezone.now() + datetime.timedelta(seconds=20))
+        self.assertLessEqual(seconds_until_next_change(), 21)
+
+    def test_unread_parameters_share_a_page(self):
+        """Query parameters the views do not read neither miss the cache nor add entries to it."""
+        self.client.get(reverse("polls:index"), {"status": "open"})
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("polls:index"), {"status": "open", "utm_source": "mail", "x": "1"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(page_key(RequestFactory().get("/polls/?x=1&status=open")), "page:/polls/?status=open")
+
+    def test_logged_in_users_bypass_cache(self):
+        """Logged-in users get their own page, not the anonymous copy."""
+        self.client.get(reverse("polls:index"))
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("polls:index"))
+        self.assertContains(response, "Welcome back, member")
+
+    def test_csrf_token_filled_in(self):
+        """A cached page gets the visitor's own CSRF token in place of the placeholder."""
+        request = RequestFactory().get(reverse("polls:index"))
+        caches["polls"].set(page_key(request), ("text/html", f"<i>{CSRF_PLACEHOLDER}</i>".encode()), version="v")
+        content = cached_page(request, "v").content.decode()
+        self.assertNotIn(CSRF_PLACEHOLDER, content)
+        self.assertRegex(content, r"^<i>\w{64}</i>$")
+
+
+class AsyncViewsMixin:
+    """Run a view test case against the async implementations of the views."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Serve the poll pages with the async views for this test case."""
+        super().setUpClass()
+        # Cleanups run last-in first-out, so the setting is restored before the reload.
+        cls.addClassCleanup(reload_urlconf)
+        cls.enterClassContext(override_settings(POLLS_ASYNC_VIEWS=True))
+        reload_urlconf()
+
+    def test_async_views_are_served(self):
+        """The URLconf routes to the async views."""
+        self.assertEqual(resolve(reverse("polls:vote", args=(1,))).func.__module__, "polls.async_views")
+
+
+class AsyncQuestionIndexViewTests(AsyncViewsMixin, QuestionIndexViewTests):
+    """The index view tests, run against the async views."""
+
+
+class AsyncQuestionIndexPaginationTests(AsyncViewsMixin, QuestionIndexPaginationTests):
+    """The index pagination tests, run against the async views."""
+
+
+class AsyncQuestionStatusTests(AsyncViewsMixin, QuestionStatusTests):
+    """The question status tests, run against the async views."""
+
+
+class AsyncQuestionDetailViewTests(AsyncViewsMixin, QuestionDetailViewTests):
+    """The detail view tests, run against the async views."""
+
+
+class AsyncQuestionResultsViewTests(AsyncViewsMixin, QuestionResultsViewTests):
+    """The results view tests, run against the async views."""
+
+
+class AsyncUserAuthTest(AsyncViewsMixin, UserAuthTest):
+    """The authentication and voting tests, run against the async views."""
+
+
+@override_settings(POLLS_RATE_LIMITS={"vote": "2/m", "signup": "2/m"})
+class RateLimitTests(TestCase):
+    """Test suite for the rate limits on voting and signing up."""
+
+    def setUp(self):
+        """Start with empty buckets and create a question with a choice."""
+        caches["ratelimit"].clear()
+        self.question = create_question(question_text="Limited question.", days=-1)
+        self.choice = Choice.objects.create(question=self.question, choice_text="Limited choice")
+
+    def vote(self, client):
+        """Post a vote for the choice with client and return the response."""
+        return client.post(reverse("polls:vote", args=(self.question.id,)), {"choice": self.choice.id})
+
+    def test_signup_limited_per_ip_before_any_work(self):
+        """Signups past the rate get a 429 with Retry-After, without touching the database."""
+        for _ in range(2):
+            self.assertEqual(self.client.post(reverse("polls:signup"), {"username": "flood"}).status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse("polls:signup"), {"username": "flood"})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "30")
+        self.assertEqual(len(queries), 0)
+        other = self.client_class(REMOTE_ADDR="10.0.0.2")
+        self.assertEqual(other.post(reverse("polls:signup"), {"username": "flood"}).status_code, 200)
+
+    def test_signup_form_not_limited(self):
+        """Only posted signups take from the bucket."""
+        for _ in range(3):
+            self.assertEqual(self.client.get(reverse("polls:signup")).status_code, 200)
+
+    def test_vote_limited_per_user(self):
+        """Each user has their own vote bucket, and a refused vote is not counted."""
+        first, second = self.client_class(), self.client_class()
+        first.force_login(User.objects.create_user(username="eager"))
+        second.force_login(User.objects.create_user(username="calm"))
+        self.assertEqual(self.vote(first).status_code, 302)
+        self.assertEqual(self.vote(first).status_code, 302)
+        self.assertEqual(self.vote(first).status_code, 429)
+        self.assertEqual(self.vote(second).status_code, 302)
+        self.assertEqual(Vote.objects.count(), 2)
+
+    def test_limit_off(self):
+        """An empty rate turns a limit off."""
+        with override_settings(POLLS_RATE_LIMITS={"signup": ""}):
+            for _ in range(3):
+                self.assertEqual(self.client.post(reverse("polls:signup"), {"username": "flood"}).status_code, 200)
+
+    def test_bucket_refills(self):
+        """A bucket refills at the rate, up to its size."""
+        rate = parse_rate("2/m")
+        bucket, _ = take(None, rate, 0)
+        bucket, _ = take(bucket, rate, 0)
+        self.assertEqual(take(bucket, rate, 15), (None, 15))
+        self.assertEqual(take(bucket, rate, 30), ((0, 30), 0))
+        self.assertEqual(take(bucket, rate, 3600), ((1, 3600), 0))
+
+    def test_invalid_rate(self):
+        """A malformed rate is reported."""
+        for rate in ("many/m", "5/week"):
+            with self.subTest(rate=rate), self.assertRaises(ValueError):
+                parse_rate(rate)
+
+    def test_client_ip_ignores_spoofed_forwarding(self):
+        """X-Forwarded-For is trusted only as far as the configured proxies wrote it."""
+        request = RequestFactory().get("/", REMOTE_ADDR="10.0.0.9", HTTP_X_FORWARDED_FOR="6.6.6.6, 203.0.113.5")
+        self.assertEqual(get_client_ip(request), "10.0.0.9")
+        with override_settings(POLLS_PROXY_COUNT=1):
+            self.assertEqual(get_client_ip(request), "203.0.113.5")
+        with override_settings(POLLS_PROXY_COUNT=2):
+            self.assertEqual(get_client_ip(request), "6.6.6.6")
+
+
+class AsyncVoteTallyTests(AsyncViewsMixin, VoteTallyTests):
+    """The vote tally tests, run against the async views."""
+
+
+class AsyncVoteCastTests(AsyncViewsMixin, VoteCastTests):
+    """The vote write path tests, run against the async views."""
+
+
+class AsyncSignupViewTests(AsyncViewsMixin, SignupViewTests):
+    """The signup tests, run against the async views."""
+
+
+class AsyncRateLimitTests(AsyncViewsMixin, RateLimitTests):
+    """The rate limit tests, run against the async views."""
+
+
+class AsyncVoteBufferTests(AsyncViewsMixin, TestCase):
+    """Test suite for the vote buffer behind the async vote view."""
+
+    def test_buffer_started_by_async_vote(self):
+        """The first async vote starts the buffer, which takes over and writes an old journal."""
+        user = User.objects.create_user(username="async-buffered")
+        question = create_question(question_text="Async buffered question.", days=-1)
+        choices = [Choice.objects.create(question=question, choice_text=f"Async {n}") for n in range(2)]
+        other = User.objects.create_user(username="async-journaled")
+        journal_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(journal_dir.cleanup)
+        journal = os.path.join(journal_dir.name, "votes.journal")
+        with open(f"{journal}.1", "w") as old:
+            old.write(json.dumps([other.id, question.id, choices[1].id]) + "\n")
+
+        settings = override_settings(POLLS_VOTE_BUFFER_ENABLED=True, POLLS_VOTE_JOURNAL=journal,
+                                     POLLS_VOTE_BUFFER_INTERVAL=3600)
+        with settings, mock.patch("polls.buffer._buffer", None), mock.patch("polls.buffer.atexit.register"):
+            self.client.force_login(user)
+            response = self.client.post(reverse("polls:vote", args=(question.id,)), {"choice": choices[0].id})
+            self.assertRedirects(response, reverse("polls:results", args=(question.id,)))
+            buffer = get_vote_buffer()
+            buffer.stop()
+        self.assertEqual(dict(Vote.objects.values_list("user", "choice")), {user.id: choices[0].id, other.id: choices[1].id})
+
+
+class AsyncPageCacheTests(AsyncViewsMixin, PageCacheTests):
+    """The page cache tests, run against the async views."""
+
+
+class LoadPollsDataTests(TestCase):
+    """Test suite for the load_polls_data management command."""
+
+    def load(self, *files):
+        """Run load_polls_data on files from the data directory and return its output."""
+        out = StringIO()
+        call_command("load_polls_data", *(os.path.join(settings.BASE_DIR, "data", name) for name in files), stdout=out)
+        return out.getvalue()
+
+    def test_loads_fixtures_and_tallies(self):
+        """The current fixtures load with their votes counted."""
+        self.load("polls-v4.json", "users.json", "votes-v4.json")
+        self.assertEqual(Question.objects.count(), 4)
+        self.assertEqual(User.objects.count(), 5)
+        self.assertEqual(Question.objects.get(pk=3).vote_count, 2)
+
+    def test_unchanged_file_is_skipped(self):
+        """Loading the same file again does nothing."""
+        self.load("polls-v4.json")
+        with self.assertNumQueries(1):
+            output = self.load("polls-v4.json")
+        self.assertIn("unchanged, skipped", output)
+
+    def test_older_formats(self):
+        """Older fixture formats load, skipping other apps' objects and filling in vote questions."""
+        output = self.load("polls-v1.json", "users.json", "polls-v3.json")
+        self.assertIn("skipped 71 objects of other models", output)
+        self.assertEqual(set(Vote.objects.values_list("question_id", flat=True)), {3})
+
+
+class ExportVotesTests(TestCase):
+    """Test suite for exporting votes."""
+
+    def setUp(self):
+        """Create two questions with one vote each."""
+        self.user = User.objects.create_superuser(username="auditor", password="FatChance!")
+        self.old = create_question(question_text="Old question.", days=-10)
+        self.new = create_question(question_text="New question.", days=-1)
+        for question in (self.old, self.new):
+            Vote.cast(self.user, Choice.objects.create(question=question, choice_text="Yes"))
+
+    def test_csv_export(self):
+        """The command writes a header and one CSV row per vote."""
+        out = StringIO()
+        call_command("export_votes", stdout=out)
+        rows = list(csv.reader(StringIO(out.getvalue())))
+        self.assertEqual(rows[0][:3], ["vote_id", "user_id", "username"])
+        self.assertEqual(len(rows), 3)
+
+    def test_filtered_gzip_jsonl_export(self):
+        """Filters narrow the export and .gz output is compressed JSON Lines."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "votes.jsonl.gz")
+            call_command("export_votes", "--format", "jsonl", "-o", path,
+                         "--since", (timezone.now() - datetime.timedelta(days=5)).date().isoformat(), stdout=StringIO())
+            with gzip.open(path, "rt") as export:
+                votes = [json.loads(line) for line in export]
+        self.assertEqual([vote["question_id"] for vote in votes], [self.new.id])
+
+    def test_cast_times_exported_and_filtered(self):
+        """Votes carry their cast and change times, and --cast-since/--cast-until select on the cast time."""
+        cast_at = timezone.now() - datetime.timedelta(days=3)
+        Vote.objects.filter(question=self.old).update(cast_at=cast_at, changed_at=cast_at)
+        out = StringIO()
+        call_command("export_votes", "--format", "jsonl", "--cast-until",
+                     (timezone.now() - datetime.timedelta(days=2)).isoformat(), stdout=out)
+        votes = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([vote["question_id"] for vote in votes], [self.old.id])
+        self.assertEqual((votes[0]["cast_at"], votes[0]["changed_at"]), (cast_at.isoformat(), cast_at.isoformat()))
+
+        out = StringIO()
+        call_command("export_votes", "--cast-since", (timezone.now() - datetime.timedelta(days=2)).isoformat(), stdout=out)
+        rows = list(csv.DictReader(StringIO(out.getvalue())))
+        self.assertEqual([int(row["question_id"]) for row in rows], [self.new.id])
+        self.assertTrue(rows[0]["cast_at"])
+
+    def test_admin_action(self):
+        """The question admin action streams the votes of the selected questions."""
+        self.client.force_login(self.user)
+        response = self.client.post(reverse("admin:polls_question_changelist"), {
+            "action": "export_votes_csv", "_selected_action": [self.old.id],
+        })
+        content = b"".join(response.streaming_content).decode()
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertIn("Old question.", content)
+        self.assertNotIn("New question.", content)
+
+
+class BenchmarkTests(TestCase):
+    """Test suite for the benchmark seeding and runner commands."""
+
+    def test_seeded_data_is_consistent(self):
+        """Seeded votes are unique per user and question and match the stored tallies."""
+        call_command("seed_benchmark", "--users", "5", "--questions", "7", "--votes", "30", "--batch-size", "4",
+                     stdout=StringIO())
+        self.assertEqual(Vote.objects.count(), 30)
+        self.assertEqual(Choice.objects.count(), 28)
+        out = StringIO()
+        call_command("reconcile_tallies", "--dry-run", stdout=out)
+        self.assertIn("Found 0 choice tallies and 0 question tallies", out.getvalue())
+
+    def test_too_many_votes(self):
+        """Asking for more votes than users can cast is an error."""
+        with self.assertRaises(CommandError):
+            call_command("seed_benchmark", "--users", "2", "--questions", "2", "--votes", "5", stdout=StringIO())
+
+    def test_run_reports_percentiles(self):
+        """The runner reports latency and queries per request for every kind of request."""
+        call_command("seed_benchmark", "--users", "3", "--questions", "5", "--votes", "10", stdout=StringIO())
+        out = StringIO()
+        call_command("run_benchmark", "--requests", "40", "--warmup", "2", "--clients", "3", stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report["overall"]["requests"], 40)
+        self.assertEqual(report["overall"]["errors"], 0)
+        self.assertEqual(set(report["endpoints"]), {"index", "detail", "results", "vote"})
+        self.assertLessEqual(report["overall"]["p50_ms"], report["overall"]["p99_ms"])
+        self.assertGreater(report["endpoints"]["index"]["queries_mean"], 0)
+
+    def test_db_free_sessions_save_queries(self):
+        """Page views run fewer queries with signed-cookie sessions and the user cache."""
+        call_command("seed_benchmark", "--users", "3", "--questions", "5", "--votes", "10", stdout=StringIO())
+        reports = {}
+        for mode, options in {"db": [], "cookie": ["--session-engine", "signed_cookies",
+                                                   "--user-cache-seconds", "60"]}.items():
+            out = StringIO()
+            call_command("run_benchmark", "--requests", "30", "--warmup", "3", "--clients", "3",
+                         "--mix", "index=1,results=1", *options, stdout=out)
+            reports[mode] = json.loads(out.getvalue())
+        self.assertEqual(reports["cookie"]["overall"]["errors"], 0)
+        # The session and the user each cost a query per request otherwise.
+        saved = reports["db"]["endpoints"]["index"]["queries_mean"] - reports["cookie"]["endpoints"]["index"]["queries_mean"]
+        self.assertEqual(saved, 2)
+
+
+class RequestTimingTests(TestCase):
+    """Test suite for the request timing middleware and the metrics endpoint."""
+
+    def setUp(self):
+        """Create a published question."""
+        caches["polls"].clear()
+        self.question = create_question(question_text="Timed question.", days=-1)
+
+    def server_timing(self, response):
+        """Return the Server-Timing header as a dict of metric name to its parameters."""
+        timings = {}
+        for entry in response["Server-Timing"].split(", "):
+            name, *params = entry.split(";")
+            timings[name] = dict(param.split("=", 1) for param in params)
+        return timings
+
+    def test_server_timing_header(self):
+        """Responses report their query count and DB, render and total time."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("polls:index"))
+        timings = self.server_timing(response)
+        self.assertEqual(timings["db"]["desc"], f'"{len(queries)} queries"')
+        self.assertGreater(float(timings["render"]["dur"]), 0)
+        self.assertGreaterEqual(float(timings["total"]["dur"]), float(timings["db"]["dur"]))
+
+    def test_async_request_queries_are_counted(self):
+        """Queries an async view runs through the async ORM are counted too."""
+        with override_settings(POLLS_ASYNC_VIEWS=True):
+            reload_urlconf()
+            self.addCleanup(reload_urlconf)
+            response = async_to_sync(self.async_client.get)(reverse("polls:results", args=(self.question.id,)))
+        self.assertNotEqual(self.server_timing(response)["db"]["desc"], '"0 queries"')
+
+    def test_metrics_endpoint(self):
+        """Finished requests show up in the Prometheus histograms."""
+        self.client.get(reverse("polls:results", args=(self.question.id,)))
+        body = self.client.get(reverse("metrics")).content.decode()
+        self.assertIn("# TYPE polls_request_duration_seconds histogram", body)
+        self.assertRegex(body, r'polls_request_queries_count\{view="polls:results"\} [1-9]')
+        self.assertIn('polls_request_duration_seconds_bucket{view="polls:results",le="+Inf"}', body)
+
+    def test_metrics_only_for_allowed_ips(self):
+        """Clients outside POLLS_METRICS_ALLOWED_IPS cannot scrape the metrics."""
+        response = self.client.get(reverse("metrics"), REMOTE_ADDR="203.0.113.7")
+        self.assertEqual(response.status_code, 404)
+        with override_settings(POLLS_METRICS_ALLOWED_IPS=["203.0.113.7"]):
+            response = self.client.get(reverse("metrics"), REMOTE_ADDR="203.0.113.7")
+        self.assertEqual(response.status_code, 200)
+
+    def test_unknown_methods_share_a_label(self):
+        """Made-up request methods are counted under a single "other" method."""
+        for method in ("BREW", "WHEN"):
+            self.client.generic(method, reverse("polls:index"))
+        body = self.client.get(reverse("metrics")).content.decode()
+        self.assertIn('view="polls:index",method="other"', body)
+        self.assertNotIn("BREW", body)
+
+    @override_settings(POLLS_SLOW_REQUEST_MS=1)
+    def test_slow_request_is_logged(self):
+        """Requests over the threshold are logged with their timing."""
+        with self.assertLogs("polls.requests", "WARNING") as logs:
+            with mock.patch("polls.middleware.time.perf_counter", side_effect=[0.0, 2.0]):
+                self.client.get(reverse("metrics"))
+        self.assertIn("Slow request: GET /metrics took 2000 ms", logs.output[0])
+
+
+@override_settings(POLLS_DATABASE_REPLICAS=["replica1"])
+class ReplicaRouterTests(SimpleTestCase):
+    """Test suite for routing poll reads to read replicas."""
+
+    def setUp(self):
+        """Create a router."""
+        self.router = ReplicaRouter()
+
+    def test_poll_reads_go_to_replica(self):
+        """Poll data is read from a replica while users stay on the primary."""
+        self.assertEqual(self.router.db_for_read(Question), "replica1")
+        self.assertIsNone(self.router.db_for_read(User))
+
+    def test_pinned_request_reads_primary(self):
+        """A request that wrote reads its own writes from the primary."""
+        state = RoutingState()
+        token = routing_state.set(state)
+        self.addCleanup(routing_state.reset, token)
+        self.assertEqual(self.router.db_for_read(Question), "replica1")
+        self.assertIsNone(self.router.db_for_write(Vote))
+        self.assertTrue(state.wrote)
+        self.assertEqual(self.router.db_for_read(Question), "default")
+
+    @override_settings(POLLS_DATABASE_REPLICAS=[])
+    def test_no_replicas(self):
+        """Without replicas every read uses the primary."""
+        self.assertIsNone(self.router.db_for_read(Question))
+
+
+class ReadYourWritesTests(TestCase):
+    """Test suite for keeping a client on the primary after it writes."""
+
+    def setUp(self):
+        """Create a question with a choice and log a voter in."""
+        caches["ratelimit"].clear()
+        self.question = create_question(question_text="Replicated question.", days=-1)
+        self.choice = Choice.objects.create(question=self.question, choice_text="Yes")
+        self.client.force_login(User.objects.create_user(username="writer", password="FatChance!"))
+
+    @override_settings(POLLS_DATABASE_REPLICAS=["replica1"], POLLS_READ_YOUR_WRITES_SECONDS=7)
+    def test_vote_pins_client_to_primary(self):
+        """Voting sets a short-lived cookie that sends the client's reads to the primary."""
+        self.assertNotIn(PRIMARY_COOKIE, self.client.get(reverse("polls:index")).cookies)
+        response = self.client.post(reverse("polls:vote", args=(self.question.id,)), {"choice": self.choice.id})
+        self.assertEqual(response.cookies[PRIMARY_COOKIE]["max-age"], 7)
+
+    def test_no_cookie_without_replicas(self):
+        """Without replicas there is nothing to pin."""
+        response = self.client.post(reverse("polls:vote", args=(self.question.id,)), {"choice": self.choice.id})
+        self.assertNotIn(PRIMARY_COOKIE, response.cookies)
+
+
+class StaticAssetsTests(TestCase):
+    """Test suite for the hashed, pre-compressed static assets."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Collect the static files once into a temporary STATIC_ROOT."""
+        super().setUpClass()
+        static_root = cls.enterClassContext(tempfile.TemporaryDirectory())
+        cls.enterClassContext(override_settings(STATIC_ROOT=static_root))
+        call_command("collectstatic", interactive=False, verbosity=0)
+        with open(os.path.join(static_root, "staticfiles.json")) as manifest:
+            cls.hashed = json.load(manifest)["paths"]
+
+    def test_pages_link_shared_assets(self):
+        """Poll pages carry no inline styles or scripts and link the hashed assets."""
+        create_question(question_text="Styled question.", days=-1)
+        content = self.client.get(reverse("polls:index")).content.decode()
+        self.assertNotIn("<style>", content)
+        self.assertNotIn("<script>", content)
+        self.assertIn(self.hashed["polls/style.css"], content)
+        self.assertIn(self.hashed["polls/polls.js"], content)
+
+    def test_hashed_asset_is_compressed_and_immutable(self):
+        """A hashed asset is served pre-compressed with a year-long immutable lifetime."""
+        url = f"/{settings.STATIC_URL.strip('/')}/{self.hashed['polls/style.css']}"
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip, deflate, br")
+        body = b"".join(response.streaming_content)
+        self.assertEqual(response["Content-Type"], "text/css")
+        self.assertIn(response["Content-Encoding"], ("br", "gzip"))
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertIn("Accept-Encoding", response["Vary"])
+        if response["Content-Encoding"] == "gzip":
+            body = gzip.decompress(body)
+        else:
+            body = brotli.decompress(body)
+        self.assertIn(b"background.", body)
+
+    def test_plain_request_for_unhashed_name(self):
+        """Without Accept-Encoding the file itself is sent, and an unhashed name is only cached briefly."""
+        response = self.client.get(f"/{settings.STATIC_URL.strip('/')}/polls/polls.js")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertNotIn("immutable", response["Cache-Control"])
+
+
+@override_settings(SESSION_ENGINE="django.contrib.sessions.backends.signed_cookies", POLLS_USER_CACHE_SECONDS=60)
+class CachedUserTests(TestCase):
+    """Test suite for the per-process cache of logged-in users."""
+
+    def setUp(self):
+        """Log in a user with an empty user cache."""
+        clear_user_cache()
+        self.addCleanup(clear_user_cache)
+        self.user = User.objects.create_user(username="cached", password="secret-pass-123")
+        self.client.login(username="cached", password="secret-pass-123")
+        self.question = create_question(question_text="Cached user question.", days=-1)
+
+    def test_page_view_needs_no_auth_queries(self):
+        """Once the user is cached, a page view queries neither sessions nor users."""
+        self.client.get(reverse("polls:index"))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("polls:detail", args=(self.question.id,)))
+        self.assertContains(response, "Welcome back, cached!")
+        tables = " ".join(query["sql"] for query in queries)
+        self.assertNotIn("django_session", tables)
+        self.assertNotIn("auth_user", tables)
+
+    def test_password_change_ends_cached_session(self):
+        """Changing the password drops the cached user, so the old session is no longer accepted."""
+        self.client.get(reverse("polls:index"))
+        self.user.set_password("another-pass-456")
+        self.user.save()
+        response = self.client.get(reverse("polls:index"))
+        self.assertFalse(response.wsgi_request.user.is_authenticated)
+
+    def test_logout_forgets_user(self):
+        """Logging out drops the user from the cache."""
+        self.client.get(reverse("polls:index"))
+        self.assertIn(self.user.pk, auth._users)
+        self.client.post(reverse("logout"))
+        self.assertNotIn(self.user.pk, auth._users)
+
+    def test_sessions_from_before_the_cache_stay_logged_in(self):
+        """Sessions logged in with the plain ModelBackend are still accepted."""
+        self.client.force_login(self.user, backend="django.contrib.auth.backends.ModelBackend")
+        response = self.client.get(reverse("polls:index"))
+        self.assertTrue(response.wsgi_request.user.is_authenticated)
+
+
+class BlockedStream(StringIO):
+    """A stream whose writes wait until it is released, like a stalled log collector."""
+
+    def __init__(self):
+        """Start out blocked."""
+        super().__init__()
+        self.released = threading.Event()
+
+    def write(self, text):
+        """Wait for the release, then write text."""
+        self.released.wait(5)
+        return super().write(text)
+
+
+class LoggingTests(TestCase):
+    """Test suite for the queued, structured logging."""
+
+    def make_logger(self, handler):
+        """Return a logger writing only to handler."""
+        logger = logging.getLogger(f"polls.tests.{self._testMethodName}")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        return logger
+
+    def test_json_record(self):
+        """Records are written as JSON with their extra fields and exception."""
+        try:
+            raise ValueError("broken")
+        except ValueError:
+            record = logging.getLogger("polls").makeRecord(
+                "polls", logging.ERROR, __file__, 1, "Failed %d times", (3,), sys.exc_info(),
+                extra={"event": "vote", "question_id": 7},
+            )
+        data = json.loads(JsonFormatter().format(record))
+        self.assertEqual(data["message"], "Failed 3 times")
+        self.assertEqual(data["level"], "ERROR")
+        self.assertEqual((data["event"], data["question_id"]), ("vote", 7))
+        self.assertIn("ValueError: broken", data["exception"])
+        self.assertNotIn("args", data)
+
+    def test_sampling_keeps_warnings(self):
+        """A zero sample rate drops info records but keeps warnings."""
+        sample = SampleFilter(rate=0)
+        self.assertFalse(sample.filter(logging.makeLogRecord({"levelno": logging.INFO})))
+        self.assertTrue(sample.filter(logging.makeLogRecord({"levelno": logging.WARNING})))
+
+    def test_slow_stream_does_not_block(self):
+        """Logging returns at once while the stream is stalled, and closing writes every record."""
+        stream = BlockedStream()
+        handler = QueueHandler(stream=stream)
+        handler.setFormatter(JsonFormatter())
+        logger = self.make_logger(handler)
+        for n in range(5):
+            logger.info("Record %d", n)
+        self.assertEqual(stream.getvalue(), "")
+        stream.released.set()
+        handler.close()
+        messages = [json.loads(line)["message"] for line in stream.getvalue().splitlines()]
+        self.assertEqual(messages, [f"Record {n}" for n in range(5)])
+
+    def test_full_queue_drops_records(self):
+        """Records that do not fit in the queue are dropped and reported on close."""
+        stream = BlockedStream()
+        handler = QueueHandler(stream=stream, maxsize=1)
+        logger = self.make_logger(handler)
+        for n in range(5):
+            logger.info("Record %d", n)
+        self.assertGreaterEqual(handler.dropped, 3)
+        stream.released.set()
+        handler.close()
+        self.assertIn(f"{handler.dropped} log records were dropped", stream.getvalue())
+
+    def test_vote_logged_with_fields(self):
+        """A vote is logged as a vote event carrying its ids."""
+        user = User.objects.create_user(username="logged", password="FatChance!")
+        question = create_question(question_text="Logged question.", days=-1)
+        choice = Choice.objects.create(question=question, choice_text="Logged choice")
+        self.client.force_login(user)
+        with self.assertLogs("polls.votes", "INFO") as logs:
+            self.client.post(reverse("polls:vote", args=(question.id,)), {"choice": choice.id})
+        record = logs.records[0]
+        self.assertEqual(record.event, "vote")
+        self.assertEqual((record.user_id, record.question_id, record.choice_id), (user.pk, question.pk, choice.pk))
+        self.assertEqual(record.getMessage(), 'User logged voted for "Logged choice" for question "Logged question.".')
+
+
+class VoteRollupTests(TestCase):
+    """Test suite for vote timestamps and the incremental turnout rollups."""
+
+    def setUp(self):
+        """Create a question with two choices and three voters, with times from the start of an hour."""
+        self.question = create_question(question_text="Turnout question.", days=-1)
+        self.first = Choice.objects.create(question=self.question, choice_text="First")
+        self.second = Choice.objects.create(question=self.question, choice_text="Second")
+        self.users = [User.objects.create_user(username=f"turnout{n}") for n in range(3)]
+        self.hour = timezone.localtime().replace(minute=0, second=0, microsecond=0) - datetime.timedelta(hours=3)
+
+    def cast(self, user, choice, minutes):
+        """Cast a vote and stamp it with a time that many minutes after self.hour."""
+        previous = Vote.cast(user, choice)
+        at = self.hour + datetime.timedelta(minutes=minutes)
+        votes = Vote.objects.filter(user=user, question=self.question)
+        if previous is None:
+            votes.update(cast_at=at, changed_at=at)
+        else:
+            votes.update(changed_at=at)
+
+    def rollups(self, granularity):
+        """Return {(choice_id, minutes after self.hour): (cast, changed)} of a granularity."""
+        return {
+            (row.choice_id, int((row.bucket - self.hour).total_seconds() // 60)): (row.cast_count, row.change_count)
+            for row in VoteRollup.objects.filter(granularity=granularity)
+        }
+
+    def test_cast_and_change_times(self):
+        """A vote records when it was cast, and a change moves only its changed time."""
+        Vote.cast(self.users[0], self.first)
+        vote = Vote.objects.get()
+        self.assertEqual(vote.cast_at, vote.changed_at)
+        Vote.cast(self.users[0], self.second)
+        changed = Vote.objects.get()
+        self.assertEqual(changed.cast_at, vote.cast_at)
+        self.assertGreater(changed.changed_at, vote.changed_at)
+        Vote.cast_many([(self.users[0].pk, self.question.pk, self.first.pk)])
+        self.assertGreater(Vote.objects.get().changed_at, changed.changed_at)
+
+    def test_incremental_rollup(self):
+        """Each run counts only the votes cast or changed since the previous one."""
+        self.cast(self.users[0], self.first, 5)
+        self.cast(self.users[1], self.first, 5)
+        self.cast(self.users[2], self.second, 70)
+        result = roll_up_votes(until=self.hour + datetime.timedelta(minutes=30))
+        self.assertEqual((result["votes"], result["changes"]), (2, 0))
+        self.assertEqual(self.rollups(VoteRollup.MINUTE), {(self.first.pk, 5): (2, 0)})
+
+        self.cast(self.users[1], self.second, 80)
+        result = roll_up_votes(until=self.hour + datetime.timedelta(minutes=90))
+        self.assertEqual((result["votes"], result["changes"]), (1, 1))
+        self.assertEqual(self.rollups(VoteRollup.HOUR), {
+            (self.first.pk, 0): (2, 0), (self.second.pk, 60): (1, 1),
+        })
+        self.assertEqual(roll_up_votes(until=self.hour + datetime.timedelta(minutes=90))["votes"], 0)
+
+    def test_vote_changed_across_a_run(self):
+        """A vote cast before a run and changed after it is counted once as cast and once as changed."""
+        self.cast(self.users[0], self.first, 5)
+        self.cast(self.users[0], self.second, 20)
+        roll_up_votes(until=self.hour + datetime.timedelta(minutes=10))
+        result = roll_up_votes(until=self.hour + datetime.timedelta(minutes=30))
+        self.assertEqual((result["votes"], result["changes"]), (0, 1))
+        self.assertEqual(self.rollups(VoteRollup.MINUTE), {(self.second.pk, 5): (1, 0), (self.second.pk, 20): (0, 1)})
+        rebuild_rollups(until=self.hour + datetime.timedelta(minutes=30))
+        self.assertEqual(self.rollups(VoteRollup.MINUTE), {(self.second.pk, 5): (1, 0), (self.second.pk, 20): (0, 1)})
+
+    def test_votes_from_before_cast_times(self):
+        """Votes without a cast time count only their changes, from the first run on."""
+        self.cast(self.users[0], self.first, 5)
+        self.cast(self.users[0], self.second, 20)
+        self.cast(self.users[1], self.first, 25)
+        Vote.objects.update(cast_at=None)
+        result = rebuild_rollups(until=self.hour + datetime.timedelta(minutes=30))
+        self.assertEqual((result["votes"], result["changes"]), (0, 2))
+
+    def test_rebuild_matches_incremental(self):
+        """Rebuilding from scratch gives the same rollups as counting run by run."""
+        for n, user in enumerate(self.users):
+            self.cast(user, self.first, n * 40)
+            roll_up_votes(until=self.hour + datetime.timedelta(minutes=n * 40 + 1))
+        incremental = {granularity: self.rollups(granularity) for granularity in VoteRollup.GRANULARITIES}
+        rebuild_rollups(until=self.hour + datetime.timedelta(minutes=81))
+        for granularity in VoteRollup.GRANULARITIES:
+            self.assertEqual(self.rollups(granularity), incremental[granularity])
+
+    def test_recent_votes_wait_to_settle(self):
+        """Votes newer than the settle time are left for a later run."""
+        Vote.cast(self.users[0], self.first)
+        out = StringIO()
+        call_command("rollup_votes", stdout=out)
+        self.assertIn("Rolled up 0 votes", out.getvalue())
+        with override_settings(POLLS_ROLLUP_SETTLE_SECONDS=0):
+            call_command("rollup_votes", stdout=out)
+        self.assertIn("Rolled up 1 votes", out.getvalue())
+
+    def test_turnout_endpoint_reads_rollups(self):
+        """The turnout endpoint answers from the rollups without reading any votes."""
+        self.cast(self.users[0], self.first, 5)
+        self.cast(self.users[1], self.second, 6)
+        roll_up_votes(until=self.hour + datetime.timedelta(minutes=10))
+        url = reverse("polls:api_turnout", args=(self.question.id,))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {"granularity": "hour"})
+        self.assertFalse(any("polls_vote\"" in query["sql"] for query in queries))
+        data = response.json()
+        self.assertEqual(len(data["buckets"]), 1)
+        self.assertEqual(data["buckets"][0]["votes"], 2)
+        self.assertEqual(data["buckets"][0]["choices"], {str(self.first.pk): 1, str(self.second.pk): 1})
+        self.assertEqual(self.client.get(url, {"granularity": "week"}).status_code, 400)
+
+
+class AdminTests(TestCase):
+    """Test suite for the admin pages of the polls models."""
+
+    def setUp(self):
+        """Log in a superuser and create a question with two choices."""
+        self.admin = User.objects.create_superuser(username="boss", password="FatChance!")
+        self.client.force_login(self.admin)
+        self.question = create_question(question_text="Admin question.", days=-1)
+        self.choices = [Choice.objects.create(question=self.question, choice_text=f"Admin choice {n}") for n in range(2)]
+
+    def add_votes(self, count):
+        """Add count votes by new users on a new question."""
+        question = create_question(question_text=f"Busy question {Question.objects.count()}.", days=-1)
+        choice = Choice.objects.create(question=question, choice_text="Busy choice")
+        offset = User.objects.count()
+        for n in range(count):
+            Vote.cast(User.objects.create_user(username=f"busy{offset + n}"), choice)
+
+    def count_queries(self, url):
+        """Return how many queries a GET of url runs."""
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+    def test_changelists_use_fixed_queries(self):
+        """The vote, choice and question lists run as many queries for many rows as for few."""
+        for name in ("vote", "choice", "question"):
+            with self.subTest(changelist=name):
+                url = reverse(f"admin:polls_{name}_changelist")
+                self.add_votes(2)
+                few = self.count_queries(url)
+                self.add_votes(10)
+                self.assertEqual(self.count_queries(url), few)
+
+    def test_vote_form_lists_no_users_or_choices(self):
+        """The vote form picks users and choices without listing every one of them."""
+        self.add_votes(5)
+        content = self.client.get(reverse("admin:polls_vote_add")).content.decode()
+        self.assertNotIn("busy1", content)
+        self.assertNotIn("Admin choice 0", content)
+
+    def test_vote_added_in_admin_updates_tallies(self):
+        """Votes added or changed in the admin are counted in the stored tallies."""
+        voter = User.objects.create_user(username="admin-voter")
+        self.client.post(reverse("admin:polls_vote_add"), {"user": voter.pk, "choice": self.choices[0].pk})
+        vote = Vote.objects.get(user=voter)
+        self.client.post(reverse("admin:polls_vote_change", args=(vote.pk,)), {"choice": self.choices[1].pk})
+        self.assertEqual([Choice.objects.get(pk=choice.pk).votes for choice in self.choices], [0, 1])
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.vote_count, 1)
+
+    def test_vote_cannot_move_to_another_question(self):
+        """A vote cannot be changed to a choice of another question in the admin."""
+        Vote.cast(self.admin, self.choices[0])
+        vote = Vote.objects.get()
+        other = Choice.objects.create(question=create_question("Other question.", days=-1), choice_text="Other")
+        response = self.client.post(reverse("admin:polls_vote_change", args=(vote.pk,)), {"choice": other.pk})
+        self.assertContains(response, "another choice of its question")
+        self.assertEqual(Vote.objects.get().choice, self.choices[0])
+
+    def test_status_filter(self):
+        """The question list filters by status in the database."""
+        create_question(question_text="Future admin question.", days=5)
+        response = self.client.get(reverse("admin:polls_question_changelist"), {"status": "upcoming"})
+        self.assertContains(response, "Future admin question.")
+        self.assertNotContains(response, "Admin question.")
+
+    def test_big_table_count_is_estimated(self):
+        """Unfiltered lists of big tables take their count from the table statistics."""
+        self.add_votes(2)
+        with mock.patch("polls.admin.estimated_count", return_value=EXACT_COUNT_LIMIT * 10) as estimate:
+            response = self.client.get(reverse("admin:polls_vote_changelist"))
+            self.assertEqual(response.context["cl"].result_count, EXACT_COUNT_LIMIT * 10)
+            estimate.assert_called_once()
+            response = self.client.get(reverse("admin:polls_vote_changelist"), {"q": "busy"})
+            self.assertEqual(response.context["cl"].result_count, 2)
+
+
+class BallotTests(TestCase):
+    """Test suite for voting on many questions with one ballot."""
+
+    def setUp(self):
+        """Log a voter in and create open, closed and upcoming questions with two choices each."""
+        caches["polls"].clear()
+        caches["ratelimit"].clear()
+        caches["idempotency"].clear()
+        self.user = User.objects.create_user(username="ballot-voter")
+        self.client.force_login(self.user)
+        self.questions = [create_question(question_text=f"Ballot question {n}.", days=-1) for n in range(6)]
+        self.closed = Question.objects.create(question_text="Closed ballot question.",
+                                              pub_date=timezone.now() - datetime.timedelta(days=5),
+                                              end_date=timezone.now() - datetime.timedelta(days=1))
+        self.upcoming = create_question(question_text="Upcoming ballot question.", days=5)
+        self.choices = {
+            question.pk: [Choice.objects.create(question=question, choice_text=f"Answer {n}") for n in range(2)]
+            for question in [*self.questions, self.closed, self.upcoming]
+        }
+
+    def cast(self, votes, key=None):
+        """Post a ballot of (question, choice) pairs and return the response."""
+        body = json.dumps({"votes": [{"question": question.pk, "choice": choice.pk} for question, choice in votes]})
+        headers = {"Idempotency-Key": key} if key else {}
+        return self.client.post(reverse("polls:api_ballot"), body, content_type="application/json", headers=headers)
+
+    def answer(self, question, n=0):
+        """Return the (question, choice) pair answering question with its nth choice."""
+        return question, self.choices[question.pk][n]
+
+    def statuses(self, response):
+        """Return the status of each vote in a ballot response."""
+        self.assertEqual(response.status_code, 200)
+        return [result["status"] for result in response.json()["results"]]
+
+    def test_ballot_reports_each_vote(self):
+        """Open questions are voted on, and the others reported without stopping the ballot."""
+        other = self.choices[self.questions[1].pk][0]
+        response = self.cast([
+            self.answer(self.questions[0]), self.answer(self.closed),
+            self.answer(self.upcoming), (self.questions[2], other),
+        ])
+        self.assertEqual(self.statuses(response), ["recorded", "closed", "invalid", "invalid"])
+        self.assertEqual(list(Vote.objects.values_list("choice", flat=True)), [self.choices[self.questions[0].pk][0].pk])
+        self.assertEqual(Choice.objects.get(pk=self.choices[self.questions[0].pk][0].pk).votes, 1)
+        self.assertEqual(Question.objects.get(pk=self.questions[0].pk).vote_count, 1)
+
+    def test_changed_and_unchanged_votes(self):
+        """A second ballot changes votes and moves the tallies to the new choices."""
+        self.cast([self.answer(self.questions[0]), self.answer(self.questions[1])])
+        response = self.cast([self.answer(self.questions[0]), self.answer(self.questions[1], 1)])
+        self.assertEqual(self.statuses(response), ["unchanged", "changed"])
+        self.assertEqual(response.json()["results"][1]["previous"], self.choices[self.questions[1].pk][0].pk)
+        self.assertEqual([choice.votes for choice in Choice.objects.filter(question=self.questions[1])], [0, 1])
+        self.assertEqual(Question.objects.get(pk=self.questions[1].pk).vote_count, 1)
+
+    def test_queries_do_not_grow_with_ballot(self):
+        """A ballot runs as many queries for four questions as for two."""
+        with CaptureQueriesContext(connection) as small:
+            self.cast([self.answer(question) for question in self.questions[:2]])
+        with CaptureQueriesContext(connection) as large:
+            self.cast([self.answer(question) for question in self.questions[2:]])
+        self.assertEqual(len(large), len(small))
+
+    def test_retry_with_idempotency_key(self):
+        """A retried ballot gets the stored response without touching the polls tables."""
+        votes = [self.answer(question) for question in self.questions[:3]]
+        first = self.cast(votes, key="retry-1")
+        with CaptureQueriesContext(connection) as queries:
+            retry = self.cast(votes, key="retry-1")
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertFalse([query for query in queries if "polls_" in query["sql"]])
+        self.assertEqual(self.cast(votes[:1], key="retry-1").status_code, 422)
+
+    def test_idempotency_survives_results_cache_eviction(self):
+        """Idempotency records are kept apart from results and pages, so clearing those does not lose them."""
+        votes = [self.answer(self.questions[0])]
+        self.cast(votes, key="retry-2")
+        caches["polls"].clear()
+        retry = self.cast(votes, key="retry-2")
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+
+    def test_bad_ballots(self):
+        """Malformed or oversized ballots are rejected as a whole."""
+        url = reverse("polls:api_ballot")
+        for body in ("not json", "[]", '{"votes": [1]}', '{"votes": [{"question": "1", "choice": 2}]}'):
+            with self.subTest(body=body):
+                self.assertEqual(self.client.post(url, body, content_type="application/json").status_code, 400)
+        with override_settings(POLLS_BALLOT_MAX_QUESTIONS=1):
+            self.assertEqual(self.cast([self.answer(question) for question in self.questions[:2]]).status_code, 400)
+        self.assertFalse(Vote.objects.exists())
+
+    def test_anonymous_ballot(self):
+        """Visitors who are not logged in cannot cast a ballot."""
+        self.client.logout()
+        self.assertEqual(self.cast([self.answer(self.questions[0])]).status_code, 401)
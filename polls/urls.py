@@ -1,13 +1,32 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import api, async_views, views
+from .pagecache import cache_anonymous_page, index_version, results_page_version, seconds_until_next_change
+from .ratelimit import rate_limit
 
+# The async views keep ASGI workers free while they wait on the database.
+poll_views = async_views if settings.POLLS_ASYNC_VIEWS else views
 
 app_name = "polls"
 urlpatterns = [
-    path("", views.IndexView.as_view(), name="index"),
-    path("<int:pk>/", views.DetailView.as_view(), name="detail"),
-    path("<int:pk>/results/", views.ResultsView.as_view(), name="results"),
-    path("<int:question_id>/vote/", views.vote, name="vote"),
-    path('signup/', views.signup, name='signup'),
+    path(
+        "",
+        cache_anonymous_page(index_version, expires=seconds_until_next_change)(poll_views.IndexView.as_view()),
+        name="index",
+    ),
+    path("<int:pk>/", poll_views.DetailView.as_view(), name="detail"),
+    path(
+        "<int:pk>/results/",
+        cache_anonymous_page(results_page_version)(poll_views.ResultsView.as_view()),
+        name="results",
+    ),
+    path("<int:pk>/results/stream/", views.results_stream, name="results_stream"),
+    path("<int:question_id>/vote/", rate_limit("vote", per_user=True)(poll_views.vote), name="vote"),
+    path('signup/', rate_limit("signup")(poll_views.signup), name='signup'),
+    path("api/questions/", api.question_list, name="api_questions"),
+    path("api/questions/<int:pk>/results/", api.question_results, name="api_results"),
+    path("api/questions/<int:pk>/turnout/", api.question_turnout, name="api_turnout"),
+    # A ballot takes one token from the voter's bucket however many questions it answers.
+    path("api/ballot/", rate_limit("vote", per_user=True)(api.cast_ballot), name="api_ballot"),
 ]
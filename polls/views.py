@@ -1,29 +1,95 @@
+import json
 import logging
+from datetime import datetime
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login
-from django.http import HttpResponseRedirect, Http404
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import OuterRef, Q, Subquery
+from django.http import HttpResponse, HttpResponseRedirect, Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render, redirect
+from django.template.response import TemplateResponse
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
 from django.views import generic
 
+from .broadcast import TooManySubscribers, broadcaster
+from .buffer import get_vote_buffer
+from .cache import get_results
 from .models import Choice, Question, Vote
 
 
-logger = logging.getLogger('polls')
+# One record per vote, sampled by POLLS_VOTE_LOG_SAMPLE_RATE
+vote_logger = logging.getLogger('polls.votes')
+
+
+# Values of the index's ``status`` parameter and the QuestionQuerySet method each one applies.
+STATUS_FILTERS = {"open": "open", "closing": "closing_soon", "closed": "closed"}
 
 
 class IndexView(generic.ListView):
-    """View for displaying a list of the most recent questions."""
+    """View for displaying a page of the most recent questions."""
 
     template_name = "polls/index.html"
     context_object_name = "latest_question_list"
 
     def get_queryset(self):
-        """Return the last five published questions (not including those set to be published in the future)."""
-        return Question.objects.filter(pub_date__lte=timezone.now()).order_by("-pub_date")
+        """
+        Return one page of published questions, newest first.
+
+        Pages are found with a keyset cursor on (pub_date, id) taken from the
+        ``after`` or ``before`` query parameter, so deep pages cost the same as
+        the first one. The ``status`` query parameter limits the page to open,
+        closing or closed questions, and each question's status is annotated
+        by the database.
+        """
+        return self.finish_page(list(self.get_page_queryset()))
+
+    def get_page_queryset(self):
+        """Return the queryset of the requested page, plus one row to tell whether another page follows."""
+        page_size = settings.POLLS_INDEX_PAGE_SIZE
+        now = timezone.now()
+        self.status_filter = self.request.GET.get("status")
+        if self.status_filter not in STATUS_FILTERS:
+            self.status_filter = None
+        questions = Question.objects.with_status(now)
+        questions = getattr(questions, STATUS_FILTERS.get(self.status_filter, "published"))(now)
+        self.after = decode_cursor(self.request.GET.get("after"))
+        self.before = decode_cursor(self.request.GET.get("before"))
+
+        if self.before:
+            pub_date, pk = self.before
+            return (
+                questions.filter(Q(pub_date__gt=pub_date) | Q(pub_date=pub_date, pk__gt=pk))
+                .order_by("pub_date", "pk")[:page_size + 1]
+            )
+        if self.after:
+            pub_date, pk = self.after
+            questions = questions.filter(Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, pk__lt=pk))
+        return questions.order_by("-pub_date", "-pk")[:page_size + 1]
+
+    def finish_page(self, page):
+        """Trim the rows fetched by get_page_queryset() to a page, newest first, and note its neighbours."""
+        page_size = settings.POLLS_INDEX_PAGE_SIZE
+        if self.before:
+            self.has_previous = len(page) > page_size
+            self.has_next = True
+            return page[:page_size][::-1]
+        self.has_previous = self.after is not None
+        self.has_next = len(page) > page_size
+        return page[:page_size]
+
+    def get_context_data(self, **kwargs):
+        """Add the cursors of the next and previous pages to the context."""
+        context = super().get_context_data(**kwargs)
+        page = self.object_list
+        context["next_cursor"] = encode_cursor(page[-1]) if page and self.has_next else None
+        context["previous_cursor"] = encode_cursor(page[0]) if page and self.has_previous else None
+        context["status_filter"] = self.status_filter
+        return context
 
 
 class DetailView(generic.DetailView):
@@ -33,33 +99,36 @@ class DetailView(generic.DetailView):
     template_name = "polls/detail.html"
 
     def get_queryset(self):
-        """Excludes any questions that aren't published yet."""
-        return Question.objects.filter(pub_date__lte=timezone.now())
+        """
+        Exclude any questions that aren't published yet.
+
+        The choices are prefetched and, for an authenticated user, the id of
+        the choice they voted for is annotated as ``selected_choice``, so the
+        whole page is built from the question query and one choice query.
+        """
+        questions = Question.objects.published().with_status().prefetch_related("choice_set")
+        if self.request.user.is_authenticated:
+            user_vote = Vote.objects.filter(question=OuterRef("pk"), user=self.request.user)
+            questions = questions.annotate(selected_choice=Subquery(user_vote.values("choice_id")[:1]))
+        return questions
 
     def get_context_data(self, **kwargs):
         """Add the user's vote to the context if authenticated."""
         context = super().get_context_data(**kwargs)
-        question = self.get_object()
-
-        if self.request.user.is_authenticated:
-            try:
-                vote = Vote.objects.get(user=self.request.user, choice__question=question)
-                context['selected_choice'] = vote.choice.id
-            except Vote.DoesNotExist:
-                context['selected_choice'] = None
-
+        context['selected_choice'] = getattr(self.object, "selected_choice", None)
         return context
 
     def get(self, request, *args, **kwargs):
-        """Redirect to the index page if the question is from the future or does not exist."""
+        """Redirect to the index page if the question is from the future, closed or does not exist."""
         try:
-            question = self.get_object()
-            if question.pub_date > timezone.now() or not question.can_vote():
-                return HttpResponseRedirect(reverse('polls:index'))
+            self.object = self.get_object()
         except Http404:
             return HttpResponseRedirect(reverse('polls:index'))
+        if self.object.status != Question.OPEN:
+            return HttpResponseRedirect(reverse('polls:index'))
 
-        return super().get(request, *args, **kwargs)
+        context = self.get_context_data(object=self.object)
+        return self.render_to_response(context)
 
 
 class ResultsView(generic.DetailView):
@@ -68,6 +137,55 @@ class ResultsView(generic.DetailView):
     model = Question
     template_name = "polls/results.html"
 
+    def get_context_data(self, **kwargs):
+        """Add the question's tally, computed in one query or read from the cache, to the context."""
+        context = super().get_context_data(**kwargs)
+        context["results"] = get_results(self.object)
+        context["live_results"] = live_results(self.request)
+        return context
+
+
+def live_results(request):
+    """
+    Return whether results can be streamed live to a request.
+
+    Streams hold their connection open, which only an ASGI server can afford,
+    so POLLS_LIVE_RESULTS must be on and the request must have come over ASGI.
+    """
+    return settings.POLLS_LIVE_RESULTS and isinstance(request, ASGIRequest)
+
+
+async def results_stream(request, pk):
+    """Stream live results of a published question as Server-Sent Events."""
+    if not live_results(request):
+        # A 204 tells EventSource clients to stop reconnecting.
+        return HttpResponse(status=204)
+    if not await Question.objects.filter(pk=pk, pub_date__lte=timezone.now()).aexists():
+        raise Http404("No such question.")
+    try:
+        subscription = await broadcaster.subscribe(pk)
+    except TooManySubscribers:
+        return HttpResponse("Too many live results connections.", status=503, headers={"Retry-After": "30"})
+
+    async def events():
+        try:
+            while True:
+                event = await subscription.next_event(timeout=settings.POLLS_SSE_KEEPALIVE)
+                if event is None:
+                    # A comment line keeps proxies from closing an idle stream.
+                    yield ": keepalive\n\n"
+                else:
+                    name, data = event
+                    yield f"event: {name}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            subscription.close()
+
+    return StreamingHttpResponse(
+        events(),
+        content_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 
 def signup(request):
     """Handle user signups and log the user in upon successful registration."""
@@ -75,7 +193,8 @@ def signup(request):
         form = UserCreationForm(request.POST)
         if form.is_valid():
             user = form.save()
-            login(request, user)
+            # Several backends are configured, so new users log in with the first one.
+            login(request, user, backend=settings.AUTHENTICATION_BACKENDS[0])
             return redirect('polls:index')
     else:
         form = UserCreationForm()
@@ -85,46 +204,74 @@ def signup(request):
 @login_required
 def vote(request, question_id):
     """Handle voting for a choice on a question."""
-    question = get_object_or_404(Question, pk=question_id)
+    try:
+        # The choice and its question are fetched together in one query.
+        selected_choice = Choice.objects.select_related("question").get(
+            pk=request.POST["choice"], question_id=question_id
+        )
+    except (KeyError, ValueError, Choice.DoesNotExist):
+        question = get_object_or_404(Question, pk=question_id)
+        if not question.can_vote():
+            return HttpResponseRedirect(reverse("polls:index"))
+        return no_choice_response(request, question)
 
+    question = selected_choice.question
     if not question.can_vote():
         return HttpResponseRedirect(reverse("polls:index"))
 
-    try:
-        selected_choice = question.choice_set.get(pk=request.POST["choice"])
-    except (KeyError, Choice.DoesNotExist):
-        return render(
-            request,
-            "polls/detail.html",
-            {
-                "question": question,
-                "error_message": "You didn't select a choice.",
-            },
-        )
+    buffer = get_vote_buffer()
+    if buffer and buffer.submit(request.user.id, question.id, selected_choice.id):
+        announce_vote(request, request.user, selected_choice, buffered=True)
+    else:
+        previous = Vote.cast(request.user, selected_choice)
+        announce_vote(request, request.user, selected_choice, previous)
 
-    this_user = request.user
+    return HttpResponseRedirect(reverse("polls:results", args=(question.id,)))
 
-    try:
-        vote = Vote.objects.get(user=this_user, choice__question=question)
-        vote.choice = selected_choice
-        vote.save()
-        messages.success(request, f"Your vote was updated to '{selected_choice.choice_text}'")
-        logger.info(f'User {this_user.username} updated their vote to "{selected_choice.choice_text}" '
-                    f'for question "{question.question_text}".')
-    except Vote.DoesNotExist:
-        vote = Vote.objects.create(user=this_user, choice=selected_choice)
-        messages.success(request, f"You voted for '{selected_choice.choice_text}'")
-        logger.info(f'User {this_user.username} voted for "{selected_choice.choice_text}" '
-                    f'for question "{question.question_text}".')
 
-    return HttpResponseRedirect(reverse("polls:results", args=(question.id,)))
+def no_choice_response(request, question):
+    """Return the detail page with an error for a vote without a valid choice."""
+    return TemplateResponse(
+        request,
+        "polls/detail.html",
+        {
+            "question": question,
+            "error_message": "You didn't select a choice.",
+        },
+    )
 
 
-def get_client_ip(request):
-    """Get the visitor’s IP address using request headers."""
-    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    if x_forwarded_for:
-        ip = x_forwarded_for.split(',')[0]
+def announce_vote(request, user, choice, previous=None, buffered=False):
+    """Tell the user their vote was recorded and log it."""
+    question = choice.question
+    event = {"user_id": user.pk, "question_id": question.pk, "choice_id": choice.pk, "buffered": buffered}
+    if buffered:
+        messages.success(request, f"Your vote for '{choice.choice_text}' was recorded")
+        vote_logger.info('User %s voted for "%s" for question "%s" (buffered).',
+                         user.username, choice.choice_text, question.question_text, extra={"event": "vote", **event})
+    elif previous is None:
+        messages.success(request, f"You voted for '{choice.choice_text}'")
+        vote_logger.info('User %s voted for "%s" for question "%s".',
+                         user.username, choice.choice_text, question.question_text, extra={"event": "vote", **event})
     else:
-        ip = request.META.get('REMOTE_ADDR')
-    return ip
+        messages.success(request, f"Your vote was updated to '{choice.choice_text}'")
+        vote_logger.info('User %s updated their vote to "%s" for question "%s".',
+                         user.username, choice.choice_text, question.question_text,
+                         extra={"event": "vote_changed", **event})
+
+
+def encode_cursor(question):
+    """Return an opaque page cursor pointing at question."""
+    raw = f"{question.pub_date.isoformat()}|{question.pk}"
+    return urlsafe_base64_encode(raw.encode())
+
+
+def decode_cursor(cursor):
+    """Return the (pub_date, id) pair of a page cursor, or None if it is missing or invalid."""
+    if not cursor:
+        return None
+    try:
+        pub_date, pk = urlsafe_base64_decode(cursor).decode().split("|")
+        return datetime.fromisoformat(pub_date), int(pk)
+    except ValueError:
+        return None